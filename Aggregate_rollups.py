@@ -0,0 +1,327 @@
+import argparse
+import json
+import os
+import time
+from decimal import Decimal
+from Aws_clients import get_client, get_table
+from Chat_store import CHAT_SESSIONS_TABLE, LEGACY_TABLE, items_from_block
+from Rollups import (ROLLUPS_TABLE, STATE_MEMBER, TOTAL_MEMBER, apply_event, event_from_item, leaderboard_key,
+                     leaderboard_rank, merge_deltas, new_session_state, session_key, summarize)
+from Telemetry import info, metric, traced
+
+# Maintains the rollups described in Rollups.py from the chat history streams (StreamViewType
+# NEW_AND_OLD_IMAGES, batch size up to 25) of both layouts in Chat_store.py. For ChatHistory,
+# inserts are counted, and so are modifications that replace a row with a different turn (two
+# turns written in the same second share a timestamp, so the second one overwrites the first).
+# For the compact blocks, the turns appended by each write are counted; blocks written back by
+# an archive import are not. In both layouts, a turn saved unscored while the model was
+# unavailable is scored (but not counted again) when a later turn rescores it.
+#
+# Each batch is grouped by session. A session's events are applied to its stored aggregation
+# state, and the new state is written in the same TransactWriteItems call as the counter
+# increments, on the condition that the state has not changed since it was read. A record
+# delivered twice is therefore skipped instead of counted twice, and a retried batch cannot
+# double count the sessions that were already committed.
+#
+# Local replay: `python Aggregate_rollups.py replay records.json` applies saved stream
+# records (a Lambda event or a JSON list of records), and `python Aggregate_rollups.py
+# backfill` replays every stored turn of both layouts. Add --dry-run to aggregate in memory and
+# print the rollups without writing anything. `python Aggregate_rollups.py rank` sets the
+# leaderboard_rank of leaderboard rows written before it was maintained.
+
+USER_TEAMS_TABLE = os.environ.get('USER_TEAMS_TABLE', 'UserTeams')
+DEFAULT_TEAM = os.environ.get('DEFAULT_TEAM', 'unassigned')
+# Session states are kept this long after a session's last turn
+SESSION_STATE_TTL_SECONDS = int(os.environ.get('SESSION_STATE_TTL_SECONDS', str(30 * 24 * 3600)))
+# DynamoDB's limit on the items of one transaction
+MAX_TRANSACT_ITEMS = 100
+# Sequence numbers available to the turns of one stream record
+SEQUENCE_SLOTS = 1000
+
+_teams = {}
+
+@traced("Aggregate_rollups")
+def lambda_handler(event, context):
+    records = event.get('Records', [])
+    events = [e for record in records for e in events_from_stream_record(record)]
+    # Raising makes Lambda retry the batch; sessions that were already committed are skipped
+    result = aggregate(events, DynamoRollupStore())
+    info(f"Rollup aggregation result: {result}")
+    metric("stream_records", len(records))
+    metric("duplicates", result["duplicates"])
+    return result
+
+# Convert a chat history stream record into the events of the turns it adds
+def events_from_stream_record(record):
+    if record.get('eventName') not in ('INSERT', 'MODIFY'):
+        return []
+    new_image = record['dynamodb']['NewImage']
+    old_image = record['dynamodb'].get('OldImage')
+    sequence = record['dynamodb'].get('SequenceNumber')
+    # Turns added by one record get consecutive sequence numbers of their own
+    sequence = int(sequence) * SEQUENCE_SLOTS if sequence else None
+    if f'/{CHAT_SESSIONS_TABLE}/' in record.get('eventSourceARN', ''):
+        block = _deserialize(new_image)
+        if block.get('restored') and 'restored' not in (old_image or {}):
+            # Written back by an archive import; its turns were counted when first written
+            return []
+        known = len(old_image.get('turns', {}).get('L', [])) if old_image else 0
+        items = items_from_block(block)
+        rescored = []
+        if old_image:
+            # Turns saved while the model was unavailable and scored by a later turn
+            rescored = [item for old, item in zip(items_from_block(_deserialize(old_image)), items[:known])
+                        if old.get('sentiment_pending') and not item.get('sentiment_pending')]
+        events = [event_from_item(item, rescore=True) for item in rescored] + [event_from_item(item) for item in items[known:]]
+        for index, event in enumerate(events[:SEQUENCE_SLOTS]):
+            event['sequence'] = None if sequence is None else sequence + index
+        return events[:SEQUENCE_SLOTS]
+    if '/ChatHistory/' not in record.get('eventSourceARN', '/ChatHistory/'):
+        return []
+    if record['eventName'] == 'MODIFY' and old_image is not None and all(
+            new_image.get(name) == old_image.get(name) for name in ('user_input', 'ai_response')):
+        if 'sentiment_pending' in old_image and 'sentiment_pending' not in new_image:
+            return [event_from_item(_deserialize(new_image), sequence, rescore=True)]
+        # The same turn rewritten, e.g. a scoring backfill
+        return []
+    return [event_from_item(_deserialize(new_image), sequence)]
+
+# Apply events to the store. Sessions whose state changed underneath (a concurrent or
+# replayed batch) are re-read and applied once more. team_of(user_id) assigns new sessions
+# to a team.
+def aggregate(events, store, team_of=None):
+    team_of = team_of or get_team
+    by_session = {}
+    # Stream events in stream order (a rescored turn comes after the turns saved since), stored
+    # rows replayed by a backfill in time order
+    for event in sorted(events, key=lambda e: (e['session_id'], e['sequence'] or 0, e['timestamp'])):
+        by_session.setdefault(event['session_id'], []).append(event)
+
+    result = {"events": len(events), "sessions": len(by_session), "duplicates": 0, "conflicts": 0, "transactions": 0}
+    pending = set(by_session)
+    for _ in range(2):
+        states = store.load_states(sorted(pending))
+        changes = []
+        for session_id in sorted(pending):
+            previous = states.get(session_id)
+            state = previous
+            deltas = {}
+            for event in by_session[session_id]:
+                if state is None:
+                    state = new_session_state(event, team_of(event['user_id']) if event['user_id'] else DEFAULT_TEAM)
+                state, event_deltas = apply_event(state, event)
+                state['version'] = (previous or {}).get('version', 0) + 1
+                if event_deltas is None:
+                    result["duplicates"] += 1
+                else:
+                    merge_deltas(deltas, event_deltas)
+            if deltas:
+                changes.append((session_id, previous, state, deltas))
+        conflicted = store.commit(changes)
+        result["transactions"] += store.transactions
+        if not conflicted:
+            return result
+        result["conflicts"] += len(conflicted)
+        pending = set(conflicted)
+    raise RuntimeError(f"Session states kept changing during aggregation: {sorted(pending)}")
+
+# Team of a trainee from the UserTeams table (UserId -> TeamId), cached for the container
+def get_team(user_id):
+    if user_id not in _teams:
+        item = get_table(USER_TEAMS_TABLE).get_item(Key={'UserId': user_id}, ProjectionExpression='TeamId').get('Item')
+        _teams[user_id] = item['TeamId'] if item and item.get('TeamId') else DEFAULT_TEAM
+    return _teams[user_id]
+
+# Rollups stored in ROLLUPS_TABLE
+class DynamoRollupStore:
+    def __init__(self):
+        self.transactions = 0
+
+    def load_states(self, session_ids):
+        states = {}
+        for start in range(0, len(session_ids), 100):
+            keys = [{'RollupKey': {'S': session_key(session_id)}, 'Member': {'S': STATE_MEMBER}} for session_id in session_ids[start:start + 100]]
+            request = {ROLLUPS_TABLE: {'Keys': keys, 'ConsistentRead': True}}
+            while request:
+                response = get_client('dynamodb').batch_get_item(RequestItems=request)
+                for item in map(_deserialize, response.get('Responses', {}).get(ROLLUPS_TABLE, [])):
+                    session_id = item['RollupKey'][len(session_key('')):]
+                    states[session_id] = {k: _plain(v) for k, v in item.items() if k not in ('RollupKey', 'Member', 'expires_at')}
+                request = response.get('UnprocessedKeys') or {}
+        return states
+
+    # Write the changes in as few transactions as fit; returns the sessions whose condition failed
+    def commit(self, changes):
+        self.transactions = 0
+        conflicted = []
+        batch, batch_deltas = [], {}
+        for change in changes:
+            merged_keys = set(batch_deltas) | set(change[3])
+            if batch and len(batch) + 1 + len(merged_keys) > MAX_TRANSACT_ITEMS:
+                conflicted += self._write(batch, batch_deltas)
+                batch, batch_deltas = [], {}
+            batch.append(change)
+            merge_deltas(batch_deltas, change[3])
+        if batch:
+            conflicted += self._write(batch, batch_deltas)
+        return conflicted
+
+    def _write(self, batch, deltas):
+        from boto3.dynamodb.types import TypeSerializer
+        serializer = TypeSerializer()
+        now = int(time.time())
+        items = []
+        for session_id, previous, state, _ in batch:
+            put = {
+                'TableName': ROLLUPS_TABLE,
+                'Item': {k: serializer.serialize(v) for k, v in dict(state, RollupKey=session_key(session_id), Member=STATE_MEMBER,
+                                                                        expires_at=now + SESSION_STATE_TTL_SECONDS).items()}
+            }
+            if previous is None:
+                put['ConditionExpression'] = 'attribute_not_exists(RollupKey)'
+            else:
+                put['ConditionExpression'] = 'version = :previous'
+                put['ExpressionAttributeValues'] = {':previous': serializer.serialize(previous['version'])}
+            items.append({'Put': put})
+        for (rollup_key, member), values in deltas.items():
+            names = {f'#a{index}': attribute for index, attribute in enumerate(values)}
+            update_values = {f':v{index}': serializer.serialize(Decimal(amount)) for index, amount in enumerate(values.values())}
+            update_values[':now'] = serializer.serialize(now)
+            items.append({'Update': {
+                'TableName': ROLLUPS_TABLE,
+                'Key': {'RollupKey': {'S': rollup_key}, 'Member': {'S': member}},
+                'UpdateExpression': 'SET updated_at = :now ADD ' + ', '.join(f'#a{index} :v{index}' for index in range(len(values))),
+                'ExpressionAttributeNames': names,
+                'ExpressionAttributeValues': update_values
+            }})
+        client = get_client('dynamodb')
+        try:
+            client.transact_write_items(TransactItems=items)
+        except client.exceptions.TransactionCanceledException:
+            # One of the states changed since it was read; nothing in this transaction was applied
+            return [session_id for session_id, _, _, _ in batch]
+        finally:
+            self.transactions += 1
+        return []
+
+# Rollups kept in memory, for dry runs and tests
+class MemoryRollupStore:
+    def __init__(self):
+        self.states = {}
+        self.rollups = {}
+        self.transactions = 0
+
+    def load_states(self, session_ids):
+        return {session_id: dict(self.states[session_id]) for session_id in session_ids if session_id in self.states}
+
+    def commit(self, changes):
+        for session_id, _, state, deltas in changes:
+            self.states[session_id] = state
+            merge_deltas(self.rollups, deltas)
+        self.transactions = 1 if changes else 0
+        return []
+
+    def report(self):
+        report = {}
+        for (rollup_key, member), values in sorted(self.rollups.items()):
+            report[f"{rollup_key}/{member}"] = summarize(values) if member == TOTAL_MEMBER else values
+        return report
+
+def _deserialize(item):
+    from boto3.dynamodb.types import TypeDeserializer
+    deserializer = TypeDeserializer()
+    return {k: deserializer.deserialize(v) for k, v in item.items()}
+
+def _plain(value):
+    return int(value) if isinstance(value, Decimal) else value
+
+# Read saved stream records: a Lambda event ({"Records": [...]}) or a list of records
+def load_records(path):
+    with open(path) as handle:
+        data = json.load(handle)
+    return data.get('Records', []) if isinstance(data, dict) else data
+
+# Replay every stored turn of both chat history layouts, one scan page at a time
+def backfill(store, team_of=None):
+    totals = {"events": 0, "duplicates": 0, "conflicts": 0}
+    for table_name, to_items in ((LEGACY_TABLE, lambda item: [item]), (CHAT_SESSIONS_TABLE, items_from_block)):
+        scan_kwargs = {}
+        while True:
+            response = get_table(table_name).scan(**scan_kwargs)
+            items = [chat_item for item in response.get('Items', []) for chat_item in to_items(item)]
+            result = aggregate([event_from_item(item) for item in items], store, team_of)
+            for key in totals:
+                totals[key] += result[key]
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return totals
+
+# Set leaderboard_rank on every leaderboard row from its counters. Each write is conditioned on
+# the counters it was computed from, and a row updated meanwhile by the stream is read again,
+# so this can run while the aggregation is live.
+def rank_leaderboards(dry_run=False):
+    from boto3.dynamodb.conditions import Attr
+    table = get_table(ROLLUPS_TABLE)
+    totals = {"rows": 0, "ranked": 0, "retries": 0}
+    scan_kwargs = {'FilterExpression': Attr('RollupKey').begins_with(leaderboard_key(''))}
+    while True:
+        response = table.scan(**scan_kwargs)
+        for row in response.get('Items', []):
+            totals["rows"] += 1
+            key = {'RollupKey': row['RollupKey'], 'Member': row['Member']}
+            while True:
+                rank = leaderboard_rank(int(row.get('levels_passed', 0)), int(row.get('turns', 0)))
+                if row.get('leaderboard_rank') == rank:
+                    break
+                if dry_run:
+                    totals["ranked"] += 1
+                    break
+                conditions, values = [], {':rank': rank}
+                for attribute in ('levels_passed', 'turns'):
+                    if attribute in row:
+                        conditions.append(f'{attribute} = :{attribute}')
+                        values[f':{attribute}'] = row[attribute]
+                    else:
+                        conditions.append(f'attribute_not_exists({attribute})')
+                try:
+                    table.update_item(Key=key, UpdateExpression='SET leaderboard_rank = :rank',
+                                      ConditionExpression=' AND '.join(conditions), ExpressionAttributeValues=values)
+                    totals["ranked"] += 1
+                    break
+                except table.meta.client.exceptions.ConditionalCheckFailedException:
+                    totals["retries"] += 1
+                    row = table.get_item(Key=key, ConsistentRead=True).get('Item', key)
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return totals
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay chat history turns into the leaderboard and analytics rollups.")
+    parser.add_argument("mode", choices=["replay", "backfill", "rank"],
+                        help="replay saved stream records, backfill from the chat history tables, or rank existing leaderboard rows")
+    parser.add_argument("records", nargs="?", help="JSON file of stream records (replay mode)")
+    parser.add_argument("--dry-run", action="store_true", help="Aggregate in memory and print the rollups without writing them")
+    parser.add_argument("--teams", help="JSON file mapping UserId to TeamId, used instead of the UserTeams table")
+    args = parser.parse_args()
+    store = MemoryRollupStore() if args.dry_run else DynamoRollupStore()
+    team_of = None
+    if args.teams or args.dry_run:
+        teams = {}
+        if args.teams:
+            with open(args.teams) as handle:
+                teams = json.load(handle)
+        team_of = lambda user_id: teams.get(user_id, DEFAULT_TEAM)
+    if args.mode == "rank":
+        result = rank_leaderboards(args.dry_run)
+    elif args.mode == "replay":
+        if not args.records:
+            parser.error("replay needs a records file")
+        events = [e for record in load_records(args.records) for e in events_from_stream_record(record)]
+        result = aggregate(events, store, team_of)
+    else:
+        result = backfill(store, team_of)
+    print(json.dumps(result, indent=2))
+    if args.dry_run and args.mode != "rank":
+        print(json.dumps(store.report(), indent=2, default=str))
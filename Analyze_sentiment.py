@@ -1,15 +1,36 @@
-import boto3
 import json
 import re
-
-# Initialize AWS services
-dynamodb = boto3.resource('dynamodb')
-sagemaker_runtime = boto3.client('sagemaker-runtime')
+from Model_gateway import generate
+from Model_guard import ModelUnavailable, model_stats
+from Sentiment_cache import cache_stats, get_cached, put_cached
+from Sentiment_classifier import CLASSIFIER_MIN_CONFIDENCE, classifier_analysis, score_batch
+from Sentiment_rules import fast_path_analysis
+from Telemetry import error, metric, set_property, timed, traced, warning
 
 # Define the SageMaker endpoint
 ENDPOINT_NAME = 'sagemaker-endpoint-name'  # Replace with your actual endpoint name
 
+# Scoring rubric shared with the combined generation mode in ContinueConversation
+ASSESSMENT_INSTRUCTIONS = (
+    "1. Provide a **Conviction Score** between 0 and 100, indicating the likelihood that the customer intends to purchase. Use these ranges:\n"
+    "   - 0-30: Minimal interest\n"
+    "   - 31-60: Mild interest with questions\n"
+    "   - 61-80: High interest, enthusiasm shown\n"
+    "   - 81-100: Very high interest, close to purchase\n"
+    "2. Provide the **Mood** as Positive, Neutral, Skeptical, or Negative, based on the customer's tone.\n"
+    "3. Set **Convinced Status** to True only if the customer explicitly signals readiness to buy.\n"
+)
+ASSESSMENT_FORMAT = (
+    "Conviction Score: <value>\n"
+    "Mood: <mood>\n"
+    "Convinced: <True/False>\n"
+)
+
+@traced("Analyze_sentiment")
 def lambda_handler(event, context):
+    if "ai_responses" in event:
+        return analyze_batch(event["ai_responses"])
+
     ai_response = event.get("ai_response", "")
     session_id = event.get("session_id", "")
 
@@ -19,22 +40,107 @@ def lambda_handler(event, context):
             "body": "Error: 'ai_response' and 'session_id' are required."
         }
 
+    try:
+        analysis = analyze_response(ai_response)
+        set_property("sentiment_cache", cache_stats())
+        set_property("model_guard", model_stats())
+        return {
+            "statusCode": 200,
+            "body": json.dumps({
+                "ai_response": ai_response,
+                "conviction_score": analysis["conviction_score"],
+                "mood": analysis["mood"],
+                "convinced": analysis["convinced"]
+            })
+        }
+    except ModelUnavailable as e:
+        # The endpoint is saturated or failing; tell the caller to defer scoring instead of retrying
+        warning(f"Sentiment scoring deferred: {e}")
+        set_property("model_guard", model_stats())
+        return {
+            "statusCode": 503,
+            "body": json.dumps({"error": str(e), "reason": e.reason, "sentiment_deferred": True})
+        }
+    except Exception as e:
+        error(f"Error processing sentiment analysis: {e}")
+        return {
+            "statusCode": 500,
+            "body": f"Error processing sentiment analysis: {str(e)}"
+        }
+
+# Score a list of customer responses for a backfill: {"ai_responses": [...]} returns one
+# analysis per reply in order. The replies the rules leave open are scored by the classifier
+# in one pass, and only those it is unsure about are scored one by one like a single reply.
+def analyze_batch(ai_responses):
+    if not isinstance(ai_responses, list) or not all(isinstance(text, str) and text for text in ai_responses):
+        return {
+            "statusCode": 400,
+            "body": "Error: 'ai_responses' must be a list of non-empty strings."
+        }
+    try:
+        analyses = timed("sentiment_rules", lambda: [fast_path_analysis(ai_response) for ai_response in ai_responses])
+        pending = [index for index, analysis in enumerate(analyses) if analysis is None]
+        predictions = timed("sentiment_classifier", score_batch, [ai_responses[index] for index in pending]) or [None] * len(pending)
+        classified = 0
+        for index, prediction in zip(pending, predictions):
+            if prediction is not None and prediction["confidence"] >= CLASSIFIER_MIN_CONFIDENCE:
+                analyses[index] = {k: v for k, v in prediction.items() if k != "confidence"}
+                classified += 1
+            else:
+                analyses[index] = analyze_response(ai_responses[index])
+        metric("classifier_scored", classified)
+        set_property("sentiment_cache", cache_stats())
+        set_property("model_guard", model_stats())
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"analyses": analyses})
+        }
+    except ModelUnavailable as e:
+        warning(f"Sentiment scoring deferred: {e}")
+        set_property("model_guard", model_stats())
+        return {
+            "statusCode": 503,
+            "body": json.dumps({"error": str(e), "reason": e.reason, "sentiment_deferred": True})
+        }
+    except Exception as e:
+        error(f"Error processing sentiment analysis: {e}")
+        return {
+            "statusCode": 500,
+            "body": f"Error processing sentiment analysis: {str(e)}"
+        }
+
+# Score a customer response. Kept separate from the handler so ContinueConversation can run
+# the assessment in-process instead of invoking this Lambda. Obvious replies are answered by
+# the rule-based fast path, then the classifier (when a model is configured), repeated
+# replies by the sentiment cache, and only the rest reach the SageMaker endpoint.
+def analyze_response(ai_response):
+    analysis = timed("sentiment_rules", fast_path_analysis, ai_response)
+    if analysis is not None:
+        set_property("sentiment_source", "rules")
+        return analysis
+    analysis = timed("sentiment_classifier", classifier_analysis, ai_response)
+    if analysis is not None:
+        set_property("sentiment_source", "classifier")
+        return analysis
+    analysis = timed("sentiment_cache_read", get_cached, ai_response)
+    if analysis is not None:
+        set_property("sentiment_source", "cache")
+        return analysis
+    analysis = timed("sentiment_model", analyze_with_model, ai_response)
+    timed("sentiment_cache_write", put_cached, ai_response, analysis)
+    set_property("sentiment_source", "model")
+    return analysis
+
+# Score a customer response with the SageMaker endpoint
+def analyze_with_model(ai_response):
     # Construct a refined prompt with detailed instructions before the "Assistant:" label
     prompt_message = (
         f"System: You are an AI assistant responsible for analyzing a customer's response and evaluating their interest level in a product.\n\n"
         f"Instructions:\n"
-        f"1. Provide a **Conviction Score** between 0 and 100, indicating the likelihood that the customer intends to purchase. Use these ranges:\n"
-        f"   - 0-30: Minimal interest\n"
-        f"   - 31-60: Mild interest with questions\n"
-        f"   - 61-80: High interest, enthusiasm shown\n"
-        f"   - 81-100: Very high interest, close to purchase\n"
-        f"2. Provide the **Mood** as Positive, Neutral, Skeptical, or Negative, based on the customer's tone.\n"
-        f"3. Set **Convinced Status** to True only if the customer explicitly signals readiness to buy.\n\n"
+        f"{ASSESSMENT_INSTRUCTIONS}\n"
         f"Response Structure:\n"
         f"The response should be formatted exactly as follows:\n"
-        f"Conviction Score: <value>\n"
-        f"Mood: <mood>\n"
-        f"Convinced: <True/False>\n\n"
+        f"{ASSESSMENT_FORMAT}\n"
         f"Customer Response:\n\"{ai_response}\"\n\n"
         f"Assistant:"
     )
@@ -49,39 +155,23 @@ def lambda_handler(event, context):
         }
     }
 
-    try:
-        # Invoke the SageMaker endpoint
-        response = sagemaker_runtime.invoke_endpoint(
-            EndpointName=ENDPOINT_NAME,
-            ContentType="application/json",
-            Body=json.dumps(payload)
-        )
-        response_body = response['Body'].read().decode('utf-8')
-        response_payload = json.loads(response_body)
-        analysis_result = response_payload[0].get('generated_text', '') if isinstance(response_payload, list) else response_payload.get('generated_text', '')
+    # Invoke the SageMaker endpoint through the shared (optionally batching) gateway
+    analysis_result = generate(ENDPOINT_NAME, payload)
+    return parse_analysis(analysis_result)
 
-        # Attempt to extract conviction score, mood, and convinced status from the response
-        conviction_score_match = re.search(r"conviction score: (\d+)", analysis_result, re.IGNORECASE)
-        conviction_score = int(conviction_score_match.group(1)) if conviction_score_match else 15  # Default to minimal interest
+# Extract conviction score, mood, and convinced status from generated text
+def parse_analysis(analysis_result):
+    conviction_score_match = re.search(r"conviction score: (\d+)", analysis_result, re.IGNORECASE)
+    conviction_score = int(conviction_score_match.group(1)) if conviction_score_match else 15  # Default to minimal interest
 
-        mood_match = re.search(r"mood: (positive|neutral|skeptical|negative)", analysis_result, re.IGNORECASE)
-        mood = mood_match.group(1).capitalize() if mood_match else "Neutral"
-        
-        convinced_match = re.search(r"convinced: (true|false)", analysis_result, re.IGNORECASE)
-        convinced = convinced_match.group(1).lower() == "true" if convinced_match else conviction_score >= 81
+    mood_match = re.search(r"mood: (positive|neutral|skeptical|negative)", analysis_result, re.IGNORECASE)
+    mood = mood_match.group(1).capitalize() if mood_match else "Neutral"
 
-        return {
-            "statusCode": 200,
-            "body": json.dumps({
-                "ai_response": ai_response,
-                "conviction_score": conviction_score,
-                "mood": mood,
-                "convinced": convinced
-            })
-        }
-    except Exception as e:
-        print(f"Error processing sentiment analysis: {e}")
-        return {
-            "statusCode": 500,
-            "body": f"Error processing sentiment analysis: {str(e)}"
-        }
+    convinced_match = re.search(r"convinced: (true|false)", analysis_result, re.IGNORECASE)
+    convinced = convinced_match.group(1).lower() == "true" if convinced_match else conviction_score >= 81
+
+    return {
+        "conviction_score": conviction_score,
+        "mood": mood,
+        "convinced": convinced
+    }
@@ -0,0 +1,139 @@
+import argparse
+import gzip
+import json
+import os
+from datetime import datetime, timezone
+from Aws_clients import get_client, get_table
+from Chat_store import (CHAT_SESSIONS_TABLE, LEGACY_TABLE, blocks_from_record, items_from_block, load_session_items,
+                        record_from_block, session_record)
+from Telemetry import info, metric, timed, traced
+
+# Moves expired chat blocks to S3. Consumes the stream of CHAT_SESSIONS_TABLE (StreamViewType
+# NEW_AND_OLD_IMAGES or OLD_IMAGE): every block removed by TTL is decoded and the batch is
+# written as one gzipped JSON-lines object under ARCHIVE_PREFIX/YYYY/MM/DD/, in
+# ARCHIVE_STORAGE_CLASS. Each line is a session record (see Chat_store.session_record) with
+# its block number. Blocks deleted by hand are not archived.
+#
+# Local tool: `python Archive_chat_history.py export sessions.jsonl.gz` writes every session
+# of the compact table (or of ChatHistory with --source legacy, or only the sessions given
+# with --session) as one JSON line per session. `python Archive_chat_history.py import FILE`
+# writes exported sessions or downloaded archive objects back to the compact table with a
+# fresh expiry. Exporting ChatHistory and importing the file migrates old sessions.
+
+ARCHIVE_BUCKET = os.environ.get('ARCHIVE_BUCKET', '')
+ARCHIVE_PREFIX = os.environ.get('ARCHIVE_PREFIX', 'chat-archive/')
+ARCHIVE_STORAGE_CLASS = os.environ.get('ARCHIVE_STORAGE_CLASS', 'GLACIER_IR')
+
+@traced("Archive_chat_history")
+def lambda_handler(event, context):
+    expired = [record for record in event.get('Records', []) if is_ttl_removal(record)]
+    blocks = [record_from_block(_deserialize(record['dynamodb']['OldImage'])) for record in expired]
+    key = None
+    if blocks:
+        # Named after the first record, so a retried batch overwrites its own object
+        key = f"{ARCHIVE_PREFIX}{datetime.now(timezone.utc):%Y/%m/%d}/{expired[0]['eventID']}.jsonl.gz"
+        timed(
+            "archive_write",
+            get_client('s3').put_object,
+            Bucket=ARCHIVE_BUCKET,
+            Key=key,
+            Body=gzip.compress("".join(json.dumps(block) + "\n" for block in blocks).encode('utf-8')),
+            ContentType='application/x-ndjson',
+            ContentEncoding='gzip',
+            StorageClass=ARCHIVE_STORAGE_CLASS
+        )
+    info(f"Archived {len(blocks)} chat blocks to {key}")
+    metric("blocks_archived", len(blocks))
+    return {"archived": len(blocks), "key": key}
+
+# Whether a stream record is a removal by the TTL process rather than by a user
+def is_ttl_removal(record):
+    identity = record.get('userIdentity') or {}
+    return (record.get('eventName') == 'REMOVE' and 'OldImage' in record.get('dynamodb', {})
+            and identity.get('type') == 'Service' and identity.get('principalId') == 'dynamodb.amazonaws.com')
+
+# Session records of a chat table, one per session. A scan returns the items of a session
+# together, so only the current session is held in memory.
+def export_sessions(source='compact', session_ids=None):
+    if session_ids:
+        for session_id in session_ids:
+            items = load_session_items(session_id)
+            if items:
+                yield session_record(items)
+        return
+    table_name, to_items = (LEGACY_TABLE, lambda item: [item]) if source == 'legacy' else (CHAT_SESSIONS_TABLE, items_from_block)
+    current = []
+    scan_kwargs = {}
+    while True:
+        response = get_table(table_name).scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            if current and current[0]['session_id'] != item['session_id']:
+                yield session_record(current)
+                current = []
+            current.extend(to_items(item))
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    if current:
+        yield session_record(current)
+
+# Write session records back as compact blocks. Blocks are marked as restored so
+# Aggregate_rollups does not count their turns a second time.
+def import_sessions(records, dry_run=False):
+    totals = {"sessions": 0, "blocks": 0, "turns": 0}
+    sessions = set()
+    with get_table(CHAT_SESSIONS_TABLE).batch_writer() if not dry_run else _NoWriter() as writer:
+        for record in records:
+            sessions.add(record['session_id'])
+            for block in blocks_from_record(record, restored=True):
+                writer.put_item(Item=block)
+                totals["blocks"] += 1
+                totals["turns"] += len(block['turns'])
+    totals["sessions"] = len(sessions)
+    totals["dry_run"] = dry_run
+    return totals
+
+class _NoWriter:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def put_item(self, Item):
+        pass
+
+def _open(path, mode):
+    return gzip.open(path, mode + 't', encoding='utf-8') if path.endswith('.gz') else open(path, mode, encoding='utf-8')
+
+def read_records(path):
+    with _open(path, 'r') as handle:
+        for line in handle:
+            if line.strip():
+                yield json.loads(line)
+
+def _deserialize(item):
+    from boto3.dynamodb.types import TypeDeserializer
+    deserializer = TypeDeserializer()
+    return {k: deserializer.deserialize(v) for k, v in item.items()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export chat sessions to a JSON-lines file, or import exported or archived sessions.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Write sessions to a .jsonl or .jsonl.gz file")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--source", choices=["compact", "legacy"], default="compact", help="Table to read")
+    export_parser.add_argument("--session", action="append", help="Export only this session (both layouts); repeatable")
+    import_parser = subparsers.add_parser("import", help="Write exported sessions or archive objects to the compact table")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--dry-run", action="store_true", help="Count blocks without writing them")
+    args = parser.parse_args()
+    if args.command == "export":
+        exported = 0
+        with _open(args.path, 'w') as handle:
+            for record in export_sessions(args.source, args.session):
+                handle.write(json.dumps(record) + "\n")
+                exported += 1
+        print(json.dumps({"sessions": exported, "path": args.path}, indent=2))
+    else:
+        print(json.dumps(import_sessions(read_records(args.path), args.dry_run), indent=2))
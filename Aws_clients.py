@@ -0,0 +1,79 @@
+import os
+import threading
+
+# Shared AWS client layer. Clients, the DynamoDB resource and tables are created on first
+# use and reused for the life of the container, so a handler only pays for the services
+# the current invocation touches. boto3 itself is imported lazily to keep cold starts short.
+#
+# Handlers call these from worker threads too (Concurrent_io, MicroBatcher, export workers).
+# Creation goes through one lock, since boto3's default session is not safe to use from
+# several threads at once. Low-level clients are thread-safe and shared; resources and their
+# Table objects are not, so each thread gets its own.
+
+# Connection pooling, keep-alive and retry settings applied to every client
+MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '20'))
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get('AWS_CONNECT_TIMEOUT_SECONDS', '2'))
+READ_TIMEOUT_SECONDS = float(os.environ.get('AWS_READ_TIMEOUT_SECONDS', '60'))
+MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '3'))
+# Services whose retries are handled by the caller; SageMaker calls are retried by Model_guard,
+# so SDK retries on top would multiply the load on a throttled endpoint
+SERVICE_MAX_ATTEMPTS = {'sagemaker-runtime': 1}
+
+_lock = threading.Lock()
+_clients = {}
+# Keyed by (thread id, name); a thread id reused after its thread exits inherits the old
+# objects, which is safe because nothing else uses them any more
+_resources = {}
+_tables = {}
+_client_configs = {}
+
+# Helper function to build the botocore config once per retry setting
+def client_config(service_name=None):
+    max_attempts = SERVICE_MAX_ATTEMPTS.get(service_name, MAX_ATTEMPTS)
+    if max_attempts not in _client_configs:
+        from botocore.config import Config
+        _client_configs[max_attempts] = Config(
+            max_pool_connections=MAX_POOL_CONNECTIONS,
+            tcp_keepalive=True,
+            connect_timeout=CONNECT_TIMEOUT_SECONDS,
+            read_timeout=READ_TIMEOUT_SECONDS,
+            retries={'max_attempts': max_attempts, 'mode': 'standard'}
+        )
+    return _client_configs[max_attempts]
+
+# Return a pooled low-level client, e.g. get_client('sagemaker-runtime'); one client is shared
+# by every thread
+def get_client(service_name, endpoint_url=None):
+    key = (service_name, endpoint_url)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                import boto3
+                client = _clients[key] = boto3.client(service_name, endpoint_url=endpoint_url, config=client_config(service_name))
+    return client
+
+# Helper function to build a resource; called with the lock held
+def _new_resource(service_name):
+    import boto3
+    return boto3.resource(service_name, config=client_config(service_name))
+
+# Return the calling thread's resource, e.g. get_resource('dynamodb')
+def get_resource(service_name):
+    key = (threading.get_ident(), service_name)
+    resource = _resources.get(key)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(key)
+            if resource is None:
+                resource = _resources[key] = _new_resource(service_name)
+    return resource
+
+# Return the calling thread's DynamoDB Table object, e.g. get_table('ChatHistory')
+def get_table(table_name):
+    key = (threading.get_ident(), table_name)
+    table = _tables.get(key)
+    if table is None:
+        table = _tables[key] = get_resource('dynamodb').Table(table_name)
+    return table
@@ -0,0 +1,74 @@
+import argparse
+import json
+from Aws_clients import get_table
+from Latest_session import record_latest_session
+from Telemetry import error, info, traced
+
+# One-off migration that builds LatestSession pointers from existing ChatHistory rows.
+# Only the attributes needed to resolve a pointer are projected, and every scan page is
+# followed so tables larger than 1 MB are covered.
+def backfill(legacy_user_id=None, dry_run=False):
+    session_users = {}
+    latest_by_session_level = {}
+
+    scan_kwargs = {
+        'ProjectionExpression': "session_id, #ts, ProductId, #lvl, user_id",
+        'ExpressionAttributeNames': {'#ts': 'timestamp', '#lvl': 'level'}
+    }
+    while True:
+        response = get_table('ChatHistory').scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            session_id = item['session_id']
+            if item.get('user_id'):
+                session_users[session_id] = item['user_id']
+            key = (session_id, item.get('ProductId', ''), int(item.get('level', 1)))
+            timestamp = int(item['timestamp'])
+            if timestamp > latest_by_session_level.get(key, -1):
+                latest_by_session_level[key] = timestamp
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    # Sessions written before user_id was stored cannot be attributed to a trainee; they are
+    # assigned to legacy_user_id when given (single-tenant deployments) and skipped otherwise
+    written = skipped = unattributed = 0
+    for (session_id, product_id, level), timestamp in latest_by_session_level.items():
+        user_id = session_users.get(session_id, legacy_user_id)
+        if not user_id or not product_id:
+            unattributed += 1
+            continue
+        if dry_run or record_latest_session(user_id, product_id, level, session_id, timestamp):
+            written += 1
+        else:
+            skipped += 1
+
+    return {
+        "sessions_seen": len({key[0] for key in latest_by_session_level}),
+        "pointers_written": written,
+        "pointers_skipped_newer_exists": skipped,
+        "unattributed": unattributed,
+        "dry_run": dry_run
+    }
+
+@traced("Backfill_latest_session")
+def lambda_handler(event, context):
+    try:
+        result = backfill(event.get("legacy_user_id"), event.get("dry_run", False))
+        info(f"LatestSession backfill result: {result}")
+        return {
+            "statusCode": 200,
+            "body": json.dumps(result)
+        }
+    except Exception as e:
+        error(f"Error backfilling LatestSession: {e}")
+        return {
+            "statusCode": 500,
+            "body": json.dumps(f"Error backfilling LatestSession: {str(e)}")
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill LatestSession pointers from ChatHistory.")
+    parser.add_argument("--legacy-user-id", help="UserId to assign sessions that predate the user_id attribute")
+    parser.add_argument("--dry-run", action="store_true", help="Count pointers without writing them")
+    args = parser.parse_args()
+    print(json.dumps(backfill(args.legacy_user_id, args.dry_run), indent=2))
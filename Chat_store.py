@@ -0,0 +1,324 @@
+import itertools
+import json
+import os
+import time
+import zlib
+from decimal import Decimal
+from Aws_clients import get_table
+
+# Chat history storage. Two layouts are read:
+#   legacy   ChatHistory (session_id, timestamp): one item per turn, repeating ProductId and
+#            level, with the text in plain attributes and no expiry
+#   compact  CHAT_SESSIONS_TABLE (session_id, block): turns bucketed CHAT_BLOCK_TURNS to an
+#            item. A block stores ProductId and level once and its turns as a list of
+#            compressed binary values; block 0 also holds user_id. Every block of a session
+#            started in this layout holds its created_at, which tells it apart from a session
+#            that moved here from ChatHistory. Every write sets expires_at, so a block is
+#            removed by TTL CHAT_RETENTION_DAYS after its last turn (block 0 usually first),
+#            and Archive_chat_history copies it to S3 on the way out.
+# New turns go to the layout chosen by CHAT_STORAGE_FORMAT. Reads return both as
+# ChatHistory-shaped items, so sessions started before a switch keep resuming.
+
+CHAT_STORAGE_FORMAT = os.environ.get('CHAT_STORAGE_FORMAT', 'compact')
+LEGACY_TABLE = 'ChatHistory'
+CHAT_SESSIONS_TABLE = os.environ.get('CHAT_SESSIONS_TABLE', 'ChatSessions')
+# Turns per block. Appending rewrites the whole block, so small blocks keep each turn's write
+# near one write unit while still storing the metadata once per block
+CHAT_BLOCK_TURNS = int(os.environ.get('CHAT_BLOCK_TURNS', '4'))
+CHAT_RETENTION_SECONDS = int(os.environ.get('CHAT_RETENTION_DAYS', '90')) * 24 * 3600
+
+# Short keys of an encoded turn; level is only stored when it differs from the block's
+TURN_FIELDS = {
+    'timestamp': 't',
+    'user_input': 'u',
+    'ai_response': 'a',
+    'level': 'l',
+    'conviction_score': 'c',
+    'mood': 'm',
+    'convinced': 'v',
+    'sentiment_pending': 'p'
+}
+# Attributes that belong to the session rather than to a turn
+SESSION_FIELDS = ('session_id', 'ProductId', 'user_id')
+
+# Block that holds a turn, the opening message being turn 0
+def block_of(turn_index):
+    return turn_index // CHAT_BLOCK_TURNS
+
+# Encode a turn as a raw-deflate compressed JSON object with short keys. The first byte marks
+# the encoding: 'z' compressed, 'j' plain JSON when compression would not save anything.
+def encode_turn(turn, block_level):
+    fields = {short: turn[name] for name, short in TURN_FIELDS.items() if name in turn}
+    if fields.get('l') is not None and int(fields['l']) == int(block_level):
+        del fields['l']
+    raw = json.dumps(fields, separators=(',', ':'), default=_plain).encode('utf-8')
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    packed = compressor.compress(raw) + compressor.flush()
+    return b'z' + packed if len(packed) < len(raw) else b'j' + raw
+
+def decode_turn(data, block_level):
+    data = bytes(getattr(data, 'value', data))
+    raw = zlib.decompress(data[1:], -15) if data[:1] == b'z' else data[1:]
+    fields = json.loads(raw)
+    turn = {name: fields[short] for name, short in TURN_FIELDS.items() if short in fields}
+    turn.setdefault('level', int(block_level))
+    return turn
+
+# Build a block item from ChatHistory-shaped turns; header holds the block 0 attributes
+def block_item(session_id, block, product_id, level, turns, now=None, **header):
+    now = int(time.time()) if now is None else now
+    return {
+        'session_id': session_id,
+        'block': block,
+        'ProductId': product_id,
+        'level': level,
+        'turns': [encode_turn(turn, level) for turn in turns],
+        'expires_at': now + CHAT_RETENTION_SECONDS,
+        **header
+    }
+
+# Expand a block item (as stored, or deserialized from a stream image) into ChatHistory-shaped items
+def items_from_block(block):
+    items = []
+    for index, data in enumerate(block.get('turns', [])):
+        item = {'session_id': block['session_id'], 'ProductId': block.get('ProductId', '')}
+        item.update(decode_turn(data, block.get('level', 1)))
+        if int(block['block']) == 0 and index == 0 and block.get('user_id'):
+            item['user_id'] = block['user_id']
+        items.append(item)
+    return items
+
+# Write the opening message of a new session
+def save_opening(chat_item):
+    if CHAT_STORAGE_FORMAT == 'legacy':
+        get_table(LEGACY_TABLE).put_item(Item=chat_item)
+        return
+    get_table(CHAT_SESSIONS_TABLE).put_item(Item=block_item(
+        chat_item['session_id'], 0, chat_item['ProductId'], chat_item['level'], [chat_item],
+        user_id=chat_item['user_id'], created_at=chat_item['timestamp']
+    ))
+
+# The TransactWriteItems entry ({'Put': ...} or {'Update': ...}) that stores a turn.
+# turn_index is the turn's position in the session and session_level the level the session
+# was started at; the turn is appended to its block, which is created on its first turn. The
+# block records the next turn index, so an append that was already applied (a retried
+# request) fails its condition instead of storing the turn twice. created_at is the start of a
+# session that was opened in the compact layout, or None for one that moved from ChatHistory.
+def turn_write(chat_item, turn_index, session_level, created_at=None):
+    from boto3.dynamodb.types import TypeSerializer
+    serializer = TypeSerializer()
+    if CHAT_STORAGE_FORMAT == 'legacy':
+        return {'Put': {'TableName': LEGACY_TABLE, 'Item': {k: serializer.serialize(v) for k, v in chat_item.items()}}}
+    values = {
+        ':empty': [],
+        ':turn': [encode_turn(chat_item, session_level)],
+        ':product': chat_item['ProductId'],
+        ':level': int(session_level),
+        ':expires': int(time.time()) + CHAT_RETENTION_SECONDS,
+        ':index': int(turn_index),
+        ':next': int(turn_index) + 1
+    }
+    marker = ''
+    if created_at is not None:
+        marker = ', created_at = if_not_exists(created_at, :created)'
+        values[':created'] = int(created_at)
+    return {'Update': {
+        'TableName': CHAT_SESSIONS_TABLE,
+        'Key': {'session_id': serializer.serialize(chat_item['session_id']), 'block': serializer.serialize(block_of(turn_index))},
+        'UpdateExpression': ('SET turns = list_append(if_not_exists(turns, :empty), :turn), '
+                             'ProductId = if_not_exists(ProductId, :product), #level = if_not_exists(#level, :level), '
+                             'expires_at = :expires, next_turn = :next' + marker),
+        'ConditionExpression': 'attribute_not_exists(next_turn) OR next_turn <= :index',
+        'ExpressionAttributeNames': {'#level': 'level'},
+        'ExpressionAttributeValues': {k: serializer.serialize(v) for k, v in values.items()}
+    }}
+
+# The TransactWriteItems entries that replace stored turns with their scored versions.
+# rewrites holds (pending_item, scored_item, turn_index) for turns written as pending_item;
+# turns that are no longer stored are left out. Turns sharing a compact block are rewritten by
+# one entry, since a transaction writes an item once. A block is read to find the turns'
+# positions, as sessions that moved from ChatHistory do not start their blocks at a multiple
+# of CHAT_BLOCK_TURNS. Every write is conditional on the stored turn being unchanged.
+def turns_rewrite(rewrites, session_level):
+    from boto3.dynamodb.types import TypeSerializer
+    serializer = TypeSerializer()
+    entries = []
+    if CHAT_STORAGE_FORMAT == 'legacy':
+        for pending_item, scored_item, _ in rewrites:
+            key = {'session_id': pending_item['session_id'], 'timestamp': pending_item['timestamp']}
+            if 'Item' not in get_table(LEGACY_TABLE).get_item(Key=key, ProjectionExpression='session_id'):
+                continue
+            values = {':score': scored_item['conviction_score'], ':mood': scored_item['mood'], ':convinced': scored_item['convinced'],
+                      ':level': scored_item['level'], ':reply': pending_item['ai_response']}
+            entries.append({'Update': {
+                'TableName': LEGACY_TABLE,
+                'Key': {k: serializer.serialize(v) for k, v in key.items()},
+                'UpdateExpression': 'SET conviction_score = :score, #mood = :mood, convinced = :convinced, #level = :level REMOVE sentiment_pending',
+                'ConditionExpression': 'attribute_exists(sentiment_pending) AND ai_response = :reply',
+                'ExpressionAttributeNames': {'#level': 'level', '#mood': 'mood'},
+                'ExpressionAttributeValues': {k: serializer.serialize(v) for k, v in values.items()}
+            }})
+        return entries
+    by_block = {}
+    for pending_item, scored_item, turn_index in rewrites:
+        by_block.setdefault(block_of(int(turn_index)), []).append((pending_item, scored_item))
+    for block_number, turns in by_block.items():
+        key = {'session_id': turns[0][0]['session_id'], 'block': block_number}
+        block = get_table(CHAT_SESSIONS_TABLE).get_item(Key=key, ProjectionExpression='turns, #level',
+                                                        ExpressionAttributeNames={'#level': 'level'}).get('Item')
+        if block is None:
+            continue
+        block_level = block.get('level', session_level)
+        stored = [bytes(getattr(data, 'value', data)) for data in block.get('turns', [])]
+        sets, conditions, values = [], [], {}
+        for pending_item, scored_item in turns:
+            pending = encode_turn(pending_item, block_level)
+            if pending not in stored:
+                continue
+            position = stored.index(pending)
+            sets.append(f'turns[{position}] = :scored{position}')
+            conditions.append(f'turns[{position}] = :pending{position}')
+            values[f':scored{position}'] = serializer.serialize(encode_turn(scored_item, block_level))
+            values[f':pending{position}'] = serializer.serialize(pending)
+        if sets:
+            entries.append({'Update': {
+                'TableName': CHAT_SESSIONS_TABLE,
+                'Key': {k: serializer.serialize(v) for k, v in key.items()},
+                'UpdateExpression': 'SET ' + ', '.join(sets),
+                'ConditionExpression': ' AND '.join(conditions),
+                'ExpressionAttributeValues': values
+            }})
+    return entries
+
+# Every stored turn of a session in chronological order, as ChatHistory-shaped items. The
+# legacy table is only queried when the first stored block has no created_at, i.e. the
+# session was started before the switch to the compact layout (its later turns still land in
+# the blocks), or its blocks predate the marker on every block and block 0 has expired.
+def load_session_items(session_id):
+    from boto3.dynamodb.conditions import Key
+    condition = Key('session_id').eq(session_id)
+    blocks = query_all_pages(get_table(CHAT_SESSIONS_TABLE), KeyConditionExpression=condition, ScanIndexForward=True)
+    items = [item for block in blocks for item in items_from_block(block)]
+    if blocks and 'created_at' in blocks[0]:
+        return items
+    legacy = query_all_pages(get_table(LEGACY_TABLE), KeyConditionExpression=condition, ScanIndexForward=True)
+    return legacy + items
+
+# Helper function to read every page of a query so long sessions are not cut off at 1 MB
+def query_all_pages(table, **kwargs):
+    return list(query_pages(table, **kwargs))
+
+# Items of a query, one page at a time; stops reading when the caller stops iterating
+def query_pages(table, **kwargs):
+    while True:
+        response = table.query(**kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+# Up to limit turns of a session that come after position, as ChatHistory-shaped items, and
+# the position after the last one. A position is ('legacy', timestamp) inside the ChatHistory
+# rows of a session started before the compact layout, or ('compact', block, index) inside
+# its compact blocks; None starts at the opening. Turns at or before since_timestamp are
+# skipped. Only the blocks or rows from position onwards are read, a page at a time, and
+# reading stops at the first turn past the limit. Returns (items, position, has_more).
+def session_page(session_id, position=None, since_timestamp=None, limit=100):
+    from boto3.dynamodb.conditions import Key
+    condition = Key('session_id').eq(session_id)
+    items = []
+    blocks = None
+    if position is None:
+        blocks = _block_pages(session_id, 0, limit)
+        first = next(blocks, None)
+        # Sessions whose blocks are marked with created_at started in the compact layout
+        if first is not None and 'created_at' in first:
+            position = ('compact', 0, 0)
+            blocks = itertools.chain([first], blocks)
+        else:
+            # The blocks read so far are used again after the ChatHistory rows
+            position = ('legacy', 0)
+            blocks = itertools.chain([first], blocks) if first is not None else iter(())
+
+    if position[0] == 'legacy':
+        newer_than = max(position[1], since_timestamp or 0)
+        for item in query_pages(get_table(LEGACY_TABLE), KeyConditionExpression=condition & Key('timestamp').gt(newer_than),
+                                ScanIndexForward=True, Limit=limit + 1):
+            if len(items) == limit:
+                return items, position, True
+            items.append(item)
+            position = ('legacy', int(item['timestamp']))
+        # Turns of a session that carried on after the switch are in its compact blocks
+        start_block, start_index = 0, 0
+    else:
+        start_block, start_index = position[1], position[2]
+
+    if blocks is None:
+        blocks = _block_pages(session_id, start_block, limit - len(items))
+    for block in blocks:
+        block_number = int(block['block'])
+        for index, item in enumerate(items_from_block(block)):
+            if block_number == start_block and index < start_index:
+                continue
+            if since_timestamp is not None and int(item['timestamp']) <= since_timestamp:
+                position = ('compact', block_number, index + 1)
+                continue
+            if len(items) == limit:
+                return items, position, True
+            items.append(item)
+            position = ('compact', block_number, index + 1)
+    return items, position, False
+
+# Helper function to stream the blocks of a session from start_block, sized for limit turns
+def _block_pages(session_id, start_block, limit):
+    from boto3.dynamodb.conditions import Key
+    return query_pages(get_table(CHAT_SESSIONS_TABLE), KeyConditionExpression=Key('session_id').eq(session_id) & Key('block').gte(start_block),
+                       ScanIndexForward=True, Limit=limit // CHAT_BLOCK_TURNS + 2)
+
+# Group ChatHistory-shaped items of one session into a portable session record:
+# {"session_id", "ProductId", "level", "user_id", "turns": [...]}
+def session_record(items):
+    first = items[0]
+    record = {
+        'session_id': first['session_id'],
+        'ProductId': first.get('ProductId', ''),
+        'level': int(first.get('level', 1)),
+        'turns': [{k: _plain(v) if isinstance(v, Decimal) else v for k, v in item.items() if k not in SESSION_FIELDS} for item in items]
+    }
+    user_id = next((item['user_id'] for item in items if item.get('user_id')), None)
+    if user_id:
+        record['user_id'] = user_id
+    return record
+
+# Session record of one block item, keeping its block number, level and created_at marker
+def record_from_block(block):
+    record = dict(session_record(items_from_block(block)), block=int(block['block']), level=int(block.get('level', 1)))
+    if block.get('created_at') is not None:
+        record['created_at'] = int(block['created_at'])
+    return record
+
+# Block items for a session record. Records with a "block" number (archived blocks) are
+# written back as that block with the marker they had; whole sessions are bucketed from block
+# 0, and every block is marked as a session of the compact layout.
+def blocks_from_record(record, now=None, **extra):
+    turns = [dict(turn, session_id=record['session_id']) for turn in record['turns']]
+    if 'block' in record:
+        chunks = [(record['block'], turns)]
+    else:
+        chunks = [(block_of(start), turns[start:start + CHAT_BLOCK_TURNS]) for start in range(0, len(turns), CHAT_BLOCK_TURNS)]
+    blocks = []
+    for block, chunk in chunks:
+        header = dict(extra)
+        if block == 0 and record.get('user_id'):
+            header['user_id'] = record['user_id']
+        if 'block' not in record:
+            header['created_at'] = int(turns[0]['timestamp'])
+        elif record.get('created_at') is not None:
+            header['created_at'] = int(record['created_at'])
+        blocks.append(block_item(record['session_id'], block, record['ProductId'], record['level'], chunk, now, **header))
+    return blocks
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return int(value) if value % 1 == 0 else float(value)
+    raise TypeError(f"Cannot encode {type(value).__name__}")
@@ -1,10 +1,7 @@
-import boto3
 import json
 from decimal import Decimal
-
-# Initialize AWS services
-dynamodb = boto3.resource('dynamodb')
-persona_progress_table = dynamodb.Table('PersonaProgress')
+from Aws_clients import get_client
+from Telemetry import error, timed, traced, warning
 
 # Helper function to convert Decimal values to JSON-compatible types
 def decimal_to_float(obj):
@@ -16,14 +13,21 @@ def decimal_to_float(obj):
         return {k: decimal_to_float(v) for k, v in obj.items()}
     return obj
 
+# Helper function to convert a low-level DynamoDB item into Python types
+def deserialize_item(item):
+    from boto3.dynamodb.types import TypeDeserializer
+    deserializer = TypeDeserializer()
+    return {k: deserializer.deserialize(v) for k, v in item.items()}
+
+@traced("Check_progress")
 def lambda_handler(event, context):
     # Parse 'body' for both API Gateway and direct Lambda invocation scenarios
     if 'body' in event:
         try:
             # If body is a string (from API Gateway), parse it as JSON
-            body = json.loads(event['body']) if isinstance(event['body'], str) else event['body']
+            body = timed("parse", json.loads, event['body']) if isinstance(event['body'], str) else event['body']
         except json.JSONDecodeError as e:
-            print("JSON decode error:", e)
+            warning(f"JSON decode error: {e}")
             return {
                 "statusCode": 400,
                 "body": json.dumps("Error: Invalid JSON in request body.")
@@ -44,16 +48,22 @@ def lambda_handler(event, context):
         }
 
     try:
-        # Fetch progress details from DynamoDB
-        progress_response = persona_progress_table.get_item(
-            Key={'UserId': user_id, 'ProductId': product_id}
+        # Fetch progress details from DynamoDB with the low-level client; this handler only
+        # needs one get_item, so it skips building the heavier DynamoDB resource
+        progress_response = timed(
+            "progress_read",
+            get_client('dynamodb').get_item,
+            TableName='PersonaProgress',
+            Key={'UserId': {'S': user_id}, 'ProductId': {'S': product_id}},
+            ProjectionExpression='LevelsPassed, ProgressPercentage'
         )
         
         # Check if progress exists
         if 'Item' in progress_response:
-            # Convert any Decimal types in the response to float
-            levels_passed = decimal_to_float(progress_response['Item'].get('LevelsPassed', []))
-            progress_percentage = decimal_to_float(progress_response['Item'].get('ProgressPercentage', 0))
+            # Convert the DynamoDB attribute values, then any Decimal types, to plain JSON types
+            item = deserialize_item(progress_response['Item'])
+            levels_passed = decimal_to_float(item.get('LevelsPassed', []))
+            progress_percentage = decimal_to_float(item.get('ProgressPercentage', 0))
             return {
                 "statusCode": 200,
                 "body": json.dumps({
@@ -71,7 +81,7 @@ def lambda_handler(event, context):
                 })
             }
     except Exception as e:
-        print(f"Error checking progress: {e}")
+        error(f"Error checking progress: {e}")
         return {
             "statusCode": 500,
             "body": json.dumps(f"Error checking progress: {str(e)}")
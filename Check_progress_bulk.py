@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import time
+from Aws_clients import get_client
+from Check_progress import decimal_to_float, deserialize_item
+from Telemetry import error, metric, timed, traced, warning
+
+# Dashboard endpoint: returns a user's progress for many products in one request. Without
+# product_ids, it pages through the user's PersonaProgress partition with one query per
+# page. With product_ids, it reads exactly those rows with BatchGetItem. Products with no
+# progress get the default values, as in Check_progress.
+#
+# Every response carries an ETag computed from its payload. A client that sends the ETag back
+# as if_none_match (or in an If-None-Match header) gets a 304 with an empty body when nothing
+# on that page has changed.
+
+# Rows per page; BatchGetItem reads at most 100 keys per call
+BULK_PROGRESS_PAGE_SIZE = int(os.environ.get('BULK_PROGRESS_PAGE_SIZE', '50'))
+MAX_PAGE_SIZE = 100
+# Attempts at reading keys that BatchGetItem returned as unprocessed (throttled)
+BATCH_GET_MAX_ATTEMPTS = 4
+
+@traced("Check_progress_bulk")
+def lambda_handler(event, context):
+    # Parse 'body' for both API Gateway and direct Lambda invocation scenarios
+    if 'body' in event:
+        try:
+            # If body is a string (from API Gateway), parse it as JSON
+            body = timed("parse", json.loads, event['body']) if isinstance(event['body'], str) else event['body']
+        except json.JSONDecodeError as e:
+            warning(f"JSON decode error: {e}")
+            return {
+                "statusCode": 400,
+                "body": json.dumps("Error: Invalid JSON in request body.")
+            }
+    else:
+        # If 'body' is not in the event, assume the entire event is the input (Lambda test console case)
+        body = event
+
+    user_id = body.get("user_id")
+    product_ids = body.get("product_ids")
+    cursor = body.get("cursor")
+    page_size = body.get("page_size", BULK_PROGRESS_PAGE_SIZE)
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    if_none_match = body.get("if_none_match") or headers.get("if-none-match")
+
+    # Validate the request
+    if not user_id:
+        return {
+            "statusCode": 400,
+            "body": json.dumps("Error: 'user_id' is required.")
+        }
+    if product_ids is not None and (not isinstance(product_ids, list) or not all(isinstance(p, str) and p for p in product_ids)):
+        return {
+            "statusCode": 400,
+            "body": json.dumps("Error: 'product_ids' must be a list of product IDs.")
+        }
+    if not isinstance(page_size, int) or not 1 <= page_size <= MAX_PAGE_SIZE:
+        return {
+            "statusCode": 400,
+            "body": json.dumps(f"Error: 'page_size' must be between 1 and {MAX_PAGE_SIZE}.")
+        }
+
+    try:
+        after_product_id = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return {
+            "statusCode": 400,
+            "body": json.dumps("Error: Invalid 'cursor'.")
+        }
+
+    try:
+        if product_ids is None:
+            progress, next_product_id = timed("progress_query", query_progress, user_id, page_size, after_product_id)
+        else:
+            progress, next_product_id = timed("progress_batch_get", batch_get_progress, user_id, product_ids, page_size, after_product_id)
+    except Exception as e:
+        error(f"Error checking progress: {e}")
+        return {
+            "statusCode": 500,
+            "body": json.dumps(f"Error checking progress: {str(e)}")
+        }
+
+    response_data = {
+        "user_id": user_id,
+        "progress": progress,
+        "next_cursor": encode_cursor(next_product_id) if next_product_id else None
+    }
+    etag = compute_etag(response_data)
+    metric("products", len(progress))
+    # Compression in front of the API may have weakened the tag (W/"..."); it still matches
+    if if_none_match and if_none_match.removeprefix('W/') == etag:
+        metric("not_modified", 1)
+        return {"statusCode": 304, "headers": {"ETag": etag}, "body": ""}
+    response_data["etag"] = etag
+    return {
+        "statusCode": 200,
+        "headers": {"ETag": etag},
+        "body": json.dumps(response_data)
+    }
+
+# Read one page of the user's PersonaProgress partition, in ProductId order. Returns the rows
+# and the ProductId to continue after, or None on the last page.
+def query_progress(user_id, page_size, after_product_id=None):
+    kwargs = {
+        'TableName': 'PersonaProgress',
+        'KeyConditionExpression': 'UserId = :user_id',
+        'ExpressionAttributeValues': {':user_id': {'S': user_id}},
+        'ProjectionExpression': 'ProductId, LevelsPassed, ProgressPercentage',
+        'Limit': page_size
+    }
+    if after_product_id:
+        kwargs['ExclusiveStartKey'] = {'UserId': {'S': user_id}, 'ProductId': {'S': after_product_id}}
+    response = get_client('dynamodb').query(**kwargs)
+    progress = [progress_entry(item['ProductId'], item) for item in map(deserialize_item, response.get('Items', []))]
+    last_key = response.get('LastEvaluatedKey')
+    return progress, last_key['ProductId']['S'] if last_key else None
+
+# Read the user's progress for an explicit list of products with BatchGetItem, one page of
+# ProductIds (in sorted order) at a time
+def batch_get_progress(user_id, product_ids, page_size, after_product_id=None):
+    remaining = sorted(set(product_ids))
+    if after_product_id:
+        remaining = [product_id for product_id in remaining if product_id > after_product_id]
+    page = remaining[:page_size]
+    if not page:
+        return [], None
+
+    request = {
+        'PersonaProgress': {
+            'Keys': [{'UserId': {'S': user_id}, 'ProductId': {'S': product_id}} for product_id in page],
+            'ProjectionExpression': 'ProductId, LevelsPassed, ProgressPercentage'
+        }
+    }
+    found = {}
+    for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+        response = get_client('dynamodb').batch_get_item(RequestItems=request)
+        for item in map(deserialize_item, response.get('Responses', {}).get('PersonaProgress', [])):
+            found[item['ProductId']] = item
+        request = response.get('UnprocessedKeys') or {}
+        if not request:
+            break
+        # Unprocessed keys mean the table throttled part of the batch; back off before retrying them
+        time.sleep(0.05 * 2 ** attempt)
+    else:
+        raise RuntimeError(f"BatchGetItem left keys unprocessed after {BATCH_GET_MAX_ATTEMPTS} attempts")
+
+    progress = [progress_entry(product_id, found.get(product_id, {})) for product_id in page]
+    return progress, page[-1] if len(remaining) > len(page) else None
+
+# Helper function to shape one PersonaProgress row, or the defaults when there is none
+def progress_entry(product_id, item):
+    return {
+        "product_id": product_id,
+        "levels_passed": decimal_to_float(item.get('LevelsPassed', [])),
+        "progress_percentage": decimal_to_float(item.get('ProgressPercentage', 0))
+    }
+
+# Cursors are opaque to clients: the ProductId to continue after, hex encoded (base64 would
+# cost a few milliseconds more at cold start)
+def encode_cursor(product_id):
+    return product_id.encode('utf-8').hex()
+
+def decode_cursor(cursor):
+    try:
+        return bytes.fromhex(cursor).decode('utf-8')
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+# Strong ETag of a response payload
+def compute_etag(response_data):
+    digest = hashlib.sha256(json.dumps(response_data, sort_keys=True).encode('utf-8')).hexdigest()
+    return f'"{digest[:32]}"'
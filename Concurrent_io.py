@@ -0,0 +1,24 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+from Telemetry import in_stage, timed
+
+# Runs the independent AWS calls of an invocation side by side on a shared thread pool, each
+# recorded as its own stage of the invocation's trace. Each worker thread resolves its own
+# Table objects through Aws_clients (boto3 resources are not thread-safe), created once per
+# worker; they share the container's pooled connections. It saves one DynamoDB round trip per
+# gathered call, so use it only for calls that are independent and on the request's path.
+
+# Set CONCURRENT_IO=0 to make the calls one after the other, e.g. to compare timings
+CONCURRENT_IO = os.environ.get('CONCURRENT_IO', '1') != '0'
+IO_POOL_SIZE = int(os.environ.get('IO_POOL_SIZE', '4'))
+_executor = ThreadPoolExecutor(max_workers=IO_POOL_SIZE)
+
+# Run calls given as (stage_name, fn, *args) at the same time and return their results in
+# order. Every call is waited for before the first error is raised, so a failure never
+# leaves another call of the invocation running unobserved.
+def gather(*calls):
+    if not CONCURRENT_IO:
+        return [timed(name, fn, *args) for name, fn, *args in calls]
+    futures = [_executor.submit(in_stage(name, fn), *args) for name, fn, *args in calls]
+    wait(futures)
+    return [future.result() for future in futures]
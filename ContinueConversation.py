@@ -1,32 +1,78 @@
-import boto3
 import json
+import os
+import random
+import re
+import time
 from datetime import datetime
 from decimal import Decimal
-
-# Initialize AWS services
-dynamodb = boto3.resource('dynamodb')
-sagemaker_runtime = boto3.client('sagemaker-runtime')
-lambda_client = boto3.client('lambda')
-
-# Define the DynamoDB tables
-chat_history_table = dynamodb.Table('ChatHistory')
-products_table = dynamodb.Table('Products')
-persona_progress_table = dynamodb.Table('PersonaProgress')
+from Aws_clients import get_client
+from Analyze_sentiment import ASSESSMENT_FORMAT, ASSESSMENT_INSTRUCTIONS, analyze_response, parse_analysis
+from Chat_store import load_session_items, turn_write, turns_rewrite
+from Concurrent_io import gather
+from Idempotency import Claim, claim, idempotency_key, release, request_hash, result_write
+from Latest_session import latest_session_write
+from Model_gateway import generate
+from Model_guard import ModelUnavailable, model_stats
+from Product_cache import get_level_prompt, get_product
+from Response_stream import StopTrimmer, stream_generate, websocket_emitter
+from Session_context import append_messages, build_conversation_history, context_from_history, context_write, load_context
+from Telemetry import debug, error, metric, set_property, stage, timed, traced, warning
+from Token_budget import count_tokens
 
 # Define the SageMaker endpoint
 ENDPOINT_NAME = 'sagemaker-endpoint-name'  # Replace with your actual endpoint name
 
+# How each reply is scored: "lambda" invokes analyze_sentiment, "inprocess" runs the same
+# analysis in this process after the reply (saving the Lambda hop, nothing runs alongside it),
+# "combined" asks for the assessment in the same generation as the reply
+SENTIMENT_MODES = ('lambda', 'inprocess', 'combined')
+# Former names still accepted. "concurrent" scored on a thread pool alongside the reply, but
+# scoring needs the finished reply, so the thread only added a handoff.
+SENTIMENT_MODE_ALIASES = {'concurrent': 'inprocess'}
+SENTIMENT_MODE = os.environ.get('SENTIMENT_MODE', 'lambda')
+SENTIMENT_MODE = SENTIMENT_MODE_ALIASES.get(SENTIMENT_MODE, SENTIMENT_MODE)
+if SENTIMENT_MODE not in SENTIMENT_MODES:
+    raise ValueError(f"Unknown SENTIMENT_MODE {SENTIMENT_MODE!r}, expected one of {', '.join(SENTIMENT_MODES)}")
+
+# How many times a turn write cancelled by a conflicting transaction or by throttling is tried
+TURN_WRITE_ATTEMPTS = int(os.environ.get('TURN_WRITE_ATTEMPTS', '3'))
+# Cancellation reasons that say nothing about the turn itself, so the same write can be retried
+RETRYABLE_CANCELLATIONS = {'TransactionConflict', 'ThrottlingError', 'ProvisionedThroughputExceeded'}
+
+# Outcomes of save_turn
+TURN_SAVED = "saved"
+TURN_CONFLICT = "conflict"  # another turn of the session was saved first
+CLAIM_LOST = "claim_lost"  # another attempt took the idempotency key over
+
+# In-character replies used when the model is unavailable, so the trainee gets an answer
+# instead of an error and the client does not retry into a saturated endpoint
+DEGRADED_REPLIES = [
+    "Sorry, give me a moment to think about that. Could you tell me a bit more?",
+    "Hmm, I'm not sure yet. What else should I know before deciding?",
+    "That's a fair point. Can you explain how that would work for me?",
+    "Let me think it over. What would you say is the main benefit for someone like me?",
+]
+
+# Instructions appended to the persona prompt in combined mode
+COMBINED_ASSESSMENT_PROMPT = (
+    "Reply to the salesperson in character. Then, on new lines after your reply, assess your own interest as the customer:\n"
+    f"{ASSESSMENT_INSTRUCTIONS}"
+    "Format the assessment exactly as follows:\n"
+    f"{ASSESSMENT_FORMAT.rstrip()}"
+)
+
+@traced("ContinueConversation")
 def lambda_handler(event, context):
-    # Logging the received event for debugging
-    print("Received event:", event)
-    
+    # Logging the received event for debugging; it holds conversation text, so only at DEBUG level
+    debug(f"Received event: {event}")
+
     # Attempt to parse 'body' for both API Gateway and direct Lambda invocation scenarios
     if 'body' in event:
         try:
             # If body is a string (from API Gateway), parse it as JSON
-            body = json.loads(event['body']) if isinstance(event['body'], str) else event['body']
+            body = timed("parse", json.loads, event['body']) if isinstance(event['body'], str) else event['body']
         except json.JSONDecodeError as e:
-            print("JSON decode error:", e)
+            warning(f"JSON decode error: {e}")
             return {
                 "statusCode": 400,
                 "body": json.dumps("Error: Invalid JSON in request body.")
@@ -41,85 +87,169 @@ def lambda_handler(event, context):
 
     # Validate that both required fields are present
     if not session_id or not salesperson_input:
-        print("Missing required fields: session_id or user_input")
+        warning("Missing required fields: session_id or user_input")
         return {
             "statusCode": 400,
             "body": json.dumps("Error: 'session_id' and 'user_input' are required.")
         }
 
-    # Retrieve session data, including level and product_id from ChatHistory using session_id
+    # Stream the reply as it is generated when the client asked for it over a WebSocket connection
+    emit = websocket_emitter(event, body)
+
+    # A client that retries sends the same idempotency key with each attempt; a retry gets the
+    # first attempt's response instead of paying for another generation
+    key = idempotency_key(event, body)
+    if key is None:
+        return continue_conversation(body, session_id, salesperson_input, emit=emit)
+    fingerprint = request_hash(session_id, salesperson_input)
     try:
-        response = chat_history_table.query(
-            KeyConditionExpression=boto3.dynamodb.conditions.Key('session_id').eq(session_id),
-            ScanIndexForward=True
-        )
-        if 'Items' in response and len(response['Items']) > 0:
-            conversation_items = response['Items']
-            product_id = conversation_items[0].get('ProductId', '')
-            level = int(conversation_items[0].get('level', 1))
-            conversation_messages = [
-                f"Salesperson: {item['user_input']}" if item['user_input'] else f"Customer: {item['ai_response']}"
-                for item in conversation_items if item['user_input'] or item['ai_response']
-            ]
-            conversation_messages.append(f"Salesperson: {salesperson_input}")
-            conversation_history = "\n".join(conversation_messages[-10:]) + "\n"
-        else:
-            return {
-                "statusCode": 400,
-                "body": json.dumps("Error: Invalid 'session_id' or conversation not found.")
-            }
+        claimed = timed("idempotency_claim", claim, session_id, key, fingerprint)
+    except Exception as e:
+        return {"statusCode": 500, "body": f"Error claiming the idempotency key in DynamoDB: {str(e)}"}
+    if claimed.mismatch:
+        return {
+            "statusCode": 422,
+            "body": json.dumps("Error: This idempotency key was already used for a different message.")
+        }
+    if claimed.claim_id is None:
+        return claimed_response(claimed, emit)
+    response = continue_conversation(body, session_id, salesperson_input, (key, claimed.claim_id, fingerprint), emit)
+    if response is None:
+        # Another attempt took the key over while this one ran (its claim looked stale), so this
+        # turn was not saved; answer like a retry would, with that attempt's response
+        metric("idempotency_claims_lost", 1)
+        claimed = timed("idempotency_claim", claim, session_id, key, fingerprint)
+        if claimed.claim_id is not None:
+            # That attempt failed and released the key; the client's retry runs the turn again
+            timed("idempotency_release", release, session_id, key, claimed.claim_id)
+            claimed = Claim()
+        return claimed_response(claimed, emit)
+    if response["statusCode"] != 200:
+        # Nothing was stored for a failed attempt, so a retry runs the turn again
+        timed("idempotency_release", release, session_id, key, claimed.claim_id)
+    return response
+
+# The answer to a request whose idempotency key is held by another attempt: that attempt's
+# stored response, or 409 while it is still running
+def claimed_response(claimed, emit):
+    if claimed.response is None:
+        return {
+            "statusCode": 409,
+            "body": json.dumps("Error: This turn is still being processed. Retry with the same idempotency key shortly.")
+        }
+    if emit is not None:
+        emit(dict(json.loads(claimed.response["body"]), type="done"))
+    return claimed.response
+
+# Tell a streaming client that the reply it was sent was not saved, so it can discard it
+def stream_failure(emit, response):
+    if emit is not None:
+        emit({"type": "error", "statusCode": response["statusCode"], "body": response["body"]})
+    return response
+
+# Run one turn and return the handler response. idempotency is (key, claim_id, fingerprint)
+# when the client sent an idempotency key; the response is then stored with the turn, and
+# None is returned when another attempt took the key over before the turn was saved. emit
+# streams the reply to the client's WebSocket connection (see websocket_emitter).
+def continue_conversation(body, session_id, salesperson_input, idempotency=None, emit=None):
+    # Retrieve the rolling context and state of the session (user, product, current level,
+    # progress) with one get_item. Sessions that predate SessionContext, or whose context
+    # predates the session state, are completed once from their chat history.
+    try:
+        session_context = timed("context_load", load_context, session_id)
+        if session_context is None or 'user_id' not in session_context:
+            if session_context is None:
+                history_items = timed("history_query", load_session_items, session_id)
+            else:
+                # The product is already known, so it is fetched into the cache while the history is read
+                history_items, _ = gather(("history_query", load_session_items, session_id),
+                                          ("product_fetch", get_product, session_context.get('ProductId', '')))
+            if not history_items:
+                return {
+                    "statusCode": 400,
+                    "body": json.dumps("Error: Invalid 'session_id' or conversation not found.")
+                }
+            rebuilt = context_from_history(session_id, history_items)
+            if session_context is None:
+                session_context = rebuilt
+            else:
+                # Before the state was kept here the level never changed, so it is the start level
+                session_context = dict(session_context, user_id=rebuilt['user_id'], start_level=session_context.get('level', 1),
+                                       level=rebuilt['level'], progress_percentage=rebuilt['progress_percentage'])
+        # Turns saved while the model was unavailable are scored first, so a level they passed
+        # applies to this turn
+        session_context, rescored_levels = rescore_pending_turns(session_context)
+        product_id = session_context.get('ProductId', '')
+        level = int(session_context.get('level', 1))
+        conversation_history = timed("prompt_build", build_conversation_history, session_context, salesperson_input)
     except Exception as e:
-        print("Error fetching conversation from DynamoDB:", e)
+        error(f"Error fetching conversation from DynamoDB: {e}")
         return {"statusCode": 500, "body": f"Error fetching conversation from DynamoDB: {str(e)}"}
 
-    # Retrieve product and persona details from Products table
+    # Retrieve the persona and system prompt for this level, cached across warm invocations
     try:
-        product_response = products_table.get_item(Key={'ProductId': product_id})
-        product_details = product_response['Item']
-        persona_info = product_details.get('ProductLevels', {}).get(f'Level{level}', {}).get('Persona', {})
-        persona_name = persona_info.get('Name', 'Customer')
-        persona_description = persona_info.get('Description', '')
-        product_name = product_details.get('ProductName', 'Product')
-        product_description = product_details.get('ProductDescription', 'No description available.')
+        level_prompt = timed("product_fetch", get_level_prompt, product_id, level, build_system_prompt)
     except Exception as e:
         return {"statusCode": 500, "body": f"Error fetching product data from DynamoDB: {str(e)}"}
+    persona_name = level_prompt["persona_name"]
 
-    # Generate the AI's response using SageMaker
-    system_prompt = (
-        f"As {persona_name}, you are {persona_description}. "
-        f"You are interested in {product_name}, which is {product_description}. "
-        f"At this level, you require more detailed information and convincing arguments. You must strictly behave as a customer only."
-    )
+    # Generate the AI's response using SageMaker.
+    # In combined mode the customer reply and its assessment come from one generation.
+    combined = SENTIMENT_MODE == "combined"
+    assessment_prompt = f"{COMBINED_ASSESSMENT_PROMPT}\n\n" if combined else ""
     prompt_message = (
-        f"{system_prompt}\n\n"
+        f"{level_prompt['system_prompt']}\n\n"
+        f"{assessment_prompt}"
         f"Conversation history:\n"
         f"{conversation_history}"
         f"{persona_name}:"
     )
+    metric("prompt_tokens", count_tokens(prompt_message))
 
     payload = {
         "inputs": prompt_message,
         "parameters": {
-            "max_new_tokens": 150,
+            "max_new_tokens": 190 if combined else 150,
             "temperature": 0.7,
             "top_p": 0.9,
-            "stop": [f"{persona_name}:", "Salesperson:", "Customer:", "\n\n"]
+            "stop": [f"{persona_name}:", "Salesperson:", "Customer:"] if combined else [f"{persona_name}:", "Salesperson:", "Customer:", "\n\n"]
         }
     }
 
+    time_to_first_token_ms = None
+
     try:
-        response = sagemaker_runtime.invoke_endpoint(
-            EndpointName=ENDPOINT_NAME,
-            ContentType="application/json",
-            Body=json.dumps(payload)
-        )
-        response_body = response['Body'].read().decode('utf-8')
-        
-        # Print the raw response for debugging
-        print("Raw SageMaker Response:", response_body)
+        degraded = False
+        try:
+            if emit is not None:
+                stop_markers = payload["parameters"]["stop"] + (["Conviction Score:"] if combined else [])
+                trimmer = StopTrimmer(persona_name, stop_markers)
+                raw_text, time_to_first_token_ms = timed("model", stream_generate, get_client('sagemaker-runtime'), ENDPOINT_NAME, payload, trimmer, emit)
+                # Keep exactly what the client saw, plus the hidden assessment in combined mode
+                generated_text = trimmer.text
+                assessment_match = re.search(r"conviction score:", raw_text, re.IGNORECASE) if combined else None
+                if assessment_match:
+                    generated_text += "\n" + raw_text[assessment_match.start():]
+                if time_to_first_token_ms is not None:
+                    metric("time_to_first_token_ms", time_to_first_token_ms, "Milliseconds")
+            else:
+                generated_text = timed("model", generate, ENDPOINT_NAME, payload)
 
-        response_payload = json.loads(response_body)
-        generated_text = response_payload[0].get('generated_text', '').strip() if isinstance(response_payload, list) else response_payload.get('generated_text', '').strip()
+                # Log the raw response for debugging
+                debug(f"Raw SageMaker Response: {generated_text}")
+                generated_text = generated_text.strip()
+        except ModelUnavailable as e:
+            # Answer in character and defer scoring rather than failing the turn
+            warning(f"Model unavailable ({e.reason}), replying in degraded mode")
+            degraded = True
+            generated_text = DEGRADED_REPLIES[int(session_context.get('turn_count', 0)) % len(DEGRADED_REPLIES)]
+            if emit is not None:
+                emit({"type": "delta", "text": generated_text})
+
+        # Separate the self-assessment from the reply when running in combined mode
+        sentiment_data = None
+        if combined and not degraded:
+            generated_text, sentiment_data = split_combined_output(generated_text)
 
         # Extract AI response after the last salesperson message
         if persona_name + ":" in generated_text:
@@ -131,82 +261,311 @@ def lambda_handler(event, context):
         if ai_response.endswith("\nSalesperson:"):
             ai_response = ai_response.rsplit("\nSalesperson:", 1)[0].strip()
 
-        print("Extracted AI response:", ai_response)  # Log the extracted response
+        debug(f"Extracted AI response: {ai_response}")  # Log the extracted response
 
         if not ai_response:
-            return {"statusCode": 500, "body": "Error: AI response is empty."}
-
-        # Call analyze_sentiment to get conviction, mood, and convinced status
-        sentiment_event = {"ai_response": ai_response, "session_id": session_id}
-        sentiment_response = lambda_client.invoke(
-            FunctionName="analyze_sentiment",
-            InvocationType="RequestResponse",
-            Payload=json.dumps(sentiment_event)
-        )
-        sentiment_data = json.loads(sentiment_response['Payload'].read().decode('utf-8'))["body"]
-        sentiment_data = json.loads(sentiment_data)
+            return stream_failure(emit, {"statusCode": 500, "body": "Error: AI response is empty."})
 
-        conviction_score = sentiment_data["conviction_score"]
-        mood = sentiment_data["mood"]
-        convinced = sentiment_data["convinced"]
+        # Get conviction, mood, and convinced status: already parsed in combined mode, scored
+        # in this process in inprocess mode (or when the combined output had no assessment),
+        # otherwise through the analyze_sentiment Lambda
+        sentiment_deferred = degraded
+        if sentiment_data is None and not degraded:
+            try:
+                sentiment_data = timed("sentiment", score_reply, ai_response, session_id)
+            except ModelUnavailable as e:
+                warning(f"Sentiment scoring deferred: {e}")
+                sentiment_deferred = True
 
-        # Initialize levels_passed and handle progression logic
-        levels_passed = []
-        if convinced:
-            # Add current level to levels_passed, reset progress and move to next level
-            levels_passed.append(level)
-            level += 1
-            progress_percentage = 0
-        else:
-            # Track progress without changing levels
-            progress_percentage = conviction_score
+        # Roll the new turn into the session context so the next turn reads one small item.
+        # It is written with the turn below, now that the assessment has set the new level.
+        session_context = append_messages(
+            session_context,
+            [f"Salesperson: {salesperson_input}", f"Customer: {ai_response}"]
+        )
+        session_context['turn_count'] = int(session_context.get('turn_count', 0)) + 1
+        chat_item = {
+            'session_id': session_id,
+            'timestamp': int(datetime.now().timestamp()),
+            'user_input': salesperson_input,
+            'ai_response': ai_response,
+            'ProductId': product_id,
+            'level': level
+        }
 
-        # Update PersonaProgress table with the latest level and progress
-        try:
-            persona_progress_table.put_item(
-                Item={
-                    'UserId': 'AI_Customer',
-                    'ProductId': product_id,
-                    'LevelsPassed': levels_passed,
-                    'ProgressPercentage': progress_percentage
-                }
-            )
-        except Exception as e:
-            return {"statusCode": 500, "body": f"Error saving progress to PersonaProgress table: {str(e)}"}
+        if sentiment_deferred:
+            # Progress is left as it was; the turn is kept in the context and scored by the next
+            # turn that reaches the model (see rescore_pending_turns)
+            chat_item['sentiment_pending'] = True
+            session_context['pending_turns'] = list(session_context.get('pending_turns') or []) + [
+                {'turn': session_context['turn_count'], 'chat_item': chat_item}
+            ]
+            conviction_score = mood = convinced = None
+            levels_passed = []
+            progress_percentage = None
+        else:
+            conviction_score = sentiment_data["conviction_score"]
+            mood = sentiment_data["mood"]
+            convinced = sentiment_data["convinced"]
 
-        # Save only the specified attributes to ChatHistory table
-        try:
-            chat_history_table.put_item(
-                Item={
-                    'session_id': session_id,
-                    'timestamp': int(datetime.now().timestamp()),
-                    'user_input': salesperson_input,
-                    'ai_response': ai_response,
-                    'ProductId': product_id,
-                    'level': level
-                }
-            )
-        except Exception as e:
-            return {"statusCode": 500, "body": f"Error saving chat to DynamoDB: {str(e)}"}
+            # Initialize levels_passed and handle progression logic
+            levels_passed = []
+            if convinced:
+                # Add current level to levels_passed, reset progress and move to next level
+                levels_passed.append(level)
+                level += 1
+                progress_percentage = 0
+            else:
+                # Track progress without changing levels
+                progress_percentage = conviction_score
+            session_context['level'] = level
+            session_context['progress_percentage'] = progress_percentage
+            # Scored turns keep their assessment for the leaderboard rollups and transcript exports
+            chat_item.update(conviction_score=conviction_score, mood=mood, convinced=convinced)
 
-        # Return final response
         response_data = {
             "session_id": session_id,
             "ai_response": ai_response,
             "conviction_score": conviction_score,
             "mood": mood,
             "convinced": convinced,
-            "levels_passed": levels_passed,
+            "levels_passed": rescored_levels + levels_passed,
             "current_level": level,
-            "progress_percentage": progress_percentage
+            "progress_percentage": progress_percentage,
+            "degraded": degraded,
+            "sentiment_deferred": sentiment_deferred
         }
-        return {
+        if emit is not None:
+            response_data["time_to_first_token_ms"] = time_to_first_token_ms
+        response = {
             "statusCode": 200,
             "body": json.dumps(convert_decimal(response_data))
         }
+        result_entry = result_write(session_id, *idempotency, response) if idempotency else None
+
+        # Save the chat row, the session state, the progress delta and the response for retries
+        # in one transaction so the tables cannot disagree; it is rejected if another turn of
+        # the session got there first
+        try:
+            with stage("turn_write"):
+                outcome = save_turn(chat_item, session_context, levels_passed, progress_percentage, result_entry)
+        except Exception as e:
+            error(f"Error saving turn of session {session_id}: {e}")
+            return stream_failure(emit, {"statusCode": 500, "body": f"Error saving turn to DynamoDB: {str(e)}"})
+        if outcome == CLAIM_LOST:
+            warning(f"Idempotency key of session {session_id} was taken over; the turn was not saved")
+            return None
+        if outcome == TURN_CONFLICT:
+            warning(f"Session {session_id} changed while the turn was generated; the turn was not saved")
+            metric("turn_conflicts", 1)
+            return stream_failure(emit, {
+                "statusCode": 409,
+                "body": json.dumps("Error: The session was updated by another request. Reload the conversation and resend the message.")
+            })
+
+        # Return final response
+        metric("degraded", int(degraded))
+        metric("sentiment_deferred", int(sentiment_deferred))
+        set_property("model_guard", model_stats())
+        if emit is not None:
+            # Scoring and persistence ran after the stream closed; tell the client the turn is final
+            emit(dict(convert_decimal(response_data), type="done"))
+        return response
+
+    except Exception as e:
+        return stream_failure(emit, {"statusCode": 500, "body": f"Error processing sentiment analysis: {str(e)}"})
+
+# Write the chat turn, the session context, the PersonaProgress update, the LatestSession
+# pointer of a newly reached level and result_entry (the stored response of an idempotent
+# request) with a single TransactWriteItems call, so nothing is written unless everything is,
+# and return one of the outcomes above. The context write is conditional on the version that
+# was read (TURN_CONFLICT when another turn of the session was saved first) and the stored
+# response on the idempotency claim (CLAIM_LOST when another attempt took it over).
+# A transaction cancelled by a conflicting transaction or throttling is retried with backoff;
+# any other failure is raised. A pointer that loses to a newer session of the level is dropped
+# and the rest written without it.
+# Progress is updated in place: the percentage is set and a newly passed level is appended,
+# instead of rewriting the whole item.
+def save_turn(chat_item, session_context, newly_passed_levels, progress_percentage, result_entry=None):
+    # The turn count and start level place the turn in its compact chat block (see Chat_store.py).
+    # Entries are named so a cancellation reason can be traced back to its write.
+    entries = {
+        'turn': turn_write(chat_item, int(session_context['turn_count']), int(session_context.get('start_level', session_context.get('level', 1))),
+                           session_context.get('created_at')),
+        'context': context_write(session_context)
+    }
+    if result_entry is not None:
+        entries['result'] = result_entry
+    client = get_client('dynamodb')
+    # A turn whose scoring was deferred leaves progress untouched, and so does a session whose
+    # user is unknown (it was started before StartConversation recorded one)
+    user_id = session_context.get('user_id')
+    if progress_percentage is not None and user_id:
+        entries['progress'] = progress_update(user_id, session_context['ProductId'], newly_passed_levels, progress_percentage)
+        if newly_passed_levels:
+            # The session continues at the next level, so resuming that level must find it
+            entries['pointer'] = latest_session_write(user_id, session_context['ProductId'], session_context['level'],
+                                                      session_context['session_id'], chat_item['timestamp'])
+    elif progress_percentage is not None:
+        warning(f"Session {session_context['session_id']} has no user_id; progress not recorded")
+    attempt = 0
+    while True:
+        try:
+            client.transact_write_items(TransactItems=list(entries.values()))
+            return TURN_SAVED
+        except client.exceptions.TransactionCanceledException as e:
+            reasons = dict(zip(entries, (reason.get('Code') for reason in e.response.get('CancellationReasons', []))))
+            if reasons.get('context') == 'ConditionalCheckFailed':
+                return TURN_CONFLICT
+            if reasons.get('result') == 'ConditionalCheckFailed':
+                return CLAIM_LOST
+            if reasons.get('pointer') == 'ConditionalCheckFailed':
+                # The trainee already started a newer session at that level; it stays the latest
+                del entries['pointer']
+                continue
+            attempt += 1
+            if attempt == TURN_WRITE_ATTEMPTS or not RETRYABLE_CANCELLATIONS & set(reasons.values()):
+                raise
+            warning(f"Turn write cancelled ({reasons}), retrying")
+            metric("turn_write_retries", 1)
+            time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+
+# The TransactWriteItems entry that sets a user's progress for a product
+def progress_update(user_id, product_id, newly_passed_levels, progress_percentage):
+    from boto3.dynamodb.types import TypeSerializer
+    serializer = TypeSerializer()
+    update_expression = "SET ProgressPercentage = :progress"
+    expression_values = {':progress': serializer.serialize(progress_percentage)}
+    if newly_passed_levels:
+        update_expression += ", LevelsPassed = list_append(if_not_exists(LevelsPassed, :empty), :passed)"
+        expression_values[':empty'] = serializer.serialize([])
+        expression_values[':passed'] = serializer.serialize(newly_passed_levels)
+
+    return {
+        'Update': {
+            'TableName': 'PersonaProgress',
+            'Key': {
+                'UserId': serializer.serialize(user_id),
+                'ProductId': serializer.serialize(product_id)
+            },
+            'UpdateExpression': update_expression,
+            'ExpressionAttributeValues': expression_values
+        }
+    }
 
+# Score the turns of a session that were saved while the model was unavailable, in order, the
+# way the live path would have: a convinced reply passes the level it was given at (unless the
+# session has left that level since), and the reply of the latest turn sets the progress.
+# The rescored chat rows, the context, the progress and the pointer of a newly reached level
+# are written in one transaction. Returns the context to continue the turn with and the levels
+# passed. While the model is still unavailable, or when the write fails, the turns stay pending
+# and the next turn tries again.
+def rescore_pending_turns(session_context):
+    pending = session_context.get('pending_turns') or []
+    if not pending:
+        return session_context, []
+    session_id = session_context['session_id']
+    try:
+        analyses = [timed("rescore", score_reply, entry['chat_item']['ai_response'], session_id) for entry in pending]
+    except ModelUnavailable as e:
+        warning(f"Pending turns of session {session_id} not rescored yet: {e}")
+        return session_context, []
     except Exception as e:
-        return {"statusCode": 500, "body": f"Error processing sentiment analysis: {str(e)}"}
+        error(f"Error rescoring pending turns of session {session_id}: {e}")
+        return session_context, []
+
+    context = {k: v for k, v in session_context.items() if k != 'pending_turns'}
+    level = int(context.get('level', 1))
+    start_level = int(context.get('start_level', level))
+    levels_passed = []
+    progress_percentage = None
+    rewrites = []
+    for entry, analysis in zip(pending, analyses):
+        pending_item = entry['chat_item']
+        scored_item = {k: v for k, v in pending_item.items() if k != 'sentiment_pending'}
+        scored_item.update(conviction_score=analysis["conviction_score"], mood=analysis["mood"], convinced=analysis["convinced"])
+        if analysis["convinced"] and int(pending_item['level']) == level:
+            levels_passed.append(level)
+            level += 1
+            progress_percentage = 0
+            # A convinced turn is stored with the level it unlocked
+            scored_item['level'] = level
+        elif int(entry['turn']) == int(context.get('turn_count', 0)) and int(pending_item['level']) == level:
+            # Only the latest turn sets the progress, and only at the level it was played at
+            progress_percentage = analysis["conviction_score"]
+        rewrites.append((pending_item, scored_item, int(entry['turn'])))
+    entries = {f'turn{index}': rewrite for index, rewrite in enumerate(turns_rewrite(rewrites, start_level))}
+    context['level'] = level
+    if progress_percentage is not None:
+        context['progress_percentage'] = progress_percentage
+    entries['context'] = context_write(context)
+    user_id = context.get('user_id')
+    if progress_percentage is not None and user_id:
+        entries['progress'] = progress_update(user_id, context['ProductId'], levels_passed, progress_percentage)
+        if levels_passed:
+            entries['pointer'] = latest_session_write(user_id, context['ProductId'], level, session_id, int(datetime.now().timestamp()))
+
+    client = get_client('dynamodb')
+    try:
+        with stage("rescore_write"):
+            try:
+                client.transact_write_items(TransactItems=list(entries.values()))
+            except client.exceptions.TransactionCanceledException as e:
+                reasons = dict(zip(entries, (reason.get('Code') for reason in e.response.get('CancellationReasons', []))))
+                if reasons.get('pointer') != 'ConditionalCheckFailed':
+                    raise
+                # The trainee already started a newer session at that level; it stays the latest
+                del entries['pointer']
+                client.transact_write_items(TransactItems=list(entries.values()))
+    except Exception as e:
+        warning(f"Rescored turns of session {session_id} not saved, keeping them pending: {e}")
+        return session_context, []
+    context['version'] = int(context.get('version') or 0) + 1
+    metric("turns_rescored", len(pending))
+    return context, levels_passed
+
+# Score a reply through the analyze_sentiment Lambda, or in this process (see SENTIMENT_MODE)
+def score_reply(ai_response, session_id):
+    if SENTIMENT_MODE == "lambda":
+        return invoke_sentiment_lambda(ai_response, session_id)
+    return analyze_response(ai_response)
+
+# Call the analyze_sentiment Lambda to get conviction, mood, and convinced status
+def invoke_sentiment_lambda(ai_response, session_id):
+    sentiment_event = {"ai_response": ai_response, "session_id": session_id}
+    sentiment_response = get_client('lambda').invoke(
+        FunctionName="analyze_sentiment",
+        InvocationType="RequestResponse",
+        Payload=json.dumps(sentiment_event)
+    )
+    result = json.loads(sentiment_response['Payload'].read().decode('utf-8'))
+    if result.get("statusCode") == 503:
+        raise ModelUnavailable(json.loads(result["body"]).get("reason", "failed"))
+    return json.loads(result["body"])
+
+# Split a combined generation into the customer reply and its parsed assessment.
+# Returns None for the assessment when the model did not produce one.
+def split_combined_output(generated_text):
+    match = re.search(r"conviction score:", generated_text, re.IGNORECASE)
+    if not match:
+        return generated_text, None
+    return generated_text[:match.start()].strip(), parse_analysis(generated_text[match.start():])
+
+# Build the persona system prompt for a product level; Product_cache keeps the result per warm container
+def build_system_prompt(product_details, level):
+    persona_info = product_details.get('ProductLevels', {}).get(f'Level{level}', {}).get('Persona', {})
+    persona_name = persona_info.get('Name', 'Customer')
+    persona_description = persona_info.get('Description', '')
+    product_name = product_details.get('ProductName', 'Product')
+    product_description = product_details.get('ProductDescription', 'No description available.')
+    return {
+        "persona_name": persona_name,
+        "system_prompt": (
+            f"As {persona_name}, you are {persona_description}. "
+            f"You are interested in {product_name}, which is {product_description}. "
+            f"At this level, you require more detailed information and convincing arguments. You must strictly behave as a customer only."
+        )
+    }
 
 # Helper function to convert Decimal types in dictionaries to int or float
 def convert_decimal(obj):
@@ -0,0 +1,278 @@
+import argparse
+import gzip
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+from Aws_clients import get_client, get_table
+from Chat_store import CHAT_BLOCK_TURNS, CHAT_RETENTION_SECONDS, CHAT_SESSIONS_TABLE, LEGACY_TABLE, items_from_block
+from Telemetry import info, metric, timed, traced
+
+# Transcript export for coaches: one row per turn with the text and the assessment stored
+# with it (conviction_score, mood, convinced), from both chat history layouts (see
+# Chat_store.py). The tables are read with a parallel scan: segment i of n is exported on its
+# own into its own part file, one scan page at a time, so memory is bounded by a page plus a
+# Parquet row group whatever the size of the export. A segment that is cut short (the Lambda
+# is about to time out) returns a cursor to continue from in a new part.
+#
+# Local: `python Export_transcripts.py out_dir --since 2026-09-01 --until 2026-10-01
+# --segments 8 --format parquet`. Lambda: invoke with {"export_id", "segment",
+# "total_segments", "since", "until", "format"} per segment (for example from a Step Functions
+# Map state) and invoke again with the returned "next" event until it is null; parts are
+# uploaded to EXPORT_BUCKET under EXPORT_PREFIX/<export_id>/.
+#
+# Parquet output needs the optional pyarrow package; NDJSON needs nothing extra.
+
+EXPORT_BUCKET = os.environ.get('EXPORT_BUCKET', '')
+EXPORT_PREFIX = os.environ.get('EXPORT_PREFIX', 'transcript-exports/')
+EXPORT_SEGMENTS = int(os.environ.get('EXPORT_SEGMENTS', '8'))
+PARQUET_ROW_GROUP_ROWS = int(os.environ.get('PARQUET_ROW_GROUP_ROWS', '10000'))
+# Part of the Lambda time limit kept for closing and uploading the part
+EXPORT_TIME_MARGIN_MS = int(os.environ.get('EXPORT_TIME_MARGIN_MS', '60000'))
+
+COLUMNS = [
+    ("session_id", "string"),
+    ("user_id", "string"),
+    ("product_id", "string"),
+    ("level", "int32"),
+    ("turn", "int32"),
+    ("timestamp", "int64"),
+    ("user_input", "string"),
+    ("ai_response", "string"),
+    ("conviction_score", "int32"),
+    ("mood", "string"),
+    ("convinced", "bool"),
+    ("sentiment_pending", "bool"),
+]
+SOURCES = {"compact": CHAT_SESSIONS_TABLE, "legacy": LEGACY_TABLE}
+
+@traced("Export_transcripts")
+def lambda_handler(event, context):
+    storage_format = event.get("format", "ndjson")
+    segment, total_segments = int(event.get("segment", 0)), int(event.get("total_segments", 1))
+    part = int(event.get("part", 0))
+    extension = "parquet" if storage_format == "parquet" else "ndjson.gz"
+    path = os.path.join(tempfile.gettempdir(), f"transcripts-{segment:05d}-{part:05d}.{extension}")
+
+    def out_of_time():
+        return context is not None and context.get_remaining_time_in_millis() < EXPORT_TIME_MARGIN_MS
+
+    writer = open_writer(path, storage_format)
+    try:
+        result = export_segment(segment, total_segments, writer, event.get("sources", list(SOURCES)),
+                                parse_date(event.get("since")), parse_date(event.get("until")), event.get("cursor"), out_of_time)
+    finally:
+        writer.close()
+    key = f"{EXPORT_PREFIX}{event.get('export_id', 'export')}/segment={segment:05d}/part-{part:05d}.{extension}"
+    if result["rows"]:
+        timed("upload", get_client('s3').upload_file, path, EXPORT_BUCKET, key)
+    os.remove(path)
+    metric("rows_exported", result["rows"])
+    info(f"Exported segment {segment}/{total_segments} part {part}: {result['rows']} rows")
+    return {
+        "rows": result["rows"],
+        "sessions": result["sessions"],
+        "key": key if result["rows"] else None,
+        # Invoke again with this event to continue the segment; null when it is finished
+        "next": dict(event, cursor=result["cursor"], part=part + 1) if result["cursor"] else None
+    }
+
+# Export one scan segment of the chat tables into writer. Turns are kept when since <= timestamp
+# < until (epoch seconds, either may be None). Returns counts and a cursor to resume from when
+# should_stop() asked to stop early, otherwise None.
+def export_segment(segment, total_segments, writer, sources=("compact", "legacy"), since=None, until=None, cursor=None, should_stop=None):
+    totals = {"rows": 0, "sessions": 0, "pages": 0, "cursor": None}
+    sources = [source for source in sources if source in SOURCES]
+    if cursor:
+        sources = sources[sources.index(cursor["source"]):]
+    for source in sources:
+        scan_kwargs = {'Segment': segment, 'TotalSegments': total_segments}
+        if source == "compact" and since is not None:
+            # A block expires a fixed time after its last turn, so older blocks can be skipped
+            scan_kwargs['FilterExpression'] = 'expires_at >= :oldest'
+            scan_kwargs['ExpressionAttributeValues'] = {':oldest': since + CHAT_RETENTION_SECONDS}
+        rows = SessionRows(source)
+        if cursor and cursor["source"] == source:
+            if cursor["key"]:
+                scan_kwargs['ExclusiveStartKey'] = cursor["key"]
+            rows.resume(cursor)
+        while True:
+            if should_stop is not None and totals["pages"] and should_stop():
+                totals["cursor"] = dict(rows.position(), source=source, key=scan_kwargs.get('ExclusiveStartKey'))
+                totals["sessions"] += rows.sessions
+                return totals
+            response = get_table(SOURCES[source]).scan(**scan_kwargs)
+            totals["pages"] += 1
+            for item in response.get('Items', []):
+                for row in rows.from_item(item):
+                    if (since is None or row["timestamp"] >= since) and (until is None or row["timestamp"] < until):
+                        writer.write(row)
+                        totals["rows"] += 1
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_kwargs['ExclusiveStartKey'] = {k: _plain(v) for k, v in response['LastEvaluatedKey'].items()}
+        totals["sessions"] += rows.sessions
+    return totals
+
+# Turns rows out of the items of one table. A scan returns the items of a session together and
+# in key order, so the session's user is known from its first item; when that item was not
+# part of the scan (filtered out by date), it is looked up once. The session being read when a
+# segment stops is carried in its cursor, so a resumed part keeps the user and the turn count
+# (which ChatHistory items do not store).
+class SessionRows:
+    def __init__(self, source):
+        self.source = source
+        self.session_id = None
+        self.user_id = None
+        self.turn = 0
+        self.sessions = 0
+
+    # The session being read, for a cursor
+    def position(self):
+        return {"session_id": self.session_id, "user_id": self.user_id, "turn": self.turn}
+
+    # Continue the session of a cursor from position(); it was counted by the earlier part
+    def resume(self, cursor):
+        self.session_id = cursor.get("session_id")
+        self.user_id = cursor.get("user_id")
+        self.turn = int(cursor.get("turn", 0))
+
+    def from_item(self, item):
+        if item['session_id'] != self.session_id:
+            self.session_id = item['session_id']
+            opening = int(item['block']) == 0 if self.source == "compact" else not item.get('user_input')
+            self.user_id = item.get('user_id') if opening else lookup_user(self.source, self.session_id)
+            self.turn = 0
+            self.sessions += 1
+        if self.source == "compact":
+            chat_items = items_from_block(item)
+            first_turn = int(item['block']) * CHAT_BLOCK_TURNS
+        else:
+            chat_items = [item]
+            first_turn = self.turn
+        rows = []
+        for offset, chat_item in enumerate(chat_items):
+            rows.append(transcript_row(chat_item, self.user_id, first_turn + offset))
+        self.turn = first_turn + len(chat_items)
+        return rows
+
+# The user of a session from its opening item
+def lookup_user(source, session_id):
+    if source == "compact":
+        item = get_table(CHAT_SESSIONS_TABLE).get_item(Key={'session_id': session_id, 'block': 0}, ProjectionExpression='user_id').get('Item')
+    else:
+        from boto3.dynamodb.conditions import Key
+        items = get_table(LEGACY_TABLE).query(KeyConditionExpression=Key('session_id').eq(session_id), Limit=1).get('Items', [])
+        item = items[0] if items else None
+    return (item or {}).get('user_id')
+
+def transcript_row(chat_item, user_id, turn):
+    conviction_score = chat_item.get('conviction_score')
+    convinced = chat_item.get('convinced')
+    return {
+        "session_id": chat_item['session_id'],
+        "user_id": user_id,
+        "product_id": chat_item.get('ProductId', ''),
+        "level": int(chat_item.get('level', 1)),
+        "turn": turn,
+        "timestamp": int(chat_item['timestamp']),
+        "user_input": chat_item.get('user_input', ""),
+        "ai_response": chat_item.get('ai_response', ""),
+        "conviction_score": None if conviction_score is None else int(conviction_score),
+        "mood": chat_item.get('mood'),
+        "convinced": None if convinced is None else bool(convinced),
+        "sentiment_pending": bool(chat_item.get('sentiment_pending', False))
+    }
+
+def open_writer(path, storage_format):
+    return ParquetWriter(path) if storage_format == "parquet" else NdjsonWriter(path)
+
+# Newline-delimited JSON, gzipped when the path ends in .gz
+class NdjsonWriter:
+    def __init__(self, path):
+        self.handle = gzip.open(path, 'wt', encoding='utf-8') if path.endswith('.gz') else open(path, 'w', encoding='utf-8')
+
+    def write(self, row):
+        self.handle.write(json.dumps(row) + "\n")
+
+    def close(self):
+        self.handle.close()
+
+# Parquet written one row group of PARQUET_ROW_GROUP_ROWS rows at a time
+class ParquetWriter:
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise RuntimeError("Parquet output needs the pyarrow package; use the ndjson format or install pyarrow") from e
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([(name, getattr(pyarrow, kind)()) for name, kind in COLUMNS])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression='zstd')
+        self.buffer = []
+
+    def write(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= PARQUET_ROW_GROUP_ROWS:
+            self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            self.writer.write_table(self.pyarrow.Table.from_pylist(self.buffer, schema=self.schema))
+            self.buffer = []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+# Export every segment into out_dir, workers segments at a time. Each worker thread reads
+# through its own Table objects (get_table is per thread, see Aws_clients.py).
+def export_all(out_dir, storage_format="ndjson", segments=EXPORT_SEGMENTS, sources=tuple(SOURCES), since=None, until=None, workers=None):
+    os.makedirs(out_dir, exist_ok=True)
+    extension = "parquet" if storage_format == "parquet" else "ndjson.gz"
+
+    def run(segment):
+        writer = open_writer(os.path.join(out_dir, f"part-{segment:05d}.{extension}"), storage_format)
+        try:
+            return export_segment(segment, segments, writer, sources, since, until)
+        finally:
+            writer.close()
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers or segments) as executor:
+        results = list(executor.map(run, range(segments)))
+    return {
+        "rows": sum(result["rows"] for result in results),
+        "sessions": sum(result["sessions"] for result in results),
+        "pages": sum(result["pages"] for result in results),
+        "segments": segments,
+        "seconds": round(time.perf_counter() - started_at, 2)
+    }
+
+# Epoch seconds of an ISO date or datetime (UTC unless it has an offset), or None
+def parse_date(value):
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+def _plain(value):
+    return int(value) if isinstance(value, Decimal) else value
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export session transcripts with per-turn scores.")
+    parser.add_argument("out_dir", help="Directory for the part files, one per segment")
+    parser.add_argument("--since", help="First day (or time) to include, ISO format, UTC")
+    parser.add_argument("--until", help="Day (or time) to stop before, ISO format, UTC")
+    parser.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson", help="Output format")
+    parser.add_argument("--segments", type=int, default=EXPORT_SEGMENTS, help="Parallel scan segments")
+    parser.add_argument("--workers", type=int, help="Segments exported at once (default: all)")
+    parser.add_argument("--source", choices=["compact", "legacy", "both"], default="both", help="Chat history layouts to read")
+    args = parser.parse_args()
+    sources = tuple(SOURCES) if args.source == "both" else (args.source,)
+    print(json.dumps(export_all(args.out_dir, args.format, args.segments, sources, parse_date(args.since), parse_date(args.until), args.workers), indent=2))
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+from Aws_clients import get_table
+from Telemetry import metric
+
+# Idempotency keys for turn submission. A client that may retry a turn sends the same
+# idempotency key with every attempt. The first attempt claims the key in TURN_REQUESTS_TABLE
+# and its response is stored in the same transaction as the turn. A retry then returns that
+# response without calling the model again, and a retry that arrives while the first attempt
+# is still running waits for it. Failed attempts release their claim so a retry can run again.
+
+TURN_REQUESTS_TABLE = os.environ.get('TURN_REQUESTS_TABLE', 'TurnRequests')
+# How long a stored response can be replayed; enable TTL on expires_at
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+# A claim older than this is assumed to belong to an attempt that died (e.g. a Lambda timeout)
+# and can be taken over; keep it above the function timeout
+IDEMPOTENCY_CLAIM_SECONDS = int(os.environ.get('IDEMPOTENCY_CLAIM_SECONDS', '90'))
+# How long a retry waits for an in-flight attempt; API Gateway gives up after 29 seconds
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '20'))
+IDEMPOTENCY_POLL_MS = int(os.environ.get('IDEMPOTENCY_POLL_MS', '250'))
+
+# The outcome of claiming a key. claim_id is set when this attempt owns the key and should
+# run the turn; otherwise response holds the stored response, or is None when the first
+# attempt was still running after IDEMPOTENCY_WAIT_SECONDS. mismatch is True when the key
+# was used for a different request.
+class Claim:
+    def __init__(self, claim_id=None, response=None, mismatch=False):
+        self.claim_id = claim_id
+        self.response = response
+        self.mismatch = mismatch
+
+# Helper function to read the idempotency key from the request body or the Idempotency-Key header
+def idempotency_key(event, body):
+    key = body.get("idempotency_key")
+    if not key:
+        headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+        key = headers.get('idempotency-key')
+    return str(key)[:128] if key else None
+
+# Hash of the request fields that must match for a retry to reuse a stored response
+def request_hash(*fields):
+    return hashlib.sha256(json.dumps(fields, default=str).encode('utf-8')).hexdigest()
+
+# Helper function to build the partition key of a request; keys are scoped to their session
+def request_key(session_id, key):
+    return f"{session_id}#{key}"
+
+# Claim a key for this attempt, or return the response of the attempt that holds it
+def claim(session_id, key, fingerprint):
+    table = get_table(TURN_REQUESTS_TABLE)
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        now = int(time.time())
+        claim_id = str(uuid.uuid4())
+        try:
+            table.put_item(
+                Item={
+                    'request_key': request_key(session_id, key),
+                    'status': 'in_progress',
+                    'claim_id': claim_id,
+                    'request_hash': fingerprint,
+                    'claimed_at': now,
+                    'expires_at': now + IDEMPOTENCY_TTL_SECONDS
+                },
+                # A stale claim is taken over; a completed request never is
+                ConditionExpression="attribute_not_exists(request_key) OR (#status = :in_progress AND claimed_at < :stale)",
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={':in_progress': 'in_progress', ':stale': now - IDEMPOTENCY_CLAIM_SECONDS}
+            )
+            return Claim(claim_id=claim_id)
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+        item = table.get_item(Key={'request_key': request_key(session_id, key)}, ConsistentRead=True).get('Item')
+        if item is None:
+            # Released by a failed attempt between the two calls; claim it again
+            continue
+        if item.get('request_hash') != fingerprint:
+            metric("idempotency_mismatch", 1)
+            return Claim(mismatch=True)
+        if item['status'] == 'complete':
+            metric("idempotent_replays", 1)
+            return Claim(response=json.loads(item['response']))
+        if time.monotonic() >= deadline:
+            metric("idempotency_wait_timeouts", 1)
+            return Claim()
+        time.sleep(IDEMPOTENCY_POLL_MS / 1000.0)
+
+# The TransactWriteItems entry that stores the response of a claimed request, on the condition
+# that the claim still belongs to this attempt
+def result_write(session_id, key, claim_id, fingerprint, response):
+    from boto3.dynamodb.types import TypeSerializer
+    serializer = TypeSerializer()
+    item = {
+        'request_key': request_key(session_id, key),
+        'status': 'complete',
+        'claim_id': claim_id,
+        'request_hash': fingerprint,
+        'response': json.dumps(response),
+        'expires_at': int(time.time()) + IDEMPOTENCY_TTL_SECONDS
+    }
+    return {'Put': {
+        'TableName': TURN_REQUESTS_TABLE,
+        'Item': {k: serializer.serialize(v) for k, v in item.items()},
+        'ConditionExpression': 'claim_id = :claim',
+        'ExpressionAttributeValues': {':claim': serializer.serialize(claim_id)}
+    }}
+
+# Give up a claim after a failed attempt so a retry runs the turn again
+def release(session_id, key, claim_id):
+    table = get_table(TURN_REQUESTS_TABLE)
+    try:
+        table.delete_item(
+            Key={'request_key': request_key(session_id, key)},
+            ConditionExpression="claim_id = :claim AND #status = :in_progress",
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':claim': claim_id, ':in_progress': 'in_progress'}
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
@@ -0,0 +1,52 @@
+from Aws_clients import get_table
+
+# LatestSession is the pointer table holding the most recent session per (user, product, level)
+
+# Helper function to build the sort key used for a product/level pair
+def latest_session_key(product_id, level):
+    return f"{product_id}#{int(level)}"
+
+# Record a session as the latest one for the user, ignoring older sessions so the
+# backfill and live writes can run side by side without clobbering each other
+def record_latest_session(user_id, product_id, level, session_id, timestamp):
+    try:
+        get_table('LatestSession').put_item(
+            Item={
+                'UserId': user_id,
+                'ProductLevel': latest_session_key(product_id, level),
+                'session_id': session_id,
+                'timestamp': timestamp
+            },
+            ConditionExpression="attribute_not_exists(UserId) OR #ts <= :ts",
+            ExpressionAttributeNames={'#ts': 'timestamp'},
+            ExpressionAttributeValues={':ts': timestamp}
+        )
+        return True
+    except get_table('LatestSession').meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+# The TransactWriteItems entry that records a session as the latest one, on the same
+# condition as record_latest_session
+def latest_session_write(user_id, product_id, level, session_id, timestamp):
+    from boto3.dynamodb.types import TypeSerializer
+    serializer = TypeSerializer()
+    item = {
+        'UserId': user_id,
+        'ProductLevel': latest_session_key(product_id, level),
+        'session_id': session_id,
+        'timestamp': timestamp
+    }
+    return {'Put': {
+        'TableName': 'LatestSession',
+        'Item': {k: serializer.serialize(v) for k, v in item.items()},
+        'ConditionExpression': "attribute_not_exists(UserId) OR #ts <= :ts",
+        'ExpressionAttributeNames': {'#ts': 'timestamp'},
+        'ExpressionAttributeValues': {':ts': serializer.serialize(timestamp)}
+    }}
+
+# Resolve the latest session for a user with a single key lookup
+def get_latest_session(user_id, product_id, level):
+    response = get_table('LatestSession').get_item(
+        Key={'UserId': user_id, 'ProductLevel': latest_session_key(product_id, level)}
+    )
+    return response.get('Item')
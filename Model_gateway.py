@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from Aws_clients import get_client
+from Model_guard import call_model
+
+# Shared entry point for non-streaming SageMaker generation. With MODEL_BATCH_MAX_WAIT_MS
+# above 0, concurrent requests for the same endpoint and parameters are collected for up to
+# that long (or until MODEL_BATCH_MAX_SIZE prompts are waiting) and sent as one invoke_endpoint
+# call with a list of inputs; each caller gets its own generated text back.
+#
+# Batching only helps where one process serves several requests at once: the sentiment thread
+# pool, a container deployment of the handlers, or the benchmark. A Lambda container handles
+# one request at a time, so it is off by default.
+
+MODEL_BATCH_MAX_SIZE = int(os.environ.get('MODEL_BATCH_MAX_SIZE', '8'))
+MODEL_BATCH_MAX_WAIT_MS = float(os.environ.get('MODEL_BATCH_MAX_WAIT_MS', '0'))
+
+# Collects submitted items into batches per group. A batch is sent by send_batch(group, items)
+# as soon as it is full, or by a background thread once its oldest item has waited max_wait_ms.
+# send_batch must return one result per item, in order.
+class MicroBatcher:
+    def __init__(self, send_batch, max_batch_size=8, max_wait_ms=10, max_concurrent_batches=16):
+        # Imported here so handlers with batching off do not pay for concurrent.futures at cold start
+        from concurrent.futures import ThreadPoolExecutor
+        self.send_batch = send_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_seconds = max_wait_ms / 1000.0
+        self._pending = OrderedDict()
+        self._condition = threading.Condition()
+        self._senders = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix="micro-batch")
+        self._flusher = None
+        self.stats = {"batches": 0, "items": 0, "full_batches": 0}
+
+    # Queue one item and return a Future for its result
+    def submit(self, item, group=None):
+        from concurrent.futures import Future
+        future = Future()
+        with self._condition:
+            batch = self._pending.get(group)
+            if batch is None:
+                batch = self._pending[group] = {"deadline": time.monotonic() + self.max_wait_seconds, "entries": []}
+            batch["entries"].append((item, future))
+            full = len(batch["entries"]) >= self.max_batch_size
+            if full:
+                del self._pending[group]
+            else:
+                self._ensure_flusher()
+                self._condition.notify()
+        if full:
+            # The caller that fills a batch sends it, so full batches never wait for the flusher
+            self._send(group, batch["entries"], full=True)
+        return future
+
+    # Submit one item and wait for its result
+    def call(self, item, group=None):
+        return self.submit(item, group).result()
+
+    def _ensure_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_expired, name="micro-batch-flusher", daemon=True)
+            self._flusher.start()
+
+    # Background loop sending batches whose wait time is over
+    def _flush_expired(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                now = time.monotonic()
+                expired = [group for group, batch in self._pending.items() if batch["deadline"] <= now]
+                if not expired:
+                    self._condition.wait(min(batch["deadline"] for batch in self._pending.values()) - now)
+                    continue
+                batches = [(group, self._pending.pop(group)["entries"]) for group in expired]
+            for group, entries in batches:
+                self._senders.submit(self._send, group, entries)
+
+    def _send(self, group, entries, full=False):
+        with self._condition:
+            self.stats["batches"] += 1
+            self.stats["items"] += len(entries)
+            self.stats["full_batches"] += int(full)
+        try:
+            results = self.send_batch(group, [item for item, _ in entries])
+            if len(results) != len(entries):
+                raise ValueError(f"Expected {len(entries)} results from the batch, got {len(results)}")
+        except Exception as e:
+            for _, future in entries:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(entries, results):
+            future.set_result(result)
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+# Generate text for one payload ({"inputs": prompt, "parameters": {...}}) and return the
+# generated_text string, batching with concurrent calls when enabled
+def generate(endpoint_name, payload):
+    if MODEL_BATCH_MAX_WAIT_MS <= 0:
+        return _invoke(endpoint_name, payload["inputs"], payload.get("parameters", {}))[0]
+    group = (endpoint_name, json.dumps(payload.get("parameters", {}), sort_keys=True))
+    return get_batcher().call(payload["inputs"], group)
+
+# The process-wide batcher, created on first use
+def get_batcher():
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = MicroBatcher(_send_batch, MODEL_BATCH_MAX_SIZE, MODEL_BATCH_MAX_WAIT_MS)
+        return _batcher
+
+def _send_batch(group, prompts):
+    endpoint_name, parameters = group
+    return _invoke(endpoint_name, prompts, json.loads(parameters))
+
+# Helper function to call the endpoint with one prompt or a list of prompts. A batch is
+# admitted and retried by Model_guard as a single request.
+def _invoke(endpoint_name, inputs, parameters):
+    batched = isinstance(inputs, list)
+
+    # The body is read inside the guarded call so a timeout while reading is retried too
+    def request():
+        response = get_client('sagemaker-runtime').invoke_endpoint(
+            EndpointName=endpoint_name,
+            ContentType="application/json",
+            Body=json.dumps({"inputs": inputs, "parameters": parameters})
+        )
+        return json.loads(response['Body'].read().decode('utf-8'))
+
+    response_payload = call_model(request)
+    if not isinstance(response_payload, list):
+        response_payload = [response_payload]
+    if not batched:
+        response_payload = response_payload[:1]
+    # Batched text-generation containers may wrap each result in its own list
+    return [(result[0] if isinstance(result, list) else result).get('generated_text', '') for result in response_payload]
@@ -0,0 +1,233 @@
+import os
+import random
+import threading
+import time
+
+# Admission control for SageMaker calls. Every invoke_endpoint goes through call_model(),
+# which applies, in order:
+#   - a circuit breaker that fails fast while the endpoint keeps failing,
+#   - a token bucket (MODEL_RATE_PER_SECOND, MODEL_BURST) and a concurrency limit
+#     (MODEL_MAX_CONCURRENCY); a request that cannot be admitted within MODEL_QUEUE_TIMEOUT_MS
+#     is shed,
+#   - up to MODEL_MAX_RETRIES retries of throttles, timeouts and 5xx errors with full-jitter
+#     backoff.
+# Shed and exhausted requests raise ModelUnavailable, which the handlers turn into a degraded
+# reply instead of a 500 that the client would retry. Limits are per container: in Lambda they
+# mostly bound the work of one warm container, while fleet-wide concurrency is set with the
+# functions' reserved concurrency.
+
+MODEL_GUARD_ENABLED = os.environ.get('MODEL_GUARD', '1') != '0'
+MODEL_RATE_PER_SECOND = float(os.environ.get('MODEL_RATE_PER_SECOND', '0'))  # 0 = no rate limit
+MODEL_BURST = int(os.environ.get('MODEL_BURST', '10'))
+MODEL_MAX_CONCURRENCY = int(os.environ.get('MODEL_MAX_CONCURRENCY', '8'))
+MODEL_QUEUE_TIMEOUT_MS = float(os.environ.get('MODEL_QUEUE_TIMEOUT_MS', '2000'))
+MODEL_MAX_RETRIES = int(os.environ.get('MODEL_MAX_RETRIES', '2'))
+MODEL_RETRY_BASE_MS = float(os.environ.get('MODEL_RETRY_BASE_MS', '100'))
+MODEL_RETRY_MAX_MS = float(os.environ.get('MODEL_RETRY_MAX_MS', '2000'))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('MODEL_BREAKER_FAILURES', '5'))
+BREAKER_RESET_SECONDS = float(os.environ.get('MODEL_BREAKER_RESET_SECONDS', '30'))
+
+# Error codes and exception names worth retrying; anything else (e.g. a validation error) is
+# raised to the caller unchanged and does not count against the breaker
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException", "ServiceUnavailable", "ServiceUnavailableException", "InternalFailure",
+    "InternalServerError", "ModelNotReadyException", "TooManyRequestsException",
+}
+RETRYABLE_EXCEPTIONS = {"ReadTimeoutError", "ConnectTimeoutError", "EndpointConnectionError", "ConnectionClosedError"}
+
+# Raised when a model call is shed or keeps failing; reason is one of "circuit_open",
+# "rate_limited", "queue_timeout" or "failed"
+class ModelUnavailable(Exception):
+    def __init__(self, reason, message=None):
+        super().__init__(message or f"Model unavailable: {reason}")
+        self.reason = reason
+
+# Token bucket refilled continuously at rate tokens per second, holding at most burst tokens
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Take one token, waiting until deadline (a time.monotonic() value) at most
+    def acquire(self, deadline):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait_seconds = (1 - self.tokens) / self.rate
+            if now + wait_seconds > deadline:
+                return False
+            time.sleep(wait_seconds)
+
+# Closed until failure_threshold consecutive failures, then open for reset_seconds, then
+# half-open: a single probe request decides whether to close again or re-open
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self.probing = False
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    # Give the half-open probe back when it was shed before reaching the endpoint
+    def release_probe(self):
+        with self.lock:
+            self.probing = False
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    _count("circuit_opened")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+_stats = {
+    "requests": 0, "admitted": 0, "retries": 0, "failures": 0, "circuit_opened": 0,
+    "shed_circuit_open": 0, "shed_rate_limited": 0, "shed_queue_timeout": 0,
+    "in_flight": 0, "queue_depth": 0, "max_queue_depth": 0,
+}
+_stats_lock = threading.Lock()
+_bucket = None
+_slots = None
+_breaker = None
+_setup_lock = threading.Lock()
+
+# Run fn(*args, **kwargs) (one endpoint request) under admission control and retries
+def call_model(fn, *args, **kwargs):
+    if not MODEL_GUARD_ENABLED:
+        return fn(*args, **kwargs)
+    bucket, slots, breaker = _limits()
+    _count("requests")
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            _shed("circuit_open")
+        try:
+            _admit(bucket, slots)
+        except ModelUnavailable:
+            breaker.release_probe()
+            raise
+        try:
+            return_value = fn(*args, **kwargs)
+            error = None
+        except Exception as e:
+            error = e
+        finally:
+            _release(slots)
+
+        if error is None:
+            breaker.record_success()
+            return return_value
+        if not is_retryable(error):
+            # The endpoint answered, so a bad request does not count against it
+            breaker.record_success()
+            raise error
+        breaker.record_failure()
+        _count("failures")
+        if attempt >= MODEL_MAX_RETRIES:
+            raise ModelUnavailable("failed", f"Model call failed after {attempt + 1} attempts: {error}") from error
+        attempt += 1
+        _count("retries")
+        # Full jitter spreads the retries of many callers instead of synchronizing them
+        time.sleep(random.uniform(0, min(MODEL_RETRY_MAX_MS, MODEL_RETRY_BASE_MS * 2 ** attempt)) / 1000.0)
+
+# Whether an error from the endpoint is transient (throttle, timeout, 5xx)
+def is_retryable(error):
+    if type(error).__name__ in RETRYABLE_EXCEPTIONS:
+        return True
+    response = getattr(error, 'response', None) or {}
+    code = response.get('Error', {}).get('Code', '')
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+    if code == "ModelError":
+        # The container's own status is reported separately from the API call's
+        status = response.get('OriginalStatusCode', status)
+    return code in RETRYABLE_ERROR_CODES or status == 429 or status >= 500
+
+# Counters for this container, including the shed rate and the current breaker state
+def model_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    shed = stats["shed_circuit_open"] + stats["shed_rate_limited"] + stats["shed_queue_timeout"]
+    stats["shed_rate"] = round(shed / stats["requests"], 4) if stats["requests"] else 0.0
+    stats["circuit_state"] = _breaker.state if _breaker is not None else "closed"
+    return stats
+
+# Drop the limiter, breaker and counters, e.g. after changing the settings
+def reset():
+    global _bucket, _slots, _breaker
+    with _setup_lock:
+        _bucket = _slots = _breaker = None
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
+
+def _limits():
+    global _bucket, _slots, _breaker
+    with _setup_lock:
+        if _breaker is None:
+            _bucket = TokenBucket(MODEL_RATE_PER_SECOND, MODEL_BURST) if MODEL_RATE_PER_SECOND > 0 else None
+            _slots = threading.BoundedSemaphore(MODEL_MAX_CONCURRENCY) if MODEL_MAX_CONCURRENCY > 0 else None
+            _breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+        return _bucket, _slots, _breaker
+
+# Helper function to wait for a token and a concurrency slot, or shed the request
+def _admit(bucket, slots):
+    deadline = time.monotonic() + MODEL_QUEUE_TIMEOUT_MS / 1000.0
+    with _stats_lock:
+        _stats["queue_depth"] += 1
+        _stats["max_queue_depth"] = max(_stats["max_queue_depth"], _stats["queue_depth"])
+    try:
+        if bucket is not None and not bucket.acquire(deadline):
+            _shed("rate_limited")
+        if slots is not None and not slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            _shed("queue_timeout")
+    finally:
+        with _stats_lock:
+            _stats["queue_depth"] -= 1
+    with _stats_lock:
+        _stats["admitted"] += 1
+        _stats["in_flight"] += 1
+
+def _release(slots):
+    if slots is not None:
+        slots.release()
+    with _stats_lock:
+        _stats["in_flight"] -= 1
+
+def _shed(reason):
+    _count(f"shed_{reason}")
+    raise ModelUnavailable(reason)
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
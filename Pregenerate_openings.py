@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+import random
+from Aws_clients import get_table
+from StartConversation import build_start_prompt, generate_opening_line
+from Telemetry import error, info, traced
+
+# Background job that keeps a pool of varied customer opening lines on each Products item,
+# under OpeningLines.Level<N> = {"prompt_hash", "lines"}. StartConversation picks one at
+# random instead of calling the model. Run it on a schedule and after editing a persona:
+# pools built from an older prompt are ignored until they are regenerated.
+
+OPENING_POOL_SIZE = int(os.environ.get('OPENING_POOL_SIZE', '8'))
+# Sampling settings for the pool; hotter than a live start so the lines differ
+OPENING_POOL_TEMPERATURE = float(os.environ.get('OPENING_POOL_TEMPERATURE', '0.9'))
+
+# Generate up to pool_size distinct opening lines for one prompt
+def generate_pool(prompt_message, pool_size):
+    lines = []
+    for _ in range(pool_size * 2):
+        if len(lines) >= pool_size:
+            break
+        payload = {
+            "inputs": prompt_message,
+            "parameters": {
+                "max_new_tokens": 100,
+                "temperature": OPENING_POOL_TEMPERATURE,
+                "top_p": 0.95,
+                "do_sample": True,
+                "seed": random.randrange(2 ** 31)
+            }
+        }
+        line = generate_opening_line(payload)
+        if line and line not in lines:
+            lines.append(line)
+    return lines
+
+# Rebuild the pools of one product. Version is bumped so warm containers drop their cached
+# copy of the product at the next revalidation.
+def refresh_product(product_id, pool_size=OPENING_POOL_SIZE, dry_run=False):
+    product = get_table('Products').get_item(Key={'ProductId': product_id})['Item']
+    opening_lines = {}
+    for level_key in sorted(product.get('ProductLevels', {})):
+        level = int(level_key[len('Level'):])
+        level_prompt = build_start_prompt(product, level)
+        opening_lines[level_key] = {
+            'prompt_hash': level_prompt['prompt_hash'],
+            'lines': generate_pool(level_prompt['prompt_message'], pool_size)
+        }
+
+    if not dry_run:
+        get_table('Products').update_item(
+            Key={'ProductId': product_id},
+            UpdateExpression="SET OpeningLines = :lines ADD #v :one",
+            ExpressionAttributeNames={'#v': 'Version'},
+            ExpressionAttributeValues={':lines': opening_lines, ':one': 1}
+        )
+    return {level_key: len(pool['lines']) for level_key, pool in opening_lines.items()}
+
+# Refresh the given products, or every product when none are given
+def refresh_all(product_ids=None, pool_size=OPENING_POOL_SIZE, dry_run=False):
+    if not product_ids:
+        product_ids = []
+        scan_kwargs = {'ProjectionExpression': 'ProductId'}
+        while True:
+            response = get_table('Products').scan(**scan_kwargs)
+            product_ids.extend(item['ProductId'] for item in response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return {product_id: refresh_product(product_id, pool_size, dry_run) for product_id in product_ids}
+
+@traced("Pregenerate_openings")
+def lambda_handler(event, context):
+    try:
+        result = refresh_all(event.get("product_ids"), event.get("pool_size", OPENING_POOL_SIZE), event.get("dry_run", False))
+        info(f"Opening line pools refreshed: {result}")
+        return {
+            "statusCode": 200,
+            "body": json.dumps(result)
+        }
+    except Exception as e:
+        error(f"Error refreshing opening line pools: {e}")
+        return {
+            "statusCode": 500,
+            "body": json.dumps(f"Error refreshing opening line pools: {str(e)}")
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate opening line pools for StartConversation.")
+    parser.add_argument("product_ids", nargs="*", help="Products to refresh (default: all)")
+    parser.add_argument("--pool-size", type=int, default=OPENING_POOL_SIZE, help="Opening lines per product level")
+    parser.add_argument("--dry-run", action="store_true", help="Generate the pools without saving them")
+    args = parser.parse_args()
+    print(json.dumps(refresh_all(args.product_ids, args.pool_size, args.dry_run), indent=2))
@@ -0,0 +1,68 @@
+import os
+import time
+from collections import OrderedDict
+from Aws_clients import get_table
+
+# Cache settings; products rarely change so a warm container keeps them for a few minutes
+PRODUCT_CACHE_TTL_SECONDS = float(os.environ.get('PRODUCT_CACHE_TTL_SECONDS', '300'))
+PRODUCT_CACHE_MAX_ENTRIES = int(os.environ.get('PRODUCT_CACHE_MAX_ENTRIES', '64'))
+
+# Module-level LRU shared by every invocation served by this container.
+# Each entry holds the product item, its Version attribute, an expiry time and the
+# prompts already built for its levels.
+_products = OrderedDict()
+
+# Fetch a product, serving it from the warm-container cache when possible.
+# Once an entry expires it is revalidated against the product's Version attribute with a
+# projected read, so unchanged products keep their precompiled prompts. Bumping Version
+# on a Products item rolls persona edits out to every container within the TTL.
+def get_product(product_id):
+    now = time.monotonic()
+    entry = _products.get(product_id)
+    if entry is not None:
+        if entry['expires_at'] > now:
+            _products.move_to_end(product_id)
+            return entry['item']
+        if entry['version'] is not None and _current_version(product_id) == entry['version']:
+            entry['expires_at'] = now + PRODUCT_CACHE_TTL_SECONDS
+            _products.move_to_end(product_id)
+            return entry['item']
+
+    product_response = get_table('Products').get_item(Key={'ProductId': product_id})
+    item = product_response['Item']
+    _products[product_id] = {
+        'item': item,
+        'version': item.get('Version'),
+        'expires_at': now + PRODUCT_CACHE_TTL_SECONDS,
+        'prompts': {}
+    }
+    _products.move_to_end(product_id)
+    while len(_products) > PRODUCT_CACHE_MAX_ENTRIES:
+        _products.popitem(last=False)
+    return item
+
+# Return the prompt for a product level, building it with builder(product_details, level)
+# only the first time it is requested for the cached product version
+def get_level_prompt(product_id, level, builder):
+    product_details = get_product(product_id)
+    prompts = _products[product_id]['prompts']
+    key = (f"Level{level}", builder.__module__, builder.__name__)
+    if key not in prompts:
+        prompts[key] = builder(product_details, level)
+    return prompts[key]
+
+# Drop one product, or the whole cache, from this container
+def invalidate(product_id=None):
+    if product_id is None:
+        _products.clear()
+    else:
+        _products.pop(product_id, None)
+
+# Helper function to read only the Version attribute of a product
+def _current_version(product_id):
+    response = get_table('Products').get_item(
+        Key={'ProductId': product_id},
+        ProjectionExpression='#v',
+        ExpressionAttributeNames={'#v': 'Version'}
+    )
+    return response.get('Item', {}).get('Version')
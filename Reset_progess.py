@@ -1,18 +1,16 @@
-import boto3
 import json
+from Aws_clients import get_table
+from Telemetry import error, timed, traced, warning
 
-# Initialize AWS services
-dynamodb = boto3.resource('dynamodb')
-persona_progress_table = dynamodb.Table('PersonaProgress')
-
+@traced("Reset_progess")
 def lambda_handler(event, context):
     # Parse 'body' for both API Gateway and direct Lambda invocation scenarios
     if 'body' in event:
         try:
             # If body is a string (from API Gateway), parse it as JSON
-            body = json.loads(event['body']) if isinstance(event['body'], str) else event['body']
+            body = timed("parse", json.loads, event['body']) if isinstance(event['body'], str) else event['body']
         except json.JSONDecodeError as e:
-            print("JSON decode error:", e)
+            warning(f"JSON decode error: {e}")
             return {
                 "statusCode": 400,
                 "body": json.dumps("Error: Invalid JSON in request body.")
@@ -34,7 +32,9 @@ def lambda_handler(event, context):
 
     try:
         # Delete the existing progress for the specified product
-        response = persona_progress_table.delete_item(
+        response = timed(
+            "progress_reset",
+            get_table('PersonaProgress').delete_item,
             Key={'UserId': user_id, 'ProductId': product_id}
         )
         
@@ -45,14 +45,14 @@ def lambda_handler(event, context):
                 "body": json.dumps("Progress reset to Level 1")
             }
         else:
-            print(f"Unexpected response from DynamoDB: {response}")
+            error(f"Unexpected response from DynamoDB: {response}")
             return {
                 "statusCode": 500,
                 "body": json.dumps("Error resetting progress: unexpected response from DynamoDB")
             }
 
     except Exception as e:
-        print(f"Error resetting progress: {e}")
+        error(f"Error resetting progress: {e}")
         return {
             "statusCode": 500,
             "body": json.dumps(f"Error resetting progress: {str(e)}")
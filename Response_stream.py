@@ -0,0 +1,143 @@
+import json
+import os
+import time
+from Aws_clients import get_client
+from Model_guard import call_model
+from Telemetry import warning
+
+# Connection management endpoint of the WebSocket API, e.g. https://<api-id>.execute-api.<region>.amazonaws.com/<stage>.
+# Needed when the API is served from a custom domain; otherwise it is derived from the request.
+WEBSOCKET_ENDPOINT = os.environ.get('WEBSOCKET_ENDPOINT', '')
+
+# Incrementally applies the stop-sequence trimming that the handlers run on the final text.
+# A leading "<persona>:" label is dropped, everything from the first stop marker on is cut,
+# and the tail that could still turn into a marker is held back until more text arrives.
+class StopTrimmer:
+    def __init__(self, persona_name, stop_markers):
+        self.prefix = f"{persona_name}:"
+        self.stop_markers = [marker for marker in stop_markers if marker]
+        self.holdback = max([len(marker) for marker in self.stop_markers] + [len(self.prefix)]) - 1
+        self.raw = ""
+        self.text = ""
+        self.pending = ""
+        self.started = False
+        self.stopped = False
+
+    # Feed a fragment of generated text; returns the text that is safe to show
+    def feed(self, fragment):
+        self.raw += fragment
+        emitted = self._advance(fragment)
+        self.text += emitted
+        return emitted
+
+    # Flush whatever was held back once the stream has closed
+    def finish(self):
+        if self.stopped:
+            return ""
+        emitted, self.pending = self.pending.rstrip(), ""
+        self.text += emitted
+        return emitted
+
+    # Helper function to move the pending text forward and return the part that can be shown
+    def _advance(self, fragment):
+        if self.stopped:
+            return ""
+        self.pending += fragment
+        if not self.started:
+            self.pending = self.pending.lstrip()
+            if len(self.pending) < len(self.prefix) and self.prefix.startswith(self.pending):
+                return ""
+            if self.pending.startswith(self.prefix):
+                self.pending = self.pending[len(self.prefix):].lstrip()
+            self.started = bool(self.pending)
+            if not self.started:
+                return ""
+        stop_index = min([self.pending.find(marker) for marker in self.stop_markers if marker in self.pending] or [-1])
+        if stop_index >= 0:
+            self.stopped = True
+            emitted, self.pending = self.pending[:stop_index].rstrip(), ""
+            return emitted
+        if len(self.pending) <= self.holdback:
+            return ""
+        emitted, self.pending = self.pending[:-self.holdback], self.pending[-self.holdback:]
+        return emitted
+
+# Helper function to turn the SageMaker event stream into text fragments. Text generation
+# containers send server-sent events ("data:{...}") that may be split across payload parts.
+def iter_stream_text(event_stream):
+    buffer = b""
+    for event in event_stream:
+        buffer += event.get('PayloadPart', {}).get('Bytes', b"")
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            text = _parse_stream_line(line)
+            if text:
+                yield text
+    text = _parse_stream_line(buffer)
+    if text:
+        yield text
+
+# Helper function to read the token text out of one streamed line
+def _parse_stream_line(line):
+    line = line.strip()
+    if line.startswith(b"data:"):
+        line = line[len(b"data:"):].strip()
+    if not line:
+        return ""
+    try:
+        data = json.loads(line)
+    except json.JSONDecodeError:
+        return ""
+    if isinstance(data, list):
+        data = data[0] if data else {}
+    token = data.get('token')
+    if token is not None:
+        return "" if token.get('special') else token.get('text', "")
+    return data.get('generated_text') or ""
+
+# Generate with invoke_endpoint_with_response_stream, passing trimmed text to emit() as it
+# arrives. Returns the full raw text and the time to first emitted token in milliseconds;
+# the trimmed text that was shown is left in trimmer.text. Model_guard admits and retries the
+# request that opens the stream; a stream that fails part-way is not retried, since its
+# text has already been shown.
+def stream_generate(sagemaker_runtime, endpoint_name, payload, trimmer, emit):
+    started_at = time.perf_counter()
+    time_to_first_token_ms = None
+    response = call_model(
+        sagemaker_runtime.invoke_endpoint_with_response_stream,
+        EndpointName=endpoint_name,
+        ContentType="application/json",
+        Body=json.dumps(dict(payload, stream=True))
+    )
+    for fragment in iter_stream_text(response['Body']):
+        text = trimmer.feed(fragment)
+        if text:
+            if time_to_first_token_ms is None:
+                time_to_first_token_ms = round((time.perf_counter() - started_at) * 1000, 1)
+            emit({"type": "delta", "text": text})
+    text = trimmer.finish()
+    if text:
+        if time_to_first_token_ms is None:
+            time_to_first_token_ms = round((time.perf_counter() - started_at) * 1000, 1)
+        emit({"type": "delta", "text": text})
+    return trimmer.raw, time_to_first_token_ms
+
+# Build an emitter that posts messages to the API Gateway WebSocket connection the request
+# came in on, or None when the request did not ask for streaming or did not come over a
+# WebSocket. The connection and endpoint are taken from the requestContext that API Gateway
+# sets, never from the body, so a caller can only stream to its own connection.
+def websocket_emitter(event, body):
+    request_context = event.get("requestContext") or {}
+    connection_id = request_context.get("connectionId")
+    if not body.get("stream") or not connection_id:
+        return None
+    endpoint_url = WEBSOCKET_ENDPOINT or f"https://{request_context['domainName']}/{request_context['stage']}"
+    client = get_client('apigatewaymanagementapi', endpoint_url=endpoint_url)
+
+    # A client that disconnects mid-stream must not abort scoring and persistence of the turn
+    def emit(message):
+        try:
+            client.post_to_connection(ConnectionId=connection_id, Data=json.dumps(message).encode('utf-8'))
+        except Exception as e:
+            warning(f"Error streaming to connection {connection_id}: {e}")
+    return emit
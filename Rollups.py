@@ -0,0 +1,173 @@
+import os
+from decimal import Decimal
+
+# Precomputed leaderboard and analytics rollups, maintained incrementally from ChatHistory
+# inserts by Aggregate_rollups and read by Team_dashboard. All rollups live in one table
+# (ROLLUPS_TABLE, partition key RollupKey, sort key Member):
+#   PRODUCT#<product_id>                 / ALL      totals for a product across all teams
+#   TEAM#<team_id>                       / ALL      totals for a team across all products
+#   TEAM#<team_id>#PRODUCT#<product_id>  / ALL      totals for a team on one product
+#   LEADERBOARD#<team_id>                / <UserId> one row per trainee of the team
+#   SESSION#<session_id>                 / STATE    aggregation state of a session (expires)
+#
+# Leaderboard rows also keep leaderboard_rank = levels_passed * LEADERBOARD_RANK_SCALE - turns,
+# the sort key of the global secondary index LEADERBOARD_INDEX (partition key RollupKey), so a
+# team's top trainees (most levels passed, fewest turns on a tie) are the first items of a
+# descending index query. Only leaderboard rows have the attribute, so the index holds nothing else.
+#
+# Totals are plain number attributes updated with ADD, so a read is one get_item:
+#   sessions, turns, scored_turns, levels_passed, passed_L<n> (levels passed per level),
+#   convinced, turns_to_convince (sum of the turns each passed level took), and
+#   conviction_sum_L<n>_T<m> / conviction_count_L<n>_T<m> for the conviction score at turn m
+#   of level n, from which the average trajectory is derived.
+
+ROLLUPS_TABLE = os.environ.get('ROLLUPS_TABLE', 'Rollups')
+# Turns tracked per level in the conviction trajectory; later turns count towards the last one
+ROLLUP_TRAJECTORY_TURNS = int(os.environ.get('ROLLUP_TRAJECTORY_TURNS', '12'))
+LEADERBOARD_INDEX = os.environ.get('LEADERBOARD_INDEX', 'LeaderboardRank')
+# Larger than any trainee's turn count, so one more level passed outranks any number of turns
+LEADERBOARD_RANK_SCALE = 10 ** 9
+TOTAL_MEMBER = "ALL"
+STATE_MEMBER = "STATE"
+UNKNOWN_USER = "unknown"
+
+def product_key(product_id):
+    return f"PRODUCT#{product_id}"
+
+def team_key(team_id):
+    return f"TEAM#{team_id}"
+
+def team_product_key(team_id, product_id):
+    return f"TEAM#{team_id}#PRODUCT#{product_id}"
+
+def leaderboard_key(team_id):
+    return f"LEADERBOARD#{team_id}"
+
+def session_key(session_id):
+    return f"SESSION#{session_id}"
+
+# Leaderboard sort key of a trainee's totals; a sum of ranks is the rank of the summed totals,
+# so it is kept up to date with ADD like the counters
+def leaderboard_rank(levels_passed, turns):
+    return levels_passed * LEADERBOARD_RANK_SCALE - turns
+
+# Turn a ChatHistory item (as stored, or the NewImage of a stream record) into an event.
+# The opening row of a session has an empty user_input. sequence is the stream record's
+# sequence number, or None when replaying stored rows. rescore marks a turn that was counted
+# when it was saved unscored and now has its assessment.
+def event_from_item(item, sequence=None, rescore=False):
+    conviction_score = item.get('conviction_score')
+    return {
+        'session_id': item['session_id'],
+        'timestamp': int(item['timestamp']),
+        'sequence': sequence,
+        'start': not item.get('user_input'),
+        'user_id': item.get('user_id'),
+        'product_id': item.get('ProductId', ''),
+        'level': int(item.get('level', 1)),
+        'conviction_score': None if conviction_score is None else int(conviction_score),
+        'convinced': bool(item.get('convinced', False)),
+        'rescore': rescore
+    }
+
+# Aggregation state of a session seen for the first time. Sessions whose opening row was
+# written before the pipeline existed cannot be attributed to a trainee.
+def new_session_state(event, team_id):
+    return {
+        'user_id': event['user_id'] or UNKNOWN_USER,
+        'team_id': team_id,
+        'product_id': event['product_id'],
+        'turns': 0,
+        'turns_in_level': 0,
+        'last_timestamp': -1,
+        'last_sequence': -1,
+        'version': 0
+    }
+
+# Whether an event was already applied to a state. Stream records are delivered at least
+# once and are compared by sequence number, since a turn written in the same second as the
+# previous one replaces its row under the same timestamp. Stored rows are compared by timestamp.
+def already_applied(state, event):
+    if event['sequence'] is not None and state.get('last_sequence', -1) >= 0:
+        return event['sequence'] <= state['last_sequence']
+    return event['timestamp'] <= state['last_timestamp']
+
+# Apply one event to a session's state. Returns the new state and the counter deltas as
+# {(RollupKey, Member): {attribute: amount}}, or (state, None) for an event that was already
+# counted.
+def apply_event(state, event):
+    if already_applied(state, event):
+        return state, None
+    state = dict(state, last_timestamp=max(event['timestamp'], state['last_timestamp']))
+    if event['sequence'] is not None:
+        state['last_sequence'] = event['sequence']
+    totals = {}
+    member = {}
+    if event['start']:
+        totals['sessions'] = member['sessions'] = 1
+    else:
+        if not event.get('rescore'):
+            state['turns'] += 1
+            state['turns_in_level'] += 1
+            totals['turns'] = member['turns'] = 1
+        if event['conviction_score'] is not None:
+            # A convinced turn is written with the level it unlocked
+            level = event['level'] - 1 if event['convinced'] else event['level']
+            turn = min(state['turns_in_level'], ROLLUP_TRAJECTORY_TURNS)
+            totals['scored_turns'] = 1
+            totals[f'conviction_sum_L{level}_T{turn:02d}'] = event['conviction_score']
+            totals[f'conviction_count_L{level}_T{turn:02d}'] = 1
+            if event['convinced']:
+                totals['levels_passed'] = member['levels_passed'] = 1
+                totals[f'passed_L{level}'] = 1
+                totals['convinced'] = 1
+                totals['turns_to_convince'] = state['turns_in_level']
+                state['turns_in_level'] = 0
+
+    # Also written for a session start, so a trainee without turns is ranked too
+    member['leaderboard_rank'] = leaderboard_rank(member.get('levels_passed', 0), member.get('turns', 0))
+
+    team_id, product_id = state['team_id'], state['product_id']
+    deltas = {
+        (product_key(product_id), TOTAL_MEMBER): totals,
+        (team_key(team_id), TOTAL_MEMBER): totals,
+        (team_product_key(team_id, product_id), TOTAL_MEMBER): totals,
+        (leaderboard_key(team_id), state['user_id']): member,
+    }
+    return state, {key: dict(values) for key, values in deltas.items() if values}
+
+# Add counter deltas into an accumulator of the same shape
+def merge_deltas(into, deltas):
+    for key, values in deltas.items():
+        target = into.setdefault(key, {})
+        for attribute, amount in values.items():
+            target[attribute] = target.get(attribute, 0) + amount
+    return into
+
+# Derived figures of a total rollup item for a dashboard
+def summarize(item):
+    item = item or {}
+
+    def number(name):
+        return int(item.get(name, 0))
+
+    trajectory = {}
+    for name in item:
+        if name.startswith('conviction_sum_L'):
+            level, turn = name[len('conviction_sum_L'):].split('_T')
+            count = number(f'conviction_count_L{level}_T{turn}')
+            if count:
+                trajectory.setdefault(f'Level{level}', {})[int(turn)] = round(float(Decimal(item[name]) / count), 1)
+    return {
+        "sessions": number('sessions'),
+        "turns": number('turns'),
+        "scored_turns": number('scored_turns'),
+        "levels_passed": number('levels_passed'),
+        "levels_passed_by_level": {f"Level{name[len('passed_L'):]}": number(name) for name in sorted(item) if name.startswith('passed_L')},
+        "avg_turns_to_convince": round(number('turns_to_convince') / number('convinced'), 2) if number('convinced') else None,
+        # Average conviction score at each turn of a level, in turn order
+        "conviction_trajectory": {
+            level: [{"turn": turn, "avg_conviction": turns[turn]} for turn in sorted(turns)]
+            for level, turns in sorted(trajectory.items())
+        }
+    }
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from Aws_clients import get_table
+from Telemetry import warning
+
+# Content-addressed cache for sentiment results. Personas repeat themselves a lot, so a
+# reply is keyed on a hash of its normalized text: an in-memory LRU serves repeats within a
+# warm container and an optional DynamoDB tier shares results across containers.
+
+SENTIMENT_CACHE_MAX_ENTRIES = int(os.environ.get('SENTIMENT_CACHE_MAX_ENTRIES', '2048'))
+# DynamoDB tier; leave SENTIMENT_CACHE_TABLE unset to keep the cache in memory only
+SENTIMENT_CACHE_TABLE = os.environ.get('SENTIMENT_CACHE_TABLE', '')
+SENTIMENT_CACHE_TTL_SECONDS = int(os.environ.get('SENTIMENT_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+_stats = {"memory_hits": 0, "dynamodb_hits": 0, "misses": 0}
+
+# Bumped when the normalization changes, so entries stored under the old keys are not reused
+CACHE_KEY_VERSION = "2"
+
+# Helper function to hash a reply after folding case and whitespace. Punctuation is kept:
+# "I'll take it." and "I'll take it?" score differently.
+def cache_key(ai_response):
+    text = re.sub(r"\s+", " ", ai_response.lower()).strip()
+    return hashlib.sha256(f"{CACHE_KEY_VERSION}:{text}".encode('utf-8')).hexdigest()
+
+# Look up a cached analysis, trying memory first and then DynamoDB
+def get_cached(ai_response):
+    key = cache_key(ai_response)
+    with _lock:
+        if key in _entries:
+            _entries.move_to_end(key)
+            _stats["memory_hits"] += 1
+            return dict(_entries[key])
+
+    if SENTIMENT_CACHE_TABLE:
+        try:
+            item = get_table(SENTIMENT_CACHE_TABLE).get_item(Key={'text_hash': key}).get('Item')
+        except Exception as e:
+            warning(f"Error reading sentiment cache: {e}")
+            item = None
+        # TTL deletion can lag behind expiry, so expired items are treated as misses
+        if item and int(item.get('expires_at', 0)) > time.time():
+            analysis = {
+                "conviction_score": int(item['conviction_score']),
+                "mood": item['mood'],
+                "convinced": bool(item['convinced'])
+            }
+            _remember(key, analysis)
+            with _lock:
+                _stats["dynamodb_hits"] += 1
+            return dict(analysis)
+
+    with _lock:
+        _stats["misses"] += 1
+    return None
+
+# Store a fresh analysis in both tiers
+def put_cached(ai_response, analysis):
+    key = cache_key(ai_response)
+    _remember(key, analysis)
+    if SENTIMENT_CACHE_TABLE:
+        try:
+            get_table(SENTIMENT_CACHE_TABLE).put_item(
+                Item={
+                    'text_hash': key,
+                    'conviction_score': int(analysis["conviction_score"]),
+                    'mood': analysis["mood"],
+                    'convinced': bool(analysis["convinced"]),
+                    'expires_at': int(time.time()) + SENTIMENT_CACHE_TTL_SECONDS
+                }
+            )
+        except Exception as e:
+            warning(f"Error writing sentiment cache: {e}")
+
+# Hit/miss counters for this container
+def cache_stats():
+    with _lock:
+        return dict(_stats, entries=len(_entries))
+
+# Helper function to add an entry to the in-memory LRU
+def _remember(key, analysis):
+    with _lock:
+        _entries[key] = {
+            "conviction_score": analysis["conviction_score"],
+            "mood": analysis["mood"],
+            "convinced": analysis["convinced"]
+        }
+        _entries.move_to_end(key)
+        while len(_entries) > SENTIMENT_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
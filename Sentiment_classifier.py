@@ -0,0 +1,194 @@
+import functools
+import os
+import re
+import threading
+import zlib
+from Telemetry import warning
+
+# In-process conviction scorer for Analyze_sentiment. A customer reply is embedded as hashed
+# word and character n-grams (no vocabulary to ship) and a linear model trained on historical
+# scored turns predicts its conviction score, mood and convinced status. One reply is scored
+# in tens of microseconds; score_batch scores a whole backfill in one vectorized pass.
+#
+# The model is an .npz file written by bench/train_sentiment_classifier.py and loaded from
+# SENTIMENT_MODEL_PATH (package it with the function). It needs the optional numpy package
+# (e.g. the AWS SDK for pandas layer); without either the classifier is skipped and replies
+# go to the SageMaker endpoint as before.
+
+SENTIMENT_MODEL_PATH = os.environ.get('SENTIMENT_MODEL_PATH', '')
+# Predictions less sure than this defer to the sentiment cache and the model
+CLASSIFIER_MIN_CONFIDENCE = float(os.environ.get('CLASSIFIER_MIN_CONFIDENCE', '0.5'))
+
+MOODS = ("Positive", "Neutral", "Skeptical", "Negative")
+# Model outputs, one weight column each: conviction score / 100, convinced, one per mood
+OUTPUTS = ("conviction_score", "convinced") + tuple(f"mood_{mood}" for mood in MOODS)
+CHAR_NGRAM = 3
+
+_WORD_PATTERN = re.compile(r"[a-z0-9']+|[?!]")
+# CRC seeds that keep a word, a word pair and a trigram with the same bytes apart
+_WORD_SEED, _PAIR_SEED, _CHAR_SEED = 1, 2, 3
+
+_model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+# Helper function to fold case and curly quotes before extracting features
+def _normalize(text):
+    return text.lower().replace("’", "'").replace("‘", "'")
+
+# Hashed feature indices of a reply: its words, word pairs and the character trigrams of each
+# word, each family hashed with its own seed and folded into 2**bits buckets. A reply without
+# any words returns an empty list.
+def feature_indices(text, bits):
+    mask = (1 << bits) - 1
+    words = [word.encode('utf-8') for word in _WORD_PATTERN.findall(_normalize(text))]
+    indices = []
+    for word in words:
+        indices.extend(_word_features(word, bits))
+    indices.extend(zlib.crc32(second, zlib.crc32(first + b" ", _PAIR_SEED)) & mask for first, second in zip(words, words[1:]))
+    return indices
+
+# Helper function to hash a word and its trigrams; replies share most of their words, so
+# these are memoized and a warm container hashes little more than the word pairs
+@functools.lru_cache(maxsize=65536)
+def _word_features(word, bits):
+    mask = (1 << bits) - 1
+    padded = b"<" + word + b">"
+    trigrams = (zlib.crc32(padded[start:start + CHAR_NGRAM], _CHAR_SEED) & mask for start in range(len(padded) - CHAR_NGRAM + 1))
+    return (zlib.crc32(word, _WORD_SEED) & mask, *trigrams)
+
+# Sparse feature rows of several replies as (indices, values, offsets): the features of reply
+# i are indices[offsets[i]:offsets[i + 1]], each weighted so a reply's vector has unit length
+def sparse_features(texts, bits):
+    import numpy as np
+    rows = [feature_indices(text, bits) for text in texts]
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(row) for row in rows])
+    indices = np.fromiter((index for row in rows for index in row), dtype=np.int64, count=int(offsets[-1]))
+    lengths = np.diff(offsets)
+    values = np.repeat(1.0 / np.sqrt(np.maximum(lengths, 1)), lengths)
+    return indices, values, offsets
+
+# A trained model: weights has one row per feature bucket and one column per output
+class SentimentModel:
+    def __init__(self, weights, bias, bits):
+        self.weights = weights
+        self.bias = bias
+        self.bits = bits
+
+    # Raw outputs of several replies, one row each
+    def outputs(self, texts):
+        import numpy as np
+        indices, values, offsets = sparse_features(texts, self.bits)
+        contributions = self.weights[indices] * values[:, None]
+        # Row sums of the sparse product from a running total, which also handles empty replies
+        totals = np.zeros((len(indices) + 1, self.weights.shape[1]))
+        np.cumsum(contributions, axis=0, out=totals[1:])
+        return totals[offsets[1:]] - totals[offsets[:-1]] + self.bias
+
+    # Raw outputs of one reply; skips the batch bookkeeping
+    def output(self, text):
+        indices = feature_indices(text, self.bits)
+        if not indices:
+            return self.bias
+        return self.weights[indices].sum(axis=0) / len(indices) ** 0.5 + self.bias
+
+    def save(self, path):
+        import numpy as np
+        np.savez(path, weights=self.weights, bias=self.bias, bits=self.bits, outputs=OUTPUTS)
+
+    @classmethod
+    def load(cls, path):
+        import numpy as np
+        with np.load(path) as data:
+            if tuple(data['outputs']) != OUTPUTS:
+                raise ValueError(f"Model outputs {tuple(data['outputs'])} do not match {OUTPUTS}")
+            return cls(data['weights'].astype(np.float32), data['bias'].astype(np.float64), int(data['bits']))
+
+# Turn the outputs of one reply into an analysis with a confidence between 0 and 1: how far
+# the convinced output is from its threshold and the mood output from the runner-up
+def analysis_from_output(output):
+    mood_outputs = [float(value) for value in output[2:]]
+    ranked = sorted(range(len(MOODS)), key=mood_outputs.__getitem__, reverse=True)
+    convinced = float(output[1])
+    confidence = min(1.0, abs(convinced - 0.5) * 2, mood_outputs[ranked[0]] - mood_outputs[ranked[1]])
+    return {
+        "conviction_score": min(100, max(0, int(round(float(output[0]) * 100)))),
+        "mood": MOODS[ranked[0]],
+        "convinced": convinced >= 0.5,
+        "confidence": round(confidence, 3)
+    }
+
+# Fit a model on replies and their analyses by ridge regression. The normal equations are
+# accumulated a chunk of replies at a time, so memory depends on bits rather than on the
+# number of replies; keep bits at 13 or below (the system is 2**bits square).
+def train(texts, analyses, bits=12, alpha=1.0, chunk_rows=2048):
+    import numpy as np
+    dimension = 1 << bits
+    targets = np.array([[analysis["conviction_score"] / 100.0, float(bool(analysis["convinced"]))] +
+                        [float(analysis["mood"] == mood) for mood in MOODS] for analysis in analyses])
+    # The last column is a constant feature that carries the bias
+    gram = np.zeros((dimension + 1, dimension + 1))
+    moments = np.zeros((dimension + 1, len(OUTPUTS)))
+    for start in range(0, len(texts), chunk_rows):
+        indices, values, offsets = sparse_features(texts[start:start + chunk_rows], bits)
+        dense = np.zeros((len(offsets) - 1, dimension + 1))
+        rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        np.add.at(dense, (rows, indices), values)
+        dense[:, dimension] = 1.0
+        gram += dense.T @ dense
+        moments += dense.T @ targets[start:start + chunk_rows]
+    penalty = np.full(dimension + 1, float(alpha))
+    penalty[dimension] = 1e-6
+    gram[np.diag_indices_from(gram)] += penalty
+    solution = np.linalg.solve(gram, moments)
+    return SentimentModel(solution[:dimension].astype(np.float32), solution[dimension], bits)
+
+# The model loaded from SENTIMENT_MODEL_PATH, or None when it is not configured or numpy is missing
+def get_model():
+    global _model, _model_loaded
+    if _model_loaded:
+        return _model
+    with _model_lock:
+        if not _model_loaded:
+            if SENTIMENT_MODEL_PATH:
+                try:
+                    # Imported here so handlers without a model do not pay for numpy at cold start
+                    _model = SentimentModel.load(SENTIMENT_MODEL_PATH)
+                except Exception as e:
+                    warning(f"Sentiment classifier unavailable, using the model endpoint: {e}")
+            _model_loaded = True
+    return _model
+
+# Score one reply; returns the analysis with its confidence, or None without a model
+def score_reply(ai_response):
+    model = get_model()
+    if model is None:
+        return None
+    return analysis_from_output(model.output(ai_response))
+
+# Score many replies in one pass, e.g. for a backfill; returns None without a model
+def score_batch(ai_responses):
+    model = get_model()
+    if model is None:
+        return None
+    import numpy as np
+    outputs = model.outputs(list(ai_responses))
+    ranked = np.sort(outputs[:, 2:], axis=1)
+    confidence = np.minimum(np.minimum(1.0, np.abs(outputs[:, 1] - 0.5) * 2), ranked[:, -1] - ranked[:, -2])
+    scores = np.clip(np.rint(outputs[:, 0] * 100), 0, 100).astype(int)
+    moods = np.argmax(outputs[:, 2:], axis=1)
+    return [{
+        "conviction_score": int(scores[row]),
+        "mood": MOODS[moods[row]],
+        "convinced": bool(outputs[row, 1] >= 0.5),
+        "confidence": round(float(confidence[row]), 3)
+    } for row in range(len(outputs))]
+
+# Entry point used by Analyze_sentiment: a confident prediction without the confidence
+# field, or None to fall back to the cache and the model
+def classifier_analysis(ai_response):
+    result = score_reply(ai_response)
+    if result is None or result["confidence"] < CLASSIFIER_MIN_CONFIDENCE:
+        return None
+    return {k: v for k, v in result.items() if k != "confidence"}
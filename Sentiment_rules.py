@@ -0,0 +1,115 @@
+import os
+import re
+
+# Deterministic fast path for Analyze_sentiment. Obvious customer replies (clear buying
+# signals, explicit rejections, plain questions) are scored locally in microseconds; anything
+# else returns None so the caller falls back to the SageMaker model.
+
+# Set SENTIMENT_RULES=0 to always use the model
+SENTIMENT_RULES_ENABLED = os.environ.get('SENTIMENT_RULES', '1') != '0'
+# Rules answering with lower confidence than this defer to the model
+RULES_MIN_CONFIDENCE = float(os.environ.get('RULES_MIN_CONFIDENCE', '0.8'))
+
+# Phrases that only close a sale when nothing follows them in their clause ("I'll take it."
+# but not "I'll take it into consideration")
+CLAUSE_END = r"(?=\s*([,.!;]|$))"
+BUYING_SIGNALS = [
+    rf"i'?ll take (it|one|them){CLAUSE_END}", rf"i will take (it|one|them){CLAUSE_END}", r"send (me )?the contract",
+    r"where do i sign", r"sign me up", r"let'?s (do it|do this|proceed|go ahead)",
+    r"i'?m (ready|happy) to (buy|purchase|order|sign)", r"i want to (buy|purchase|order)",
+    r"i'?ll (buy|purchase|order)", r"you'?ve (convinced|sold) me",
+    rf"(?<!offer me )(?<!kind of )(?<!give me )(it'?s )?a deal{CLAUSE_END}",
+    r"count me in", r"how (do|can) i pay",
+]
+REJECTIONS = [
+    r"not interested", r"no,? thanks?( you)?\b", r"i'?ll pass", r"not for me",
+    r"i (don'?t|do not) (need|want) (it|this|that)", r"waste of (my )?(time|money)",
+    r"i'?m (going|gonna) to (pass|walk away)", r"not (going|gonna) (to )?buy",
+    r"stop (calling|contacting)", r"i'?ve decided (against|not to)",
+]
+# Words that mean a reply expresses an opinion, so it is not a "pure" question
+OPINION_WORDS = re.compile(
+    r"\b(great|love|like|perfect|excellent|amazing|expensive|cheap|worried|concern|doubt|unsure|not sure|"
+    r"skeptical|hmm|honestly|but|however|think|hate|bad|disappoint|impress|interesting|not|\w+n't)\b"
+)
+# Conditions attached to a buying signal ("I'll take it if...") leave the outcome open
+CONDITIONAL = re.compile(r"\b(if|unless|as long as|provided|only when|assuming)\b")
+NEGATION_BEFORE = re.compile(r"\b(not|never|no|don'?t|won'?t|can'?t|isn'?t|wouldn'?t|couldn'?t)\b(\W+\w+){0,3}\W*$")
+# Qualifiers and negations after a buying signal that put it off ("Let's proceed with the demo
+# first", "..., but I'm not convinced")
+QUALIFIED_AFTER = re.compile(
+    r"\b(first|later|to review|into consideration|under advisement|think (it )?over|not|never|\w+n'?t)\b"
+)
+# Second thoughts anywhere after a buying signal take it back ("I'll take it. Actually, wait,
+# let me think.")
+RETRACTED_AFTER = re.compile(
+    r"\b(wait|actually|hold on|hang on|let me think|on second thought|second thoughts|never ?mind|scratch that|sleep on it)\b"
+)
+# The rest of a sentence that is a question
+QUESTION_AFTER = re.compile(r"[^.!]*\?")
+
+_buying_patterns = [re.compile(rf"\b{pattern}") for pattern in BUYING_SIGNALS]
+_rejection_patterns = [re.compile(rf"\b{pattern}") for pattern in REJECTIONS]
+
+# Helper function to normalize curly quotes and case before matching
+def _normalize(text):
+    return text.lower().replace("’", "'").replace("‘", "'").strip()
+
+# Helper function to find a buying signal in a statement. Returns True for a signal, False
+# for none and None for a signal that is asked about, qualified ("Could you send me the
+# contract to review?") or taken back later in the reply, which is left to the model.
+def _buying_signal(text):
+    hedged = False
+    for pattern in _buying_patterns:
+        for match in pattern.finditer(text):
+            if NEGATION_BEFORE.search(text[:match.start()]):
+                continue
+            rest = text[match.end():]
+            if QUESTION_AFTER.match(rest) or QUALIFIED_AFTER.search(rest) or RETRACTED_AFTER.search(rest):
+                hedged = True
+            else:
+                return True
+    return None if hedged else False
+
+# Helper function to find a pattern that is not preceded by a negation ("I'm not ready to buy")
+def _affirmed_match(patterns, text):
+    for pattern in patterns:
+        for match in pattern.finditer(text):
+            if not NEGATION_BEFORE.search(text[:match.start()]):
+                return True
+    return False
+
+# Score a customer response with rules. Returns the analysis together with a confidence,
+# or None when no rule applies.
+def score_by_rules(ai_response):
+    text = _normalize(ai_response)
+    if not text:
+        return None
+
+    buying = _buying_signal(text)
+    if buying is None:
+        return None
+    rejecting = _affirmed_match(_rejection_patterns, text)
+    if buying and not rejecting:
+        if CONDITIONAL.search(text):
+            return {"conviction_score": 80, "mood": "Positive", "convinced": False, "confidence": 0.6}
+        return {"conviction_score": 90, "mood": "Positive", "convinced": True, "confidence": 0.95}
+    if rejecting and not buying:
+        return {"conviction_score": 10, "mood": "Negative", "convinced": False, "confidence": 0.9}
+    if buying and rejecting:
+        return None
+
+    sentences = [sentence for sentence in re.split(r"(?<=[.!?])\s+", text) if sentence]
+    if sentences and all(sentence.endswith("?") for sentence in sentences) and not OPINION_WORDS.search(text):
+        return {"conviction_score": 45, "mood": "Neutral", "convinced": False, "confidence": 0.8}
+    return None
+
+# Fast-path entry point used by Analyze_sentiment: a confident rule result without the
+# confidence field, or None to call the model
+def fast_path_analysis(ai_response):
+    if not SENTIMENT_RULES_ENABLED:
+        return None
+    result = score_by_rules(ai_response)
+    if result is None or result["confidence"] < RULES_MIN_CONFIDENCE:
+        return None
+    return {k: v for k, v in result.items() if k != "confidence"}
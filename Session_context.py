@@ -0,0 +1,212 @@
+import json
+import os
+import re
+import zlib
+from Aws_clients import get_table
+from Telemetry import metric
+from Token_budget import count_tokens, truncate_to_tokens
+
+# SessionContext keeps one small item per session holding the rolling prompt window and the
+# session state (user_id, current level, progress, turn count), so a turn never has to re-read
+# the chat history. Every turn replaces the item on the condition that its version is the one
+# the turn read, so a double-submitted or concurrent turn is rejected instead of applied twice.
+# The messages are stored compressed in one binary attribute, which keeps the item, written on
+# every turn, near one write unit; contexts stored before that keep a plain list and still load.
+
+# Number of most recent messages kept verbatim for the prompt when CONTEXT_STORE_TOKENS is 0
+CONTEXT_WINDOW_MESSAGES = int(os.environ.get('CONTEXT_WINDOW_MESSAGES', '10'))
+# Maximum length of the compressed summary of older turns; 0 disables the summary
+CONTEXT_SUMMARY_CHARS = int(os.environ.get('CONTEXT_SUMMARY_CHARS', '0'))
+# Maximum tokens of conversation history in a prompt; 0 keeps the whole message window
+HISTORY_TOKEN_BUDGET = int(os.environ.get('HISTORY_TOKEN_BUDGET', '600'))
+# Tokens of the most recent messages kept in the context, however many messages that is, so
+# short exchanges can fill the prompt budget and long pitches do not bloat the item. Defaults
+# to the prompt budget, since older messages would not fit in the prompt anyway.
+CONTEXT_STORE_TOKENS = int(os.environ.get('CONTEXT_STORE_TOKENS', str(HISTORY_TOKEN_BUDGET)))
+# An older message is cut down to fill the rest of the budget only if this many tokens are left
+MIN_TRUNCATED_TOKENS = 16
+
+# Helper function to read the context item of a session
+def load_context(session_id):
+    response = get_table('SessionContext').get_item(Key={'session_id': session_id})
+    item = response.get('Item')
+    if item is not None and 'messages' in item:
+        item['recent_messages'] = unpack_messages(item.pop('messages'))
+    return item
+
+# Helper function to persist a context item
+def save_context(context):
+    get_table('SessionContext').put_item(Item=stored_context(context))
+
+# The item stored for a context: its messages packed into the binary messages attribute
+def stored_context(context):
+    item = {k: v for k, v in context.items() if k != 'recent_messages'}
+    item['messages'] = pack_messages(context.get('recent_messages', []))
+    return item
+
+# Encode messages as raw-deflate compressed JSON, marked by a first byte of 'z', or 'j' for
+# plain JSON when compression would not save anything (the encoding of Chat_store's turns)
+def pack_messages(messages):
+    raw = json.dumps(list(messages), separators=(',', ':')).encode('utf-8')
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    packed = compressor.compress(raw) + compressor.flush()
+    return b'z' + packed if len(packed) < len(raw) else b'j' + raw
+
+def unpack_messages(data):
+    data = bytes(getattr(data, 'value', data))
+    return json.loads(zlib.decompress(data[1:], -15) if data[:1] == b'z' else data[1:])
+
+# The TransactWriteItems entry that stores a context on the condition that nobody wrote the
+# session since context was read. Contexts from before versioning (or rebuilt from the chat
+# history) have no version and are written only if the stored item has none either.
+def context_write(context):
+    from boto3.dynamodb.types import TypeSerializer
+    serializer = TypeSerializer()
+    previous = context.get('version')
+    put = {
+        'TableName': 'SessionContext',
+        'Item': {k: serializer.serialize(v) for k, v in stored_context(dict(context, version=int(previous or 0) + 1)).items()}
+    }
+    if previous is None:
+        put['ConditionExpression'] = 'attribute_not_exists(version)'
+    else:
+        put['ConditionExpression'] = 'version = :previous'
+        put['ExpressionAttributeValues'] = {':previous': serializer.serialize(previous)}
+    return {'Put': put}
+
+# Create the context for a new session from its opening message. start_level is the level the
+# session was opened at, which places its turns in the compact chat blocks; level follows the
+# trainee through level-ups. created_at is set when the opening went to the compact chat
+# blocks, and marks every later block of the session (see Chat_store.py).
+def new_context(session_id, product_id, level, ai_response, user_id, created_at=None):
+    context = {
+        'session_id': session_id,
+        'user_id': user_id,
+        'ProductId': product_id,
+        'start_level': level,
+        'level': level,
+        'progress_percentage': 0,
+        'recent_messages': [],
+        'summary': "",
+        'turn_count': 0,
+        'version': 0
+    }
+    if created_at is not None:
+        context['created_at'] = created_at
+    return append_messages(context, [f"Customer: {ai_response}"])
+
+# Rebuild the context of a session that predates SessionContext from its chat history items.
+# The current level and progress come from the last turn, which stores the level after any
+# level-up; the user comes from the opening item when it recorded one.
+def context_from_history(session_id, conversation_items):
+    last = conversation_items[-1]
+    scored = [item for item in conversation_items if item.get('conviction_score') is not None]
+    progress = 0
+    if scored and not scored[-1].get('convinced'):
+        progress = int(scored[-1]['conviction_score'])
+    context = {
+        'session_id': session_id,
+        'user_id': next((item['user_id'] for item in conversation_items if item.get('user_id')), ''),
+        'ProductId': conversation_items[0].get('ProductId', ''),
+        'start_level': int(conversation_items[0].get('level', 1)),
+        'level': int(last.get('level', 1)),
+        'progress_percentage': progress,
+        'recent_messages': [],
+        'summary': "",
+        'turn_count': 0
+    }
+    messages = []
+    for item in conversation_items:
+        if item.get('user_input'):
+            messages.append(f"Salesperson: {item['user_input']}")
+        if item.get('ai_response'):
+            messages.append(f"Customer: {item['ai_response']}")
+    context = append_messages(context, messages)
+    context['turn_count'] = max(len(conversation_items) - 1, 0)
+    return context
+
+# Add messages to the rolling window; messages pushed out of the window are folded into
+# the summary when it is enabled
+def append_messages(context, messages):
+    window = list(context.get('recent_messages', [])) + list(messages)
+    start = window_start(window)
+    evicted = window[:start]
+    updated = dict(context)
+    updated['recent_messages'] = window[start:]
+    if evicted and CONTEXT_SUMMARY_CHARS > 0:
+        updated['summary'] = summarize(context.get('summary', ""), evicted)
+    return updated
+
+# Helper function to find the oldest message of the window that is kept: the newest messages
+# up to CONTEXT_STORE_TOKENS (counted like fit_history, with the message that crosses the limit
+# kept so the prompt can be filled with a cut-down copy of it), or the last
+# CONTEXT_WINDOW_MESSAGES when CONTEXT_STORE_TOKENS is 0
+def window_start(window):
+    if CONTEXT_STORE_TOKENS <= 0:
+        return max(len(window) - CONTEXT_WINDOW_MESSAGES, 0)
+    tokens = 0
+    for index in range(len(window) - 1, -1, -1):
+        if tokens >= CONTEXT_STORE_TOKENS:
+            return index + 1
+        tokens += count_tokens(window[index]) + 1
+    return 0
+
+# Compress evicted messages to their first sentence and keep only the newest
+# CONTEXT_SUMMARY_CHARS characters of the running summary
+def summarize(summary, messages):
+    sentences = [re.split(r"(?<=[.!?])\s", message.strip(), maxsplit=1)[0] for message in messages]
+    combined = " ".join(part for part in [summary] + sentences if part)
+    if len(combined) > CONTEXT_SUMMARY_CHARS:
+        combined = combined[-CONTEXT_SUMMARY_CHARS:].split(" ", 1)[-1]
+    return combined
+
+# Build the conversation history section of the prompt for the next customer reply. With a
+# token budget, fit_history picks how many of the stored messages go in.
+def build_conversation_history(context, salesperson_input):
+    messages = list(context.get('recent_messages', [])) + [f"Salesperson: {salesperson_input}"]
+    summary = context.get('summary', "")
+    if HISTORY_TOKEN_BUDGET > 0:
+        messages, summary = fit_history(messages, summary, HISTORY_TOKEN_BUDGET)
+    else:
+        messages = messages[-CONTEXT_WINDOW_MESSAGES:]
+    conversation_history = "\n".join(messages) + "\n"
+    if summary:
+        conversation_history = f"Earlier in the conversation: {summary}\n" + conversation_history
+    return conversation_history
+
+# Keep the newest messages that fit in budget tokens. Older messages are folded into the
+# summary when it is enabled and get whatever budget remains; otherwise the newest of them is
+# cut short to fill the budget and the rest are dropped.
+def fit_history(messages, summary, budget):
+    kept = []
+    remaining = budget
+    for index in range(len(messages) - 1, -1, -1):
+        cost = count_tokens(messages[index]) + 1
+        if cost <= remaining:
+            kept.append(messages[index])
+            remaining -= cost
+            continue
+        # The newest message is always kept, cut down if it alone is over budget
+        if not kept or (CONTEXT_SUMMARY_CHARS <= 0 and remaining >= MIN_TRUNCATED_TOKENS):
+            kept.append(truncate_to_tokens(messages[index], max(remaining - 2, 1)) + " ...")
+            remaining = 0
+            index -= 1
+        dropped = messages[:index + 1]
+        if dropped and CONTEXT_SUMMARY_CHARS > 0:
+            summary = summarize(summary, dropped)
+        metric("history_messages_dropped", len(dropped))
+        break
+    kept.reverse()
+
+    if summary:
+        summary_tokens = count_tokens(summary)
+        if summary_tokens > remaining:
+            # Keep the most recent part of the summary
+            words = summary.split(" ")
+            while words and count_tokens(" ".join(words)) > remaining:
+                words = words[max(1, len(words) // 8):]
+            summary = " ".join(words)
+            summary_tokens = count_tokens(summary)
+        remaining -= summary_tokens
+    metric("history_tokens", budget - remaining)
+    return kept, summary
@@ -1,22 +1,34 @@
+import hashlib
 import json
-import boto3
+import random
 import uuid
 from datetime import datetime
 from decimal import Decimal
-
-# Initialize AWS services
-dynamodb = boto3.resource('dynamodb')
-sagemaker_runtime = boto3.client('sagemaker-runtime')
-
-# Define the DynamoDB tables
-products_table = dynamodb.Table('Products')
-chat_history_table = dynamodb.Table('ChatHistory')
-persona_progress_table = dynamodb.Table('PersonaProgress')
+from Aws_clients import get_client, get_table
+from Chat_store import CHAT_STORAGE_FORMAT, save_opening
+from Concurrent_io import gather
+from Latest_session import record_latest_session
+from Model_gateway import generate
+from Model_guard import ModelUnavailable
+from Product_cache import get_level_prompt, get_product
+from Response_stream import StopTrimmer, stream_generate, websocket_emitter
+from Session_context import new_context, save_context
+from Telemetry import metric, stage, timed, traced, warning
+from Token_budget import count_tokens
 
 # Define the SageMaker endpoint
 ENDPOINT_NAME = 'sagemaker-endpoint-name'  # Replace with your actual endpoint name
 
+# Opening used when there is no pre-generated line and the model is unavailable
+DEGRADED_OPENING_LINE = "Hi, I'm interested in this product. Could you tell me more about it?"
+
+@traced("StartConversation")
 def lambda_handler(event, context):
+    return start_conversation(event)
+
+# Start a conversation and return the handler response. Importable so Start_or_continue_conversation
+# can run it in-process instead of invoking this function over Lambda.
+def start_conversation(event):
     # Extract event details
     user_id = event.get("user_id", "")
     product_id = event.get("product_id", "")
@@ -33,7 +45,9 @@ def lambda_handler(event, context):
     if reset:
         try:
             # Reset progress for the product
-            persona_progress_table.delete_item(
+            timed(
+                "progress_reset",
+                get_table('PersonaProgress').delete_item,
                 Key={
                     'UserId': user_id,
                     'ProductId': product_id
@@ -46,34 +60,15 @@ def lambda_handler(event, context):
                 "body": f"Error resetting progress: {str(e)}"
             }
 
-    # Retrieve product details from Products table
+    # Retrieve the product and its precompiled level prompt, cached across warm invocations
     try:
-        product_response = products_table.get_item(Key={'ProductId': product_id})
-        product_details = product_response['Item']
+        level_prompt = timed("product_fetch", get_level_prompt, product_id, level, build_start_prompt)
     except Exception as e:
         return {
             "statusCode": 500,
             "body": f"Error fetching product data: {str(e)}"
         }
-
-    # Prepare prompt and SageMaker payload based on level
-    persona_info = product_details.get('ProductLevels', {}).get(f'Level{level}', {}).get('Persona', {})
-    persona_name = persona_info.get('Name', 'Customer')
-    primary_trait = persona_info.get('PrimaryTrait', 'Neutral')
-    persona_description = persona_info.get('Description', '')
-    product_name = product_details.get('ProductName', 'Product')
-    product_description = product_details.get('ProductDescription', 'No description available.')
-
-    system_prompt = (
-        "This is a chat between a salesperson and a customer AI. "
-        "The AI customer will ask relevant questions about the product to assess if it matches their interests."
-    )
-    context = (
-        f"The customer is named {persona_name}, who is {primary_trait.lower()} and {persona_description.lower()}. "
-        f"The product, {product_name}, offers {product_description}."
-    )
-    user_message = "Start the conversation as a customer interested in learning more about the product. Respond and behave as a real customer."
-    prompt_message = f"System: {system_prompt}\n\nContext: {context}\n\nUser: {user_message}\n\nAssistant:"
+    prompt_message = level_prompt["prompt_message"]
 
     # SageMaker payload
     payload = {
@@ -85,39 +80,73 @@ def lambda_handler(event, context):
         }
     }
 
-    # Invoke SageMaker model
+    # Stream the opening line as it is generated when the client asked for it over a WebSocket connection
+    emit = websocket_emitter(event, event)
+    time_to_first_token_ms = None
+
+    # Invoke SageMaker model, unless the pre-generated pool already has openings for this level
     try:
-        response = sagemaker_runtime.invoke_endpoint(
-            EndpointName=ENDPOINT_NAME,
-            ContentType="application/json",
-            Body=json.dumps(payload)
-        )
-        response_body = response['Body'].read().decode('utf-8')
-        response_payload = json.loads(response_body)
-        ai_response = response_payload[0].get('generated_text', '').split('Assistant:')[1].strip()
+        ai_response = pick_opening_line(product_id, level, level_prompt["prompt_hash"])
+        if ai_response:
+            metric("opening_from_pool", 1)
+            if emit is not None:
+                time_to_first_token_ms = 0
+                emit({"type": "delta", "text": ai_response})
+        else:
+            metric("prompt_tokens", level_prompt["prompt_tokens"])
+            try:
+                if emit is not None:
+                    # Streamed output holds only the new tokens, so there is no prompt echo to split off
+                    trimmer = StopTrimmer(level_prompt["persona_name"], [])
+                    _, time_to_first_token_ms = timed("model", stream_generate, get_client('sagemaker-runtime'), ENDPOINT_NAME, payload, trimmer, emit)
+                    ai_response = trimmer.text
+                    metric("time_to_first_token_ms", time_to_first_token_ms, "Milliseconds")
+                else:
+                    ai_response = timed("model", generate_opening_line, payload)
+            except ModelUnavailable as e:
+                # Open with a generic line rather than failing the session start
+                warning(f"Model unavailable ({e.reason}), using the fallback opening line")
+                ai_response = DEGRADED_OPENING_LINE
+                if emit is not None:
+                    emit({"type": "delta", "text": ai_response})
 
         # Generate a unique session_id for this conversation
         session_id = str(uuid.uuid4())
+        timestamp = int(datetime.now().timestamp())
 
-        # Save initial chat to ChatHistory table
-        chat_history_table.put_item(
-            Item={
+        # Save initial chat in the chat history (see Chat_store.py) and seed the rolling context
+        # that ContinueConversation reads instead of the full history. The two writes are
+        # independent, so they run side by side.
+        gather(
+            ("chat_write", save_opening, {
                 'session_id': session_id,
-                'timestamp': int(datetime.now().timestamp()),
+                'timestamp': timestamp,
                 'user_input': "",  # Initial input is blank as AI starts the conversation
                 'ai_response': ai_response,
                 'ProductId': product_id,
-                'level': level
-            }
+                'level': level,
+                'user_id': user_id  # Lets the LatestSession backfill attribute the session
+            }),
+            # Sessions opened in the compact layout mark every chat block they write
+            ("context_save", save_context, new_context(session_id, product_id, level, ai_response, user_id,
+                                                       timestamp if CHAT_STORAGE_FORMAT != 'legacy' else None))
         )
 
+        # Point the (user, product, level) lookup at this session so resume is a single get_item.
+        # Written last, so a failed start never replaces the pointer to the previous session.
+        timed("pointer_write", record_latest_session, user_id, product_id, level, session_id, timestamp)
+
+        response_data = {
+            "session_id": session_id,
+            "ai_response": ai_response,
+            "level": level
+        }
+        if emit is not None:
+            response_data["time_to_first_token_ms"] = time_to_first_token_ms
+            emit(dict(convert_decimal(response_data), type="done"))
         return {
             "statusCode": 200,
-            "body": json.dumps(convert_decimal({
-                "session_id": session_id,
-                "ai_response": ai_response,
-                "level": level
-            }))
+            "body": json.dumps(convert_decimal(response_data))
         }
     except Exception as e:
         return {
@@ -125,6 +154,45 @@ def lambda_handler(event, context):
             "body": f"Error starting conversation: {str(e)}"
         }
 
+# Pick a random opening line from the pool stored on the product by Pregenerate_openings.
+# Returns None when the pool is empty or was generated from a different prompt (the persona
+# was edited since), so the caller falls back to a live model call.
+def pick_opening_line(product_id, level, prompt_hash):
+    pool = get_product(product_id).get('OpeningLines', {}).get(f'Level{level}', {})
+    if pool.get('prompt_hash') != prompt_hash or not pool.get('lines'):
+        return None
+    return random.choice(pool['lines'])
+
+# Generate an opening line with a single invoke_endpoint call
+def generate_opening_line(payload):
+    return generate(ENDPOINT_NAME, payload).split('Assistant:')[1].strip()
+
+# Build the opening prompt for a product level; Product_cache keeps the result per warm container
+def build_start_prompt(product_details, level):
+    persona_info = product_details.get('ProductLevels', {}).get(f'Level{level}', {}).get('Persona', {})
+    persona_name = persona_info.get('Name', 'Customer')
+    primary_trait = persona_info.get('PrimaryTrait', 'Neutral')
+    persona_description = persona_info.get('Description', '')
+    product_name = product_details.get('ProductName', 'Product')
+    product_description = product_details.get('ProductDescription', 'No description available.')
+
+    system_prompt = (
+        "This is a chat between a salesperson and a customer AI. "
+        "The AI customer will ask relevant questions about the product to assess if it matches their interests."
+    )
+    context = (
+        f"The customer is named {persona_name}, who is {primary_trait.lower()} and {persona_description.lower()}. "
+        f"The product, {product_name}, offers {product_description}."
+    )
+    user_message = "Start the conversation as a customer interested in learning more about the product. Respond and behave as a real customer."
+    prompt_message = f"System: {system_prompt}\n\nContext: {context}\n\nUser: {user_message}\n\nAssistant:"
+    return {
+        "persona_name": persona_name,
+        "prompt_message": prompt_message,
+        "prompt_hash": hashlib.sha256(prompt_message.encode('utf-8')).hexdigest(),
+        "prompt_tokens": count_tokens(prompt_message)
+    }
+
 # Helper function to convert Decimal types in dictionaries to int or float
 def convert_decimal(obj):
     if isinstance(obj, list):
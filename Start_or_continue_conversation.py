@@ -1,28 +1,37 @@
 import json
-import boto3
+import os
 from decimal import Decimal
+from Aws_clients import get_client
+from Chat_store import session_page
+from Latest_session import get_latest_session
+from Telemetry import debug, error, info, metric, stage, timed, traced, warning
 
-# Initialize AWS services
-lambda_client = boto3.client('lambda')
-dynamodb = boto3.resource('dynamodb')
-
-# Define DynamoDB table and Lambda function names
-chat_history_table = dynamodb.Table('ChatHistory')
-persona_progress_table = dynamodb.Table('PersonaProgress')
+# Define Lambda function names
 start_conversation_lambda = "StartConversation"  # Replace with actual Lambda name
 continue_conversation_lambda = "Continueconversation"  # Replace with actual Lambda name
 
+# "inprocess" (default) runs StartConversation inside this function; "lambda" invokes the
+# separately deployed StartConversation function instead
+START_CONVERSATION_MODE = os.environ.get('START_CONVERSATION_MODE', 'inprocess')
+
+# Turns returned per resume response; clients page through longer sessions with next_cursor
+RESUME_PAGE_SIZE = int(os.environ.get('RESUME_PAGE_SIZE', '200'))
+MAX_RESUME_PAGE_SIZE = 500
+# Fields of each row in the "rows" encoding of previous messages
+ROW_FIELDS = ["timestamp", "user_input", "ai_response"]
+
+@traced("Start_or_continue_conversation")
 def lambda_handler(event, context):
     # Logging the received event for debugging
-    print("Received event:", event)
+    debug(f"Received event: {event}")
     
     # Attempt to parse 'body' for both API Gateway and direct Lambda invocation scenarios
     if 'body' in event:
         try:
             # If body is a string (from API Gateway), parse it as JSON
-            body = json.loads(event['body']) if isinstance(event['body'], str) else event['body']
+            body = timed("parse", json.loads, event['body']) if isinstance(event['body'], str) else event['body']
         except json.JSONDecodeError as e:
-            print("JSON decode error:", e)
+            warning(f"JSON decode error: {e}")
             return {
                 "statusCode": 400,
                 "body": json.dumps("Error: Invalid JSON in request body.")
@@ -37,119 +46,191 @@ def lambda_handler(event, context):
     levels_passed = body.get("levels_passed", 0)
     progress_percentage = body.get("progress_percentage", 0)
     reset = body.get("reset", False)
+    # Resume options: only the turns after cursor (from the previous response) or after
+    # since_timestamp, page_size turns at a time, as objects or as compact rows
+    page_request = {
+        "cursor": body.get("cursor"),
+        "since_timestamp": body.get("since_timestamp"),
+        "page_size": body.get("page_size", RESUME_PAGE_SIZE),
+        "encoding": body.get("encoding", "objects")
+    }
 
     # Validate that required fields are present
     if not user_id or not product_id:
-        print("Missing required fields: user_id or product_id")
+        warning("Missing required fields: user_id or product_id")
         return {
             "statusCode": 400,
             "body": json.dumps("Error: 'user_id' and 'product_id' are required.")
         }
+    if not isinstance(page_request["page_size"], int) or not 1 <= page_request["page_size"] <= MAX_RESUME_PAGE_SIZE:
+        return {
+            "statusCode": 400,
+            "body": json.dumps(f"Error: 'page_size' must be between 1 and {MAX_RESUME_PAGE_SIZE}.")
+        }
+    if page_request["since_timestamp"] is not None and not isinstance(page_request["since_timestamp"], (int, float)):
+        return {
+            "statusCode": 400,
+            "body": json.dumps("Error: 'since_timestamp' must be epoch seconds.")
+        }
+    if page_request["encoding"] not in ("objects", "rows"):
+        return {
+            "statusCode": 400,
+            "body": json.dumps("Error: 'encoding' must be 'objects' or 'rows'.")
+        }
+    try:
+        if page_request["cursor"]:
+            decode_cursor(page_request["cursor"])
+    except ValueError:
+        return {
+            "statusCode": 400,
+            "body": json.dumps("Error: Invalid 'cursor'.")
+        }
 
     # Logging extracted values for debugging
-    print(f"Input - User ID: {user_id}, Product ID: {product_id}, Levels Passed: {levels_passed}, Progress Percentage: {progress_percentage}, Reset: {reset}")
+    debug(f"Input - User ID: {user_id}, Product ID: {product_id}, Levels Passed: {levels_passed}, Progress Percentage: {progress_percentage}, Reset: {reset}")
 
     # Case 1: Reset - start a new conversation from Level 1
     if reset:
-        print("Reset is true. Starting a new conversation from Level 1.")
+        info("Reset is true. Starting a new conversation from Level 1.")
         return invoke_start_conversation(user_id, product_id, 1)
 
     # Case 2: No levels passed but there is progress, so retrieve previous messages only
     if levels_passed == 0 and progress_percentage > 0:
-        print("No levels passed, but progress exists. Fetching previous messages from Level 1.")
-        return fetch_previous_chats(user_id, product_id, 1)
+        info("No levels passed, but progress exists. Fetching previous messages from Level 1.")
+        return fetch_previous_chats(user_id, product_id, 1, page_request)
 
     # Case 3: Levels have been passed; determine next level to start or continue from
     if levels_passed > 0:
         next_level = levels_passed + 1
         if progress_percentage > 0:
-            print(f"Level {levels_passed} passed with progress. Fetching previous messages from Level {next_level}.")
-            return fetch_previous_chats(user_id, product_id, next_level)
+            info(f"Level {levels_passed} passed with progress. Fetching previous messages from Level {next_level}.")
+            return fetch_previous_chats(user_id, product_id, next_level, page_request)
         else:
-            print(f"Level {levels_passed} passed but no progress. Starting new conversation at Level {next_level}.")
+            info(f"Level {levels_passed} passed but no progress. Starting new conversation at Level {next_level}.")
             return invoke_start_conversation(user_id, product_id, next_level)
 
     # Default: Start fresh at Level 1 if no progress or levels have been passed
-    print("No progress and no levels passed. Starting conversation from Level 1.")
+    info("No progress and no levels passed. Starting conversation from Level 1.")
     return invoke_start_conversation(user_id, product_id, 1)
 
-# Helper function to fetch previous chat messages without invoking the conversation
-def fetch_previous_chats(user_id, product_id, level):
+# Helper function to fetch previous chat messages without invoking the conversation. Only the
+# turns after page_request's cursor or since_timestamp are returned, at most page_size of them,
+# with the cursor to send next time; see Chat_store.session_page.
+def fetch_previous_chats(user_id, product_id, level, page_request=None):
+    page_request = dict({"cursor": None, "since_timestamp": None, "page_size": RESUME_PAGE_SIZE, "encoding": "objects"}, **(page_request or {}))
     try:
-        # Fetch previous chat sessions for the user_id and product_id at the specified level
-        response = chat_history_table.scan(
-            FilterExpression=boto3.dynamodb.conditions.Attr('ProductId').eq(product_id) &
-                             boto3.dynamodb.conditions.Attr('level').eq(level)
-        )
-
-        # Sort items by timestamp to get chat history in ascending order
-        if 'Items' in response and response['Items']:
-            latest_session = max(response['Items'], key=lambda x: x['timestamp'])
+        # Resolve the latest session for this user, product and level from the LatestSession pointer
+        latest_session = timed("latest_session", get_latest_session, user_id, product_id, level)
+
+        if latest_session:
             session_id = latest_session['session_id']
-            print(f"Fetching previous messages with session_id: {session_id}")
+            debug(f"Fetching previous messages with session_id: {session_id}")
             
-            # Retrieve all messages for the ongoing conversation in ascending order
-            chat_history_response = chat_history_table.query(
-                KeyConditionExpression=boto3.dynamodb.conditions.Key('session_id').eq(session_id),
-                ScanIndexForward=True  # Ensure messages are in chronological order
+            # A cursor from another session (a newer one was started since) starts over
+            position = None
+            restarted = False
+            if page_request["cursor"]:
+                cursor_session, position = decode_cursor(page_request["cursor"])
+                if cursor_session != session_id[:CURSOR_SESSION_CHARS]:
+                    position, restarted = None, True
+
+            # Retrieve the messages after the cursor in chronological order, from the compact
+            # chat blocks or the per-turn ChatHistory rows of older sessions
+            chat_history_items, position, has_more = timed(
+                "history_query", session_page, session_id, position,
+                None if restarted or page_request["since_timestamp"] is None else int(page_request["since_timestamp"]),
+                page_request["page_size"]
             )
-            
-            # Collect all previous messages in the chat history
-            previous_messages = []
-            for item in chat_history_response.get('Items', []):
-                previous_messages.append({
+            metric("messages_returned", len(chat_history_items))
+
+            response_data = {"session_id": session_id}
+            if page_request["encoding"] == "rows":
+                response_data["fields"] = ROW_FIELDS
+                response_data["rows"] = [[convert_decimal(item.get("timestamp", 0)), item.get("user_input", ""), item.get("ai_response", "")]
+                                         for item in chat_history_items]
+            else:
+                response_data["previous_messages"] = [{
                     "user_input": item.get("user_input", ""),
                     "ai_response": item.get("ai_response", ""),
                     "timestamp": convert_decimal(item.get("timestamp", 0))
-                })
-            
+                } for item in chat_history_items]
+            response_data["next_cursor"] = encode_cursor(session_id, position)
+            response_data["has_more"] = has_more
+            if restarted:
+                response_data["restarted"] = True
+
             # Return only the chat history without calling ContinueConversation
-            print(f"Returning previous chat messages for session_id {session_id}.")
+            debug(f"Returning previous chat messages for session_id {session_id}.")
             return {
                 "statusCode": 200,
-                "body": json.dumps({
-                    "session_id": session_id,
-                    "previous_messages": previous_messages
-                })
+                "body": json.dumps(response_data, separators=(',', ':'))
             }
         
         else:
             # If no ongoing session found, start a new conversation
-            print(f"No ongoing session found. Starting new conversation at Level {level}.")
+            info(f"No ongoing session found. Starting new conversation at Level {level}.")
             return invoke_start_conversation(user_id, product_id, level)
     
     except Exception as e:
-        print(f"Error fetching session or previous messages: {e}")
+        error(f"Error fetching session or previous messages: {e}")
         return {
             "statusCode": 500,
             "body": json.dumps(f"Error fetching previous messages: {str(e)}")
         }
 
-# Function to invoke the StartConversation Lambda function
+# Function to start a new conversation, in-process or through the StartConversation Lambda
 def invoke_start_conversation(user_id, product_id, level):
+    start_event = {
+        "user_id": user_id,
+        "product_id": product_id,
+        "level": level
+    }
     try:
-        response = lambda_client.invoke(
-            FunctionName=start_conversation_lambda,
-            InvocationType="RequestResponse",
-            Payload=json.dumps({
-                "user_id": user_id,
-                "product_id": product_id,
-                "level": level
-            })
-        )
-        result = json.loads(response['Payload'].read())
-        print(f"StartConversation response: {result}")
+        # In-process, StartConversation's own stages are recorded on this invocation's trace as well
+        with stage("start_conversation"):
+            if START_CONVERSATION_MODE == 'lambda':
+                response = get_client('lambda').invoke(
+                    FunctionName=start_conversation_lambda,
+                    InvocationType="RequestResponse",
+                    Payload=json.dumps(start_event)
+                )
+                result = json.loads(response['Payload'].read())
+            else:
+                # Imported on first use so resume-only requests do not pay for it
+                from StartConversation import start_conversation
+                result = start_conversation(start_event)
+        debug(f"StartConversation response: {result}")
+        # Keep the {"statusCode", "body"} envelope in the body so clients see the same shape in both modes
         return {
             "statusCode": 200,
             "body": json.dumps(convert_decimal(result))
         }
     except Exception as e:
-        print(f"Error invoking StartConversation: {e}")
+        error(f"Error invoking StartConversation: {e}")
         return {
             "statusCode": 500,
             "body": json.dumps(f"Error invoking StartConversation: {str(e)}")
         }
 
+# Cursors are opaque to clients: the start of the session id and the Chat_store position of
+# the last turn returned, dot separated (all ASCII, so no further encoding is needed)
+CURSOR_SESSION_CHARS = 8
+
+def encode_cursor(session_id, position):
+    return ".".join([session_id[:CURSOR_SESSION_CHARS], position[0][0]] + [str(int(part)) for part in position[1:]])
+
+def decode_cursor(cursor):
+    try:
+        session_prefix, layout, *parts = str(cursor).split(".")
+        parts = [int(part) for part in parts]
+        if layout == "l" and len(parts) == 1:
+            return session_prefix, ('legacy', parts[0])
+        if layout == "c" and len(parts) == 2 and min(parts) >= 0:
+            return session_prefix, ('compact', parts[0], parts[1])
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid cursor: {cursor}")
+
 # Helper function to convert Decimal types in dictionaries to int or float
 def convert_decimal(obj):
     if isinstance(obj, list):
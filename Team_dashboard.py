@@ -0,0 +1,98 @@
+import json
+import os
+from decimal import Decimal
+from Aws_clients import get_table
+from Rollups import (LEADERBOARD_INDEX, ROLLUPS_TABLE, TOTAL_MEMBER, leaderboard_key, product_key, summarize,
+                     team_key, team_product_key)
+from Telemetry import error, timed, traced, warning
+
+# Team and product analytics from the precomputed rollups (see Rollups.py): one get_item
+# for the totals and, for a team, one index query for the top of its leaderboard. Raw chat
+# rows are never read.
+
+LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', '10'))
+
+@traced("Team_dashboard")
+def lambda_handler(event, context):
+    # Parse 'body' for both API Gateway and direct Lambda invocation scenarios
+    if 'body' in event:
+        try:
+            # If body is a string (from API Gateway), parse it as JSON
+            body = timed("parse", json.loads, event['body']) if isinstance(event['body'], str) else event['body']
+        except json.JSONDecodeError as e:
+            warning(f"JSON decode error: {e}")
+            return {
+                "statusCode": 400,
+                "body": json.dumps("Error: Invalid JSON in request body.")
+            }
+    else:
+        # If 'body' is not in the event, assume the entire event is the input (Lambda test console case)
+        body = event
+
+    team_id = body.get("team_id")
+    product_id = body.get("product_id")
+    top = body.get("top", LEADERBOARD_SIZE)
+
+    if not team_id and not product_id:
+        return {
+            "statusCode": 400,
+            "body": json.dumps("Error: 'team_id' or 'product_id' is required.")
+        }
+
+    if isinstance(top, bool) or not isinstance(top, int) or not 1 <= top <= LEADERBOARD_SIZE:
+        return {
+            "statusCode": 400,
+            "body": json.dumps(f"Error: 'top' must be an integer from 1 to {LEADERBOARD_SIZE}.")
+        }
+
+    if team_id and product_id:
+        rollup_key = team_product_key(team_id, product_id)
+    elif team_id:
+        rollup_key = team_key(team_id)
+    else:
+        rollup_key = product_key(product_id)
+
+    try:
+        item = timed("rollup_read", get_table(ROLLUPS_TABLE).get_item, Key={'RollupKey': rollup_key, 'Member': TOTAL_MEMBER}).get('Item')
+        response_data = {"team_id": team_id, "product_id": product_id, **summarize(item)}
+        if team_id:
+            response_data["leaderboard"] = timed("leaderboard_read", get_leaderboard, team_id, top)
+    except Exception as e:
+        error(f"Error reading rollups: {e}")
+        return {
+            "statusCode": 500,
+            "body": json.dumps(f"Error reading rollups: {str(e)}")
+        }
+    return {
+        "statusCode": 200,
+        "body": json.dumps(response_data)
+    }
+
+# The top trainees of a team by levels passed, fewer turns first on a tie, read in that order
+# from the leaderboard index
+def get_leaderboard(team_id, top):
+    from boto3.dynamodb.conditions import Key
+    table = get_table(ROLLUPS_TABLE)
+    kwargs = {
+        'IndexName': LEADERBOARD_INDEX,
+        'KeyConditionExpression': Key('RollupKey').eq(leaderboard_key(team_id)),
+        'ScanIndexForward': False,
+        'Limit': top
+    }
+    rows = []
+    while len(rows) < top:
+        response = table.query(**kwargs)
+        rows.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        kwargs['Limit'] = top - len(rows)
+    return [
+        {
+            "user_id": row['Member'],
+            "levels_passed": int(row.get('levels_passed', Decimal(0))),
+            "sessions": int(row.get('sessions', Decimal(0))),
+            "turns": int(row.get('turns', Decimal(0)))
+        }
+        for row in rows[:top]
+    ]
@@ -0,0 +1,167 @@
+import functools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Lightweight per-invocation tracing and logging. Handlers are wrapped with @traced, which
+# opens a trace for the invocation; stage() blocks record how long each step took and the
+# trace is written to stdout as one CloudWatch Embedded Metric Format (EMF) line when the
+# handler returns, so CloudWatch extracts the timings as metrics without any API calls.
+#
+# Log lines go through debug/info/warning/error and are gated by LOG_LEVEL. DEBUG lines,
+# which may contain conversation text, are otherwise kept only for a DEBUG_SAMPLE_RATE
+# fraction of invocations.
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+DEBUG_SAMPLE_RATE = float(os.environ.get('DEBUG_SAMPLE_RATE', '0'))
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'SalesTrainingApp')
+# Set METRICS=0 to stop writing EMF lines
+METRICS_ENABLED = os.environ.get('METRICS', '1') != '0'
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+_min_level = LEVELS.get(LOG_LEVEL, 20)
+_local = threading.local()
+
+# Timings and properties of one handler invocation
+class Trace:
+    def __init__(self, handler_name):
+        self.handler_name = handler_name
+        self.started_at = time.perf_counter()
+        self.timings = {}
+        self.metrics = {}
+        self.properties = {}
+        self.debug_sampled = DEBUG_SAMPLE_RATE > 0 and random.random() < DEBUG_SAMPLE_RATE
+        self.lock = threading.Lock()
+
+    # Add elapsed milliseconds to a stage; a stage that runs several times accumulates
+    def record(self, name, elapsed_ms):
+        with self.lock:
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed_ms
+
+    # Record a metric other than a stage timing, e.g. a count
+    def metric(self, name, value, unit="Count"):
+        with self.lock:
+            self.metrics[name] = (value, unit)
+
+    # Attach a non-metric property (searchable in Logs Insights, not billed as a metric)
+    def set(self, name, value):
+        with self.lock:
+            self.properties[name] = value
+
+    def emit(self, status_code=None):
+        if not METRICS_ENABLED:
+            return
+        total_ms = (time.perf_counter() - self.started_at) * 1000
+        with self.lock:
+            values = {f"{name}_ms": round(elapsed_ms, 2) for name, elapsed_ms in self.timings.items()}
+            values["total_ms"] = round(total_ms, 2)
+            definitions = [{"Name": name, "Unit": "Milliseconds"} for name in values]
+            for name, (value, unit) in self.metrics.items():
+                values[name] = value
+                definitions.append({"Name": name, "Unit": unit})
+            record = dict(self.properties)
+        record.update(values)
+        record.update({
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Handler"]],
+                    "Metrics": definitions
+                }]
+            },
+            "Handler": self.handler_name,
+            "StatusCode": status_code
+        })
+        # One write per line so concurrent invocations in the same process never interleave
+        sys.stdout.write(json.dumps(record, default=str) + "\n")
+
+# Decorator for lambda_handler functions: traces the invocation and emits it on return
+def traced(handler_name):
+    def decorate(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            outer = getattr(_local, 'trace', None)
+            trace = _local.trace = Trace(handler_name)
+            status_code = None
+            try:
+                result = handler(event, context)
+                if isinstance(result, dict):
+                    status_code = result.get("statusCode")
+                return result
+            finally:
+                _local.trace = outer
+                trace.emit(status_code)
+        return wrapper
+    return decorate
+
+# The trace of the invocation running on this thread, or None
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+# Time a block as one stage of the current invocation
+@contextmanager
+def stage(name):
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.record(name, (time.perf_counter() - started_at) * 1000)
+
+# Call fn(*args, **kwargs) as one stage of the current invocation and return its result
+def timed(name, fn, *args, **kwargs):
+    with stage(name):
+        return fn(*args, **kwargs)
+
+# Wrap fn so it runs as a stage of the current invocation on another thread
+def in_stage(name, fn):
+    trace = current_trace()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        previous = getattr(_local, 'trace', None)
+        _local.trace = trace
+        try:
+            with stage(name):
+                return fn(*args, **kwargs)
+        finally:
+            _local.trace = previous
+    return run
+
+# Record a metric or property on the current invocation; no-ops outside a traced handler
+def metric(name, value, unit="Count"):
+    trace = current_trace()
+    if trace is not None:
+        trace.metric(name, value, unit)
+
+def set_property(name, value):
+    trace = current_trace()
+    if trace is not None:
+        trace.set(name, value)
+
+def debug(message):
+    trace = current_trace()
+    if _min_level <= LEVELS['DEBUG'] or (trace is not None and trace.debug_sampled):
+        _write('DEBUG', message)
+
+def info(message):
+    if _min_level <= LEVELS['INFO']:
+        _write('INFO', message)
+
+def warning(message):
+    if _min_level <= LEVELS['WARNING']:
+        _write('WARNING', message)
+
+def error(message):
+    _write('ERROR', message)
+
+def _write(level, message):
+    sys.stdout.write(f"[{level}] {message}\n")
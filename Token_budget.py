@@ -0,0 +1,60 @@
+import os
+import re
+import threading
+from Telemetry import warning
+
+# Token counting for prompt budgeting. With TOKENIZER_PATH pointing at the endpoint model's
+# tokenizer.json and the optional `tokenizers` package installed, counts are exact. Otherwise
+# they are estimated from words and punctuation, which is close enough to keep a prompt
+# within budget but should not be used to bill anything.
+
+TOKENIZER_PATH = os.environ.get('TOKENIZER_PATH', '')
+
+# Characters per estimated subword piece; long words are split into several tokens
+_CHARS_PER_PIECE = 6
+_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+# Number of tokens in text
+def count_tokens(text):
+    if not text:
+        return 0
+    tokenizer = get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+    return sum(1 + (len(piece) - 1) // _CHARS_PER_PIECE for piece in _PIECE_PATTERN.findall(text))
+
+# The longest prefix of text that fits in max_tokens tokens
+def truncate_to_tokens(text, max_tokens):
+    if max_tokens <= 0:
+        return ""
+    tokenizer = get_tokenizer()
+    if tokenizer is not None:
+        offsets = tokenizer.encode(text, add_special_tokens=False).offsets
+        return text if len(offsets) <= max_tokens else text[:offsets[max_tokens - 1][1]]
+    used = 0
+    for match in _PIECE_PATTERN.finditer(text):
+        used += 1 + (len(match.group()) - 1) // _CHARS_PER_PIECE
+        if used > max_tokens:
+            return text[:match.start()].rstrip()
+    return text
+
+# The tokenizer loaded from TOKENIZER_PATH, or None when it is not configured or not installed
+def get_tokenizer():
+    global _tokenizer, _tokenizer_loaded
+    if _tokenizer_loaded:
+        return _tokenizer
+    with _tokenizer_lock:
+        if not _tokenizer_loaded:
+            if TOKENIZER_PATH:
+                try:
+                    # Imported here so handlers without a tokenizer do not pay for it at cold start
+                    from tokenizers import Tokenizer
+                    _tokenizer = Tokenizer.from_file(TOKENIZER_PATH)
+                except Exception as e:
+                    warning(f"Tokenizer unavailable, estimating token counts: {e}")
+            _tokenizer_loaded = True
+    return _tokenizer
@@ -0,0 +1,57 @@
+import argparse
+
+import run_bench
+
+# Micro-batching benchmark: a whole class starts negotiating at once against an endpoint with
+# a fixed number of instance slots. Each run sets a different Model_gateway batch wait; the
+# report shows the throughput of the burst against the latency each trainee sees.
+
+
+# Total model requests and prompts across every handler, including batches sent by the
+# gateway's background flusher (counted as unattributed)
+def model_totals(harness):
+    requests = prompts = 0
+    for values in harness.metrics.snapshot().values():
+        requests += values.get("model_calls", 0)
+        prompts += values.get("model_prompts", 0)
+    return requests, prompts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Model_gateway batch settings on a burst of trainees.")
+    run_bench.add_common_arguments(parser)
+    parser.set_defaults(users=60, turns=4, concurrency=60)
+    parser.add_argument("--max-wait-ms", type=float, nargs="+", default=[0, 5, 20, 50],
+                        help="MODEL_BATCH_MAX_WAIT_MS values to compare (0 disables batching)")
+    parser.add_argument("--max-batch-size", type=int, default=8, help="MODEL_BATCH_MAX_SIZE")
+    parser.add_argument("--model-slots", type=int, default=4, help="Requests the fake endpoint serves at once (0 for unlimited)")
+    parser.add_argument("--per-prompt-ms", type=float, default=10, help="Extra endpoint time per additional prompt in a batch")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'max wait ms':>12}{'wall s':>8}{'turns/s':>9}{'turn p50':>10}{'turn p95':>10}{'requests':>10}{'prompts':>9}{'batch':>7}")
+    for max_wait_ms in args.max_wait_ms:
+        harnesses = []
+
+        def configure(harness, max_wait_ms=max_wait_ms):
+            import Model_gateway
+            Model_gateway.MODEL_BATCH_MAX_WAIT_MS = max_wait_ms
+            Model_gateway.MODEL_BATCH_MAX_SIZE = args.max_batch_size
+            Model_gateway._batcher = None
+            harnesses.append(harness)
+
+        options = dict(run_bench.harness_options(args), per_prompt_ms=args.per_prompt_ms, model_slots=args.model_slots or None)
+        report = run_bench.run_workload(args.users, args.turns, args.concurrency, configure, **options)
+        requests, prompts = model_totals(harnesses[0])
+        turns = report["handlers"].get("ContinueConversation", {})
+        report["model_requests"] = requests
+        report["model_prompts"] = prompts
+        results[f"max_wait_ms={max_wait_ms}"] = report
+        print(f"{max_wait_ms:>12}{report['wall_seconds']:>8}{round(turns.get('calls', 0) / report['wall_seconds'], 1):>9}"
+              f"{turns.get('p50_ms', 0):>10}{turns.get('p95_ms', 0):>10}"
+              f"{requests:>10}{prompts:>9}{round(prompts / max(requests, 1), 2):>7}")
+    run_bench.write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import contextlib
+import gzip
+import json
+import os
+
+import fakes
+import run_bench
+
+# Chat storage benchmark: replays the standard workload once per chat history layout (see
+# Chat_store.py) and compares the turns kept, stored bytes per turn, the write units of a turn
+# and the read units of resuming a session. For the compact layout it then expires every
+# block through Archive_chat_history (TTL removal records into a fake S3), imports the
+# archive objects back and checks that every session reads the same as before.
+
+
+def chat_table_items(harness):
+    import Chat_store
+    items = []
+    for name in (Chat_store.LEGACY_TABLE, Chat_store.CHAT_SESSIONS_TABLE):
+        items.extend(harness.dynamodb.Table(name).items.values())
+    return items
+
+
+def resume_all(harness, users):
+    import workload
+    harness.metrics.counters.clear()
+    for user_index in range(users):
+        product_id = workload.PRODUCTS[user_index % len(workload.PRODUCTS)]["ProductId"]
+        harness.call("Start_or_continue_conversation", {"body": json.dumps({
+            "user_id": f"trainee-{user_index:04d}", "product_id": product_id, "progress_percentage": 1})})
+    return harness.metrics.snapshot().get("Start_or_continue_conversation", {})
+
+
+# Expire every block, archive it, wipe the table and import the archive back
+def archive_round_trip(harness, batch_size):
+    import Archive_chat_history
+    import Aws_clients
+    import Chat_store
+    s3 = fakes.FakeS3Client(harness.metrics)
+    Aws_clients._clients[('s3', None)] = s3
+    table = harness.dynamodb.Table(Chat_store.CHAT_SESSIONS_TABLE)
+    sessions = sorted({item['session_id'] for item in table.items.values()})
+    before = {session_id: Chat_store.load_session_items(session_id) for session_id in sessions}
+    removals = [{
+        'eventID': f"expired-{index:06d}",
+        'eventName': 'REMOVE',
+        'userIdentity': {'type': 'Service', 'principalId': 'dynamodb.amazonaws.com'},
+        'dynamodb': {'Keys': fakes._to_typed({'session_id': item['session_id'], 'block': item['block']}), 'OldImage': fakes._to_typed(item)}
+    } for index, item in enumerate(table._sorted_items())]
+    table.items.clear()
+    harness.metrics.set_handler("Archive_chat_history")
+    for start in range(0, len(removals), batch_size):
+        Archive_chat_history.lambda_handler({'Records': removals[start:start + batch_size]}, None)
+    harness.metrics.set_handler("import")
+    records = [json.loads(line) for stored in s3.objects.values() for line in gzip.decompress(stored['Body']).decode('utf-8').splitlines()]
+    imported = Archive_chat_history.import_sessions(records)
+    harness.metrics.set_handler(None)
+    after = {session_id: Chat_store.load_session_items(session_id) for session_id in sessions}
+    turns = sum(len(items) for items in before.values())
+    return {
+        "archive_objects": len(s3.objects),
+        "archive_bytes_per_turn": round(sum(len(stored['Body']) for stored in s3.objects.values()) / max(turns, 1), 1),
+        "blocks_imported": imported["blocks"],
+        "sessions_identical_after_import": sum(1 for session_id in sessions if before[session_id] == after[session_id]),
+        "sessions": len(sessions),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the legacy and compact chat history layouts.")
+    run_bench.add_common_arguments(parser)
+    parser.add_argument("--formats", nargs="+", default=["legacy", "compact"], help="CHAT_STORAGE_FORMAT values to compare")
+    parser.add_argument("--archive-batch", type=int, default=25, help="TTL removal records per archive invocation")
+    args = parser.parse_args()
+
+    import Chat_store
+    results = {}
+    for storage_format in args.formats:
+        captured = []
+
+        def configure(harness, storage_format=storage_format):
+            Chat_store.CHAT_STORAGE_FORMAT = storage_format
+            captured.append(harness)
+
+        report = run_bench.run_workload(args.users, args.turns, args.concurrency, configure, **run_bench.harness_options(args))
+        harness = captured[0]
+        stored = chat_table_items(harness)
+        turns_stored = sum(len(item['turns']) if 'turns' in item else 1 for item in stored)
+        continue_row = report["handlers"]["ContinueConversation"]
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            resume = resume_all(harness, args.users)
+            row = {
+                "turns_written": args.users * (args.turns + 1),
+                "turns_stored": turns_stored,
+                "items_stored": len(stored),
+                "bytes_per_stored_turn": round(sum(fakes.item_size(item) for item in stored) / max(turns_stored, 1), 1),
+                "continue_wcu_per_turn": continue_row["wcu_per_call"],
+                "resume_rcu": round(resume.get("rcu", 0) / args.users, 2),
+                "resume_dynamodb_calls": round(resume.get("dynamodb_calls", 0) / args.users, 2),
+            }
+            if storage_format == "compact":
+                row.update(archive_round_trip(harness, args.archive_batch))
+        results[storage_format] = row
+    names = list(dict.fromkeys(name for row in results.values() for name in row))
+    for name in names:
+        print(f"{name:<34}" + "".join(f"{str(results[storage_format].get(name, '-')):>12}" for storage_format in args.formats))
+    run_bench.write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
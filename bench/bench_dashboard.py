@@ -0,0 +1,104 @@
+import argparse
+import contextlib
+import json
+import os
+import time
+
+import fakes
+import run_bench
+
+# Dashboard benchmark: seeds PersonaProgress rows for many trainees across a catalog of
+# products, then loads each trainee's dashboard three ways: one Check_progress call per
+# product, one Check_progress_bulk call over the partition, and one Check_progress_bulk call
+# with an explicit product list. A second bulk load sends the ETag back to show the 304 path.
+
+
+def seed_progress(harness, users, products, coverage):
+    table = harness.dynamodb.Table('PersonaProgress')
+    for user_index in range(users):
+        for product_index, product_id in enumerate(products):
+            # Trainees have progress on a subset of the catalog
+            if (user_index + product_index) % 100 < coverage * 100:
+                table.items[(f"trainee-{user_index:04d}", product_id)] = fakes.normalize({
+                    'UserId': f"trainee-{user_index:04d}",
+                    'ProductId': product_id,
+                    'LevelsPassed': list(range(1, product_index % 3 + 1)),
+                    'ProgressPercentage': (user_index * 7 + product_index * 13) % 100
+                })
+
+
+# Load every trainee's dashboard with load(user_id) and report latency and DynamoDB work per dashboard
+def measure(harness, users, load):
+    harness.metrics.counters.clear()
+    harness.latencies.clear()
+    started_at = time.perf_counter()
+    dashboards = [None] * users
+    for user_index in range(users):
+        loaded_at = time.perf_counter()
+        dashboards[user_index] = load(f"trainee-{user_index:04d}")
+        harness.metrics.add("dashboard_ms", (time.perf_counter() - loaded_at) * 1000)
+    wall_seconds = time.perf_counter() - started_at
+    totals = {}
+    for values in harness.metrics.snapshot().values():
+        for counter, value in values.items():
+            totals[counter] = totals.get(counter, 0) + value
+    return {
+        "invocations_per_dashboard": round(totals.get("calls", 0) / users, 2),
+        "dynamodb_calls_per_dashboard": round(totals.get("dynamodb_calls", 0) / users, 2),
+        "rcu_per_dashboard": round(totals.get("rcu", 0) / users, 2),
+        "ms_per_dashboard": round(totals.get("dashboard_ms", 0) / users, 1),
+        "not_modified": sum(1 for dashboard in dashboards if dashboard == "not_modified"),
+        "wall_seconds": round(wall_seconds, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-product and bulk progress reads for the dashboard.")
+    run_bench.add_common_arguments(parser)
+    parser.add_argument("--products", type=int, default=12, help="Products in the catalog")
+    parser.add_argument("--coverage", type=float, default=0.5, help="Fraction of products each trainee has progress on")
+    args = parser.parse_args()
+
+    harness = run_bench.Harness(**run_bench.harness_options(args))
+    products = [f"Product{index:03d}" for index in range(args.products)]
+    seed_progress(harness, args.users, products, args.coverage)
+    etags = {}
+
+    def per_product(user_id):
+        return [json.loads(harness.call("Check_progress", {"body": json.dumps({"user_id": user_id, "product_id": product_id})})["body"])
+                for product_id in products]
+
+    def bulk(user_id, body_fields=None):
+        progress, cursor = [], None
+        while True:
+            body = dict(body_fields or {}, user_id=user_id, cursor=cursor)
+            result = harness.call("Check_progress_bulk", {"body": json.dumps(body)})
+            payload = json.loads(result["body"])
+            progress.extend(payload["progress"])
+            etags[user_id] = payload["etag"]
+            cursor = payload["next_cursor"]
+            if not cursor:
+                return progress
+
+    def bulk_revalidate(user_id):
+        result = harness.call("Check_progress_bulk", {"body": json.dumps({"user_id": user_id}), "headers": {"If-None-Match": etags[user_id]}})
+        return "not_modified" if result["statusCode"] == 304 else json.loads(result["body"])
+
+    runs = {
+        "check_progress_per_product": per_product,
+        "bulk_query": bulk,
+        "bulk_batch_get": lambda user_id: bulk(user_id, {"product_ids": products}),
+        "bulk_query_if_none_match": bulk_revalidate,
+    }
+    results = {}
+    print(f"{'mode':<28}{'invocations':>12}{'ddb calls':>11}{'RCU':>7}{'ms':>8}{'304s':>6}")
+    for name, load in runs.items():
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results[name] = row = measure(harness, args.users, load)
+        print(f"{name:<28}{row['invocations_per_dashboard']:>12}{row['dynamodb_calls_per_dashboard']:>11}{row['rcu_per_dashboard']:>7}"
+              f"{row['ms_per_dashboard']:>8}{row['not_modified']:>6}")
+    run_bench.write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import contextlib
+import gzip
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import run_bench
+
+# Transcript export benchmark: replays the standard workload, then exports every turn with
+# Export_transcripts using 1 and more scan segments, against DynamoDB pages shrunk to
+# --page-kb so a small workload still spans many pages. Reports rows, wall time, scan pages,
+# read units and the peak memory of the export, and checks every stored turn was exported
+# once with its assessment.
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the segmented transcript export.")
+    run_bench.add_common_arguments(parser)
+    parser.add_argument("--segments", nargs="+", type=int, default=[1, 4, 8], help="TotalSegments values to compare")
+    parser.add_argument("--page-kb", type=int, default=16, help="Scan page size of the fake DynamoDB")
+    parser.add_argument("--sentiment-mode", default="combined", help="ContinueConversation SENTIMENT_MODE")
+    args = parser.parse_args()
+
+    import Chat_store
+    import Export_transcripts
+    captured = []
+
+    def configure(harness):
+        harness.modules["ContinueConversation"].SENTIMENT_MODE = args.sentiment_mode
+        captured.append(harness)
+
+    run_bench.run_workload(args.users, args.turns, args.concurrency, configure, **run_bench.harness_options(args))
+    harness = captured[0]
+    harness.dynamodb.page_size_bytes = args.page_kb * 1024
+    stored_turns = sum(len(item['turns']) for item in harness.dynamodb.Table(Chat_store.CHAT_SESSIONS_TABLE).items.values())
+
+    print(f"{'segments':>8}{'rows':>8}{'seconds':>9}{'pages':>7}{'RCU':>8}{'peak MB':>9}{'scored':>8}{'dupes':>7}")
+    results = {}
+    for segments in args.segments:
+        with tempfile.TemporaryDirectory() as out_dir:
+            harness.metrics.counters.clear()
+            tracemalloc.start()
+            started_at = time.perf_counter()
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                summary = Export_transcripts.export_all(out_dir, "ndjson", segments)
+            seconds = time.perf_counter() - started_at
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            rows = []
+            for name in sorted(os.listdir(out_dir)):
+                with gzip.open(os.path.join(out_dir, name), 'rt') as handle:
+                    rows.extend(json.loads(line) for line in handle)
+        # The segments run on worker threads, which have no current handler
+        counters = harness.metrics.snapshot().get("unattributed", {})
+        keys = {(row["session_id"], row["turn"]) for row in rows}
+        results[segments] = row = {
+            "rows": summary["rows"],
+            "stored_turns": stored_turns,
+            "seconds": round(seconds, 2),
+            "pages": summary["pages"],
+            "rcu": counters.get("rcu", 0),
+            "peak_mb": round(peak_bytes / 1e6, 2),
+            "scored_rows_with_mood": sum(1 for r in rows if r["conviction_score"] is not None and r["mood"]),
+            "duplicate_rows": len(rows) - len(keys),
+        }
+        print(f"{segments:>8}{row['rows']:>8}{row['seconds']:>9}{row['pages']:>7}{row['rcu']:>8}{row['peak_mb']:>9}"
+              f"{row['scored_rows_with_mood']:>8}{row['duplicate_rows']:>7}")
+    run_bench.write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
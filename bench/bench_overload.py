@@ -0,0 +1,117 @@
+import argparse
+import contextlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import run_bench
+import workload
+
+# Overload benchmark: a class larger than the endpoint can serve negotiates at once against a
+# fake endpoint with few instance slots and a short queue, which throttles everything beyond
+# it. Each client retries a failed turn like the web client does. The run is repeated with
+# Model_guard off (throttles surface as 500s) and on (admission control, jittered retries,
+# circuit breaker and degraded replies). One guard is shared by every simulated trainee, so
+# its limits behave like a fleet-wide limit.
+
+
+# Send one request, retrying failures the way a naive client would
+def call_with_client_retries(harness, handler_name, event, client_retries, succeeded=lambda result: result.get("statusCode") == 200):
+    for attempt in range(client_retries + 1):
+        result = harness.call(handler_name, event)
+        if succeeded(result):
+            return result
+        harness.metrics.add("client_retries")
+    return result
+
+
+def run_class(harness, users, turns, concurrency, client_retries):
+    outcomes = {"starts": 0, "failed_starts": 0, "turns": 0, "failed_turns": 0, "degraded_turns": 0, "deferred_scoring": 0}
+    lock = threading.Lock()
+
+    def count(outcome, amount=1):
+        with lock:
+            outcomes[outcome] += amount
+
+    def negotiate(index):
+        user_id = f"trainee-{index:04d}"
+        product_id = workload.PRODUCTS[index % len(workload.PRODUCTS)]["ProductId"]
+        started = call_with_client_retries(harness, "Start_or_continue_conversation",
+                                           {"body": json.dumps({"user_id": user_id, "product_id": product_id})}, client_retries,
+                                           lambda result: result.get("statusCode") == 200 and run_bench.session_from_start(result))
+        session_id = run_bench.session_from_start(started) if started.get("statusCode") == 200 else None
+        count("starts")
+        if not session_id:
+            count("failed_starts")
+            return
+        for turn in range(turns):
+            line = workload.SALESPERSON_LINES[(index + turn) % len(workload.SALESPERSON_LINES)]
+            result = call_with_client_retries(harness, "ContinueConversation",
+                                              {"body": json.dumps({"session_id": session_id, "user_input": line})}, client_retries)
+            count("turns")
+            if result.get("statusCode") != 200:
+                count("failed_turns")
+                continue
+            body = json.loads(result["body"])
+            count("degraded_turns", int(bool(body.get("degraded"))))
+            count("deferred_scoring", int(bool(body.get("sentiment_deferred"))))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(negotiate, range(users)))
+    return outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Model_guard off and on against a saturated endpoint.")
+    run_bench.add_common_arguments(parser)
+    parser.set_defaults(users=60, turns=4, concurrency=60)
+    parser.add_argument("--model-slots", type=int, default=4, help="Requests the fake endpoint serves at once")
+    parser.add_argument("--model-max-queue", type=int, default=8, help="Queued requests before the endpoint throttles")
+    parser.add_argument("--client-retries", type=int, default=2, help="Retries of a failed request by the client")
+    parser.add_argument("--guard-concurrency", type=int, default=8, help="MODEL_MAX_CONCURRENCY with the guard on")
+    args = parser.parse_args()
+
+    import Model_guard
+    results = {}
+    for guard in (False, True):
+        options = dict(run_bench.harness_options(args), model_slots=args.model_slots, model_max_queue=args.model_max_queue)
+        harness = run_bench.Harness(**options)
+        Model_guard.MODEL_GUARD_ENABLED = guard
+        Model_guard.MODEL_MAX_CONCURRENCY = args.guard_concurrency
+        Model_guard.reset()
+        started_at = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            outcomes = run_class(harness, args.users, args.turns, args.concurrency, args.client_retries)
+        wall_seconds = round(time.perf_counter() - started_at, 2)
+
+        totals = {}
+        for values in harness.metrics.snapshot().values():
+            for counter, value in values.items():
+                totals[counter] = totals.get(counter, 0) + value
+        latencies = harness.latencies.get("ContinueConversation", [])
+        result = dict(outcomes, wall_seconds=wall_seconds,
+                      turn_p50_ms=round(run_bench.percentile(latencies, 50), 1),
+                      turn_p95_ms=round(run_bench.percentile(latencies, 95), 1),
+                      model_requests=totals.get("model_calls", 0) + totals.get("model_throttles", 0),
+                      model_throttles=totals.get("model_throttles", 0),
+                      client_retries=totals.get("client_retries", 0),
+                      guard=Model_guard.model_stats() if guard else None)
+        results[f"guard={'on' if guard else 'off'}"] = result
+
+        print(f"== Model_guard {'on' if guard else 'off'} (wall {wall_seconds} s) ==")
+        print(f"starts {result['starts']}, failed {result['failed_starts']}; turns {result['turns']}, failed {result['failed_turns']}, degraded {result['degraded_turns']}, "
+              f"scoring deferred {result['deferred_scoring']}")
+        print(f"handler calls p50 {result['turn_p50_ms']} ms, p95 {result['turn_p95_ms']} ms, client retries {result['client_retries']}")
+        print(f"endpoint requests {result['model_requests']}, throttled {result['model_throttles']}")
+        if guard:
+            stats = result["guard"]
+            print(f"guard: shed rate {stats['shed_rate']}, retries {stats['retries']}, max queue depth {stats['max_queue_depth']}, "
+                  f"circuit opened {stats['circuit_opened']}x")
+        print()
+    run_bench.write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
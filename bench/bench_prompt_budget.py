@@ -0,0 +1,91 @@
+import argparse
+import contextlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bench_stages
+import run_bench
+import workload
+
+# Prompt budget benchmark: replays negotiations in which some salesperson messages are long
+# pitches, against an endpoint whose latency grows with prompt length (prefill), for several
+# HISTORY_TOKEN_BUDGET values, with the context storing as many tokens as the budget (or
+# --window-messages messages without one). Reports the prompt tokens per turn taken from the
+# handlers' EMF records, ContinueConversation latency and its write units per turn.
+
+LONG_PITCHES = [
+    "Let me walk you through everything. " + " ".join(workload.SALESPERSON_LINES[1:6]) + " On top of that, onboarding is included, "
+    "a dedicated account manager checks in every quarter, and if you are not satisfied within the first ninety days we refund "
+    "the full price, no questions asked, which very few companies in this market are willing to offer.",
+    "Here is how customers like you usually use it. " + " ".join(workload.SALESPERSON_LINES[2:7]) + " Most of them start with the "
+    "basic setup, then add the extra modules after a month or two once their team is comfortable, so the upfront cost stays low "
+    "and you only pay for what you actually use.",
+]
+
+
+# Values of one EMF metric for one handler among the collected lines
+def metric_values(lines, handler_name, name):
+    values = []
+    for line in "".join(lines).splitlines():
+        if line.startswith("{"):
+            record = json.loads(line)
+            if record.get("Handler") == handler_name and name in record:
+                values.append(record[name])
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare HISTORY_TOKEN_BUDGET values on negotiations with long pitches.")
+    run_bench.add_common_arguments(parser)
+    parser.set_defaults(turns=12)
+    parser.add_argument("--budgets", type=int, nargs="+", default=[0, 600, 300, 150],
+                        help="HISTORY_TOKEN_BUDGET values to compare (0 keeps the whole message window)")
+    parser.add_argument("--window-messages", type=int, default=10, help="CONTEXT_WINDOW_MESSAGES, used with budget 0")
+    parser.add_argument("--per-input-word-ms", type=float, default=0.2, help="Endpoint prefill time per prompt word")
+    args = parser.parse_args()
+
+    import Concurrent_io
+    import Session_context
+    original_lines = workload.SALESPERSON_LINES
+    # Every third message is a long pitch
+    workload.SALESPERSON_LINES = [line for pair in zip(original_lines, original_lines[1:], LONG_PITCHES * 4) for line in pair]
+    results = {}
+    print(f"{'budget':>8}{'prompt p50':>12}{'prompt p95':>12}{'dropped':>9}{'turn p50':>10}{'turn p95':>10}{'WCU':>7}")
+    try:
+        for budget in args.budgets:
+            Session_context.HISTORY_TOKEN_BUDGET = budget
+            Session_context.CONTEXT_STORE_TOKENS = budget
+            Session_context.CONTEXT_WINDOW_MESSAGES = args.window_messages
+            harness = run_bench.Harness(**run_bench.harness_options(args), per_input_word_ms=args.per_input_word_ms)
+            # Writes gathered on worker threads are charged to the handler that made them
+            Concurrent_io._executor = run_bench.fakes.AttributingExecutor(harness.metrics, 2 * args.concurrency)
+            harness.modules["ContinueConversation"].SENTIMENT_MODE = "combined"
+            collector = bench_stages.LineCollector()
+            started_at = time.perf_counter()
+            with contextlib.redirect_stdout(collector):
+                with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                    list(executor.map(lambda index: run_bench.run_negotiation(harness, index, args.turns), range(args.users)))
+            wall_seconds = round(time.perf_counter() - started_at, 2)
+
+            prompt_tokens = metric_values(collector.lines, "ContinueConversation", "prompt_tokens")
+            dropped = metric_values(collector.lines, "ContinueConversation", "history_messages_dropped")
+            turns = harness.report().get("ContinueConversation", {})
+            result = results[f"budget={budget}"] = {
+                "wall_seconds": wall_seconds,
+                "prompt_tokens_p50": run_bench.percentile(prompt_tokens, 50),
+                "prompt_tokens_p95": run_bench.percentile(prompt_tokens, 95),
+                "messages_dropped": sum(dropped),
+                "turn_p50_ms": turns.get("p50_ms", 0),
+                "turn_p95_ms": turns.get("p95_ms", 0),
+                "wcu_per_turn": turns.get("wcu_per_call", 0),
+            }
+            print(f"{budget:>8}{result['prompt_tokens_p50']:>12}{result['prompt_tokens_p95']:>12}{result['messages_dropped']:>9}"
+                  f"{result['turn_p50_ms']:>10}{result['turn_p95_ms']:>10}{result['wcu_per_turn']:>7}")
+    finally:
+        workload.SALESPERSON_LINES = original_lines
+    run_bench.write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import contextlib
+import gzip
+import json
+import os
+
+import run_bench
+import workload
+
+# Resume benchmark: plays sessions of --turns turns, then resumes each one the way the app
+# does after every few new turns. Compares downloading the whole history each time with
+# sending back the previous next_cursor, in both response encodings, and reports response
+# bytes (plain and gzipped, as API Gateway compression would send them), RCU and DynamoDB
+# calls per resume.
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare full and incremental resume of previous messages.")
+    run_bench.add_common_arguments(parser)
+    parser.add_argument("--new-turns", type=int, default=2, help="Turns played between two resumes")
+    parser.add_argument("--resumes", type=int, default=5, help="Resumes per session after the first full load")
+    parser.set_defaults(turns=40, users=20)
+    args = parser.parse_args()
+
+    harness = run_bench.Harness(**run_bench.harness_options(args))
+    harness.modules["ContinueConversation"].SENTIMENT_MODE = "combined"
+    devnull = open(os.devnull, "w")
+    sessions = []
+    with contextlib.redirect_stdout(devnull):
+        for index in range(args.users):
+            user_id = f"trainee-{index:04d}"
+            product_id = workload.PRODUCTS[index % len(workload.PRODUCTS)]["ProductId"]
+            session_id = run_bench.session_from_start(harness.call("Start_or_continue_conversation", {"body": json.dumps({"user_id": user_id, "product_id": product_id})}))
+            for turn in range(args.turns):
+                harness.call("ContinueConversation", {"body": json.dumps({"session_id": session_id, "user_input": workload.SALESPERSON_LINES[turn % len(workload.SALESPERSON_LINES)]})})
+            sessions.append((user_id, product_id, session_id))
+
+    def resume(user_id, product_id, **options):
+        harness.metrics.set_handler("resume")
+        result = harness.modules["Start_or_continue_conversation"].lambda_handler(
+            {"body": json.dumps(dict(user_id=user_id, product_id=product_id, progress_percentage=1, **options))}, None)
+        harness.metrics.set_handler(None)
+        return result["body"]
+
+    results = {}
+    for strategy, encoding in (("full", "objects"), ("cursor", "objects"), ("cursor", "rows")):
+        harness.metrics.counters.clear()
+        sizes = []
+        with contextlib.redirect_stdout(devnull):
+            cursors = {user_id: json.loads(resume(user_id, product_id, encoding=encoding))["next_cursor"] for user_id, product_id, _ in sessions}
+            harness.metrics.counters.clear()
+            for _ in range(args.resumes):
+                for user_id, product_id, session_id in sessions:
+                    for turn in range(args.new_turns):
+                        harness.metrics.set_handler("play")
+                        harness.modules["ContinueConversation"].lambda_handler(
+                            {"body": json.dumps({"session_id": session_id, "user_input": workload.SALESPERSON_LINES[turn]})}, None)
+                        harness.metrics.set_handler(None)
+                    options = {"encoding": encoding}
+                    if strategy == "cursor":
+                        options["cursor"] = cursors[user_id]
+                    body = resume(user_id, product_id, **options)
+                    cursors[user_id] = json.loads(body)["next_cursor"]
+                    sizes.append((len(body.encode("utf-8")), len(gzip.compress(body.encode("utf-8")))))
+        counters = harness.metrics.snapshot().get("resume", {})
+        resumes = len(sizes)
+        results[f"{strategy}/{encoding}"] = row = {
+            "bytes_per_resume": round(sum(plain for plain, _ in sizes) / resumes),
+            "gzip_bytes_per_resume": round(sum(packed for _, packed in sizes) / resumes),
+            "rcu_per_resume": round(counters.get("rcu", 0) / resumes, 2),
+            "dynamodb_calls_per_resume": round(counters.get("dynamodb_calls", 0) / resumes, 2),
+        }
+    print(f"{'strategy':<18}{'bytes':>9}{'gzip':>9}{'RCU':>8}{'ddb':>6}")
+    for name, row in results.items():
+        print(f"{name:<18}{row['bytes_per_resume']:>9}{row['gzip_bytes_per_resume']:>9}{row['rcu_per_resume']:>8}{row['dynamodb_calls_per_resume']:>6}")
+    run_bench.write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import contextlib
+import json
+import os
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import run_bench
+import workload
+
+# Retry benchmark: every simulated trainee plays a client that gives up on a turn after
+# --client-timeout-ms and sends it again, up to --attempts times, while the earlier attempts
+# keep running server-side like a Lambda whose caller hung up. Compared with and without an
+# idempotency key, it reports the model calls and stored turns per turn the trainee meant to
+# send, the replies that disagree with what was stored, and the latency the client saw.
+
+
+def play(harness, user_index, args, with_key, attempt_pool):
+    import Chat_store
+    user_id = f"trainee-{user_index:04d}"
+    product_id = workload.PRODUCTS[user_index % len(workload.PRODUCTS)]["ProductId"]
+    session_id = run_bench.session_from_start(harness.call("Start_or_continue_conversation", {"body": json.dumps({"user_id": user_id, "product_id": product_id})}))
+    if not session_id:
+        return None
+    stats = {"turns": 0, "client_ms": [], "statuses": {}, "replies": []}
+    for turn in range(args.turns):
+        body = {"session_id": session_id, "user_input": workload.SALESPERSON_LINES[(user_index + turn) % len(workload.SALESPERSON_LINES)]}
+        if with_key:
+            body["idempotency_key"] = str(uuid.uuid4())
+        started_at = time.perf_counter()
+        attempts = [attempt_pool.submit(harness.call, "ContinueConversation", {"body": json.dumps(body)})]
+        answer = None
+        pending = set(attempts)
+        while answer is None and pending:
+            # Another attempt is sent each time the client times out, while earlier ones keep running
+            timeout = args.client_timeout_ms / 1000.0 if len(attempts) < args.attempts else None
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for attempt in done:
+                result = attempt.result()
+                if result["statusCode"] == 200 and answer is None:
+                    answer = json.loads(result["body"])["ai_response"]
+            if answer is None and not done and len(attempts) < args.attempts:
+                attempts.append(attempt_pool.submit(harness.call, "ContinueConversation", {"body": json.dumps(body)}))
+                pending.add(attempts[-1])
+        stats["client_ms"].append((time.perf_counter() - started_at) * 1000)
+        stats["turns"] += 1
+        if answer is not None:
+            stats["replies"].append(answer)
+        wait(attempts)
+        for attempt in attempts:
+            status = attempt.result()["statusCode"]
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+    stats["stored"] = Chat_store.load_session_items(session_id)[1:]
+    return stats
+
+
+def run_mode(with_key, args):
+    harness = run_bench.Harness(**run_bench.harness_options(args))
+    import Concurrent_io
+    import fakes
+    Concurrent_io._executor = fakes.AttributingExecutor(harness.metrics, 4 * args.concurrency)
+    harness.modules["ContinueConversation"].SENTIMENT_MODE = "combined"
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        with ThreadPoolExecutor(max_workers=args.attempts * args.concurrency) as attempt_pool:
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                results = [r for r in executor.map(lambda index: play(harness, index, args, with_key, attempt_pool), range(args.users)) if r]
+    counters = harness.metrics.snapshot().get("ContinueConversation", {})
+    turns = sum(r["turns"] for r in results)
+    stored = [item for r in results for item in r["stored"]]
+    statuses = {}
+    for r in results:
+        for status, count in r["statuses"].items():
+            statuses[status] = statuses.get(status, 0) + count
+    mismatched = sum(1 for r in results for reply in r["replies"] if reply not in {item.get("ai_response") for item in r["stored"]})
+    client_ms = [ms for r in results for ms in r["client_ms"]]
+    return {
+        "turns_sent": turns,
+        "attempts": sum(statuses.values()),
+        "model_calls_per_turn": round(counters.get("model_calls", 0) / max(turns, 1), 2),
+        "stored_turns_per_turn": round(len(stored) / max(turns, 1), 2),
+        "replies_not_stored": mismatched,
+        "client_p50_ms": round(run_bench.percentile(client_ms, 50), 1),
+        "client_p95_ms": round(run_bench.percentile(client_ms, 95), 1),
+        "statuses": dict(sorted(statuses.items())),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure what client retries cost with and without idempotency keys.")
+    run_bench.add_common_arguments(parser)
+    parser.add_argument("--client-timeout-ms", type=float, default=150, help="Client gives up on an attempt after this long")
+    parser.add_argument("--attempts", type=int, default=3, help="Attempts per turn, including the first")
+    args = parser.parse_args()
+
+    results = {}
+    for with_key in (False, True):
+        results[f"idempotency_key={int(with_key)}"] = row = run_mode(with_key, args)
+        print(f"== idempotency key: {'yes' if with_key else 'no'} ==")
+        for name, value in row.items():
+            print(f"  {name:<24}{value}")
+        print()
+    run_bench.write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import time
+
+import run_bench
+
+# Rollup benchmark: replays the standard workload with the chat history stream captured, feeds
+# the stream to Aggregate_rollups in Lambda-sized batches (redelivering some batches, as
+# Lambda does after a failure), checks the rollups against a single in-memory pass over the
+# same records, checks each team's leaderboard comes back in order from the rank index, and
+# compares a team dashboard read with the scan it replaces.
+
+
+# Counters of a rollup table item without the bookkeeping attributes
+def counters(item):
+    return {name: int(value) for name, value in item.items() if name not in ("RollupKey", "Member", "updated_at")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and cost the stream-fed leaderboard rollups.")
+    run_bench.add_common_arguments(parser)
+    parser.add_argument("--teams", type=int, default=4, help="Teams the trainees are spread across")
+    parser.add_argument("--batch-size", type=int, default=25, help="Stream records per aggregation batch")
+    parser.add_argument("--redeliver", type=float, default=0.2, help="Fraction of batches delivered twice")
+    parser.add_argument("--sentiment-mode", default="combined", help="ContinueConversation SENTIMENT_MODE")
+    args = parser.parse_args()
+
+    import Aggregate_rollups
+    import Chat_store
+    chat_table = Chat_store.LEGACY_TABLE if Chat_store.CHAT_STORAGE_FORMAT == "legacy" else Chat_store.CHAT_SESSIONS_TABLE
+    streams = []
+
+    def configure(harness):
+        harness.modules["ContinueConversation"].SENTIMENT_MODE = args.sentiment_mode
+        teams = harness.dynamodb.Table("UserTeams")
+        for index in range(args.users):
+            teams.items[(f"trainee-{index:04d}",)] = {"UserId": f"trainee-{index:04d}", "TeamId": f"team-{index % args.teams}"}
+        streams.append(harness.dynamodb.Table(chat_table).enable_stream())
+        streams.append(harness)
+
+    run_bench.run_workload(args.users, args.turns, args.concurrency, configure, **run_bench.harness_options(args))
+    records, harness = streams
+    Aggregate_rollups._teams.clear()
+
+    # Feed the stream in batches, delivering some of them twice
+    rng = random.Random(7)
+    batches = [records[start:start + args.batch_size] for start in range(0, len(records), args.batch_size)]
+    deliveries = [batch for batch in batches for _ in range(2 if rng.random() < args.redeliver else 1)]
+    harness.metrics.set_handler("Aggregate_rollups")
+    started_at = time.perf_counter()
+    results = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for batch in deliveries:
+            results.append(Aggregate_rollups.lambda_handler({"Records": batch}, None))
+    aggregation_seconds = time.perf_counter() - started_at
+    harness.metrics.set_handler(None)
+
+    # Reference: every record applied exactly once in memory
+    reference = Aggregate_rollups.MemoryRollupStore()
+    events = [event for record in records for event in Aggregate_rollups.events_from_stream_record(record)]
+    Aggregate_rollups.aggregate(events, reference)
+    stored = {key: counters(item) for key, item in harness.dynamodb.Table("Rollups").items.items() if key[1] != "STATE"}
+    mismatches = [key for key, values in reference.rollups.items() if stored.get(key) != values]
+
+    # Team dashboards from the rollups, against scanning the raw chat rows. Each leaderboard
+    # must match sorting all of the team's reference rows (levels passed, then fewer turns).
+    import Team_dashboard
+    leaderboards_in_order = 0
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for team in range(args.teams):
+            result = harness.call("Team_dashboard", {"body": json.dumps({"team_id": f"team-{team}"})})
+            members = [values for (rollup_key, _), values in reference.rollups.items() if rollup_key == f"LEADERBOARD#team-{team}"]
+            expected = sorted(((-values.get("levels_passed", 0), values.get("turns", 0)) for values in members))[:Team_dashboard.LEADERBOARD_SIZE]
+            returned = [(-entry["levels_passed"], entry["turns"]) for entry in json.loads(result["body"])["leaderboard"]]
+            leaderboards_in_order += returned == expected
+        harness.metrics.set_handler("chat history scan")
+        scan_kwargs = {}
+        while True:
+            response = harness.dynamodb.Table(chat_table).scan(**scan_kwargs)
+            if "LastEvaluatedKey" not in response:
+                break
+            scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        harness.metrics.set_handler(None)
+
+    counters_by_handler = harness.metrics.snapshot()
+    aggregation = counters_by_handler.get("Aggregate_rollups", {})
+    dashboard = counters_by_handler.get("Team_dashboard", {})
+    scan = counters_by_handler.get("chat history scan", {})
+    counted = len(events)
+    product_totals = [values for (rollup_key, _), values in reference.rollups.items() if rollup_key.startswith("PRODUCT#")]
+    summary = {
+        "stream_records": len(records),
+        "turn_events": counted,
+        "sessions_counted": sum(values.get("sessions", 0) for values in product_totals),
+        "turns_counted": sum(values.get("turns", 0) for values in product_totals),
+        "levels_passed": sum(values.get("levels_passed", 0) for values in product_totals),
+        "batches_delivered": len(deliveries),
+        "duplicates_skipped": sum(result["duplicates"] for result in results),
+        "rollups_matching_reference": len(reference.rollups) - len(mismatches),
+        "rollups_mismatched": len(mismatches),
+        "aggregation_wcu_per_event": round(aggregation.get("wcu", 0) / max(counted, 1), 2),
+        "aggregation_rcu_per_event": round(aggregation.get("rcu", 0) / max(counted, 1), 2),
+        "aggregation_ms_per_batch": round(aggregation_seconds * 1000 / max(len(deliveries), 1), 1),
+        "leaderboards_in_order": f"{leaderboards_in_order} of {args.teams}",
+        "dashboard_rcu": round(dashboard.get("rcu", 0) / args.teams, 2),
+        "dashboard_p50_ms": round(run_bench.percentile(harness.latencies.get("Team_dashboard", []), 50), 1),
+        "scan_rcu": scan.get("rcu", 0),
+    }
+    for name, value in summary.items():
+        print(f"{name:<30}{round(value, 2) if isinstance(value, float) else value}")
+    run_bench.write_json(args.json, summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import contextlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import run_bench
+import workload
+
+# Session-start benchmark: every simulated trainee opens a fresh session through
+# Start_or_continue_conversation, once with StartConversation run in-process and once with
+# it invoked as a separate Lambda, and then with the opening-line pools filled by
+# Pregenerate_openings so no model call is needed. Only the start path is exercised.
+
+MODES = ["inprocess", "lambda"]
+
+
+# Start one session per trainee and return the orchestrator's report row
+def run_starts(mode, users, concurrency, pool_size=0, **harness_options):
+    harness = run_bench.Harness(**harness_options)
+    harness.modules["Start_or_continue_conversation"].START_CONVERSATION_MODE = mode
+    if pool_size:
+        import Pregenerate_openings
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            Pregenerate_openings.refresh_all(pool_size=pool_size)
+
+    def start(index):
+        user_id = f"trainee-{index:04d}"
+        product_id = workload.PRODUCTS[index % len(workload.PRODUCTS)]["ProductId"]
+        result = harness.call("Start_or_continue_conversation", {"body": json.dumps({"user_id": user_id, "product_id": product_id})})
+        if not run_bench.session_from_start(result):
+            harness.metrics.add("errors")
+
+    started_at = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(start, range(users)))
+    return {"wall_seconds": round(time.perf_counter() - started_at, 2), "handlers": harness.report()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare session-start latency with and without the Lambda hop.")
+    run_bench.add_common_arguments(parser)
+    parser.add_argument("--modes", nargs="+", default=MODES, help="START_CONVERSATION_MODE values to compare")
+    parser.add_argument("--opening-pool-size", type=int, default=8,
+                        help="Opening lines per level for the pre-generated pool runs (0 skips them)")
+    args = parser.parse_args()
+
+    results = {}
+    for pool_size in sorted({0, args.opening_pool_size}):
+        for mode in args.modes:
+            title = f"start mode: {mode}" + (f", opening pool of {pool_size}" if pool_size else "")
+            key = f"start_mode={mode},opening_pool={pool_size}"
+            results[key] = run_starts(mode, args.users, args.concurrency, pool_size, **run_bench.harness_options(args))
+            run_bench.print_report(title, results[key])
+    run_bench.write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
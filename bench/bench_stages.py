@@ -0,0 +1,79 @@
+import argparse
+import contextlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import run_bench
+
+# Stage benchmark: replays the standard workload and collects the EMF lines Telemetry writes
+# for every invocation, then reports p50/p95 per stage per handler. Use it to see where a
+# handler spends its time before and after a change, from the same records CloudWatch gets.
+
+
+# Collects the lines written to stdout by concurrent handlers
+class LineCollector:
+    def __init__(self):
+        self.lines = []
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        with self.lock:
+            self.lines.append(text)
+
+    def flush(self):
+        pass
+
+
+# Per handler: {stage: [milliseconds, ...]} from the EMF records among the collected lines
+def stage_samples(lines):
+    samples = {}
+    for line in "".join(lines).splitlines():
+        if not line.startswith("{"):
+            continue
+        record = json.loads(line)
+        if "_aws" not in record:
+            continue
+        handler_samples = samples.setdefault(record["Handler"], {})
+        for definition in record["_aws"]["CloudWatchMetrics"][0]["Metrics"]:
+            if definition["Unit"] == "Milliseconds":
+                handler_samples.setdefault(definition["Name"][:-3], []).append(record[definition["Name"]])
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report per-stage latency from the handlers' EMF records.")
+    run_bench.add_common_arguments(parser)
+    parser.add_argument("--sentiment-mode", default="inprocess", help="ContinueConversation SENTIMENT_MODE")
+    args = parser.parse_args()
+
+    harness = run_bench.Harness(**run_bench.harness_options(args))
+    handler = harness.modules["ContinueConversation"]
+    handler.SENTIMENT_MODE = args.sentiment_mode
+    collector = LineCollector()
+    started_at = time.perf_counter()
+    with contextlib.redirect_stdout(collector):
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(lambda index: run_bench.run_negotiation(harness, index, args.turns), range(args.users)))
+    wall_seconds = round(time.perf_counter() - started_at, 2)
+
+    results = {}
+    print(f"== per-stage latency, sentiment mode {args.sentiment_mode} (wall {wall_seconds} s) ==")
+    for handler_name, stages in sorted(stage_samples(collector.lines).items()):
+        print(f"{handler_name}")
+        print(f"  {'stage':<24}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}")
+        rows = results[handler_name] = {}
+        for stage_name, values in sorted(stages.items(), key=lambda item: -run_bench.percentile(item[1], 50)):
+            rows[stage_name] = {
+                "count": len(values),
+                "p50_ms": round(run_bench.percentile(values, 50), 1),
+                "p95_ms": round(run_bench.percentile(values, 95), 1),
+            }
+            print(f"  {stage_name:<24}{len(values):>7}{rows[stage_name]['p50_ms']:>9}{rows[stage_name]['p95_ms']:>9}")
+        print()
+    run_bench.write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import contextlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import run_bench
+import workload
+
+# Concurrent I/O benchmark: replays the standard workload with CONCURRENT_IO on and off, then
+# measures the two paths that have independent DynamoDB calls: opening a session
+# (StartConversation writes the opening and the context side by side) and the first turn of a
+# session whose context predates the session state (the chat history is read while the
+# product is fetched into a cold cache). Reports p50/p95 per path; the regular turn writes
+# everything in one transaction, so it has nothing to overlap.
+
+STATE_ATTRIBUTES = ('user_id', 'start_level', 'progress_percentage', 'version')
+
+
+def run_mode(concurrent_io, args):
+    import Concurrent_io
+    import Product_cache
+    captured = []
+
+    def configure(harness):
+        Concurrent_io.CONCURRENT_IO = concurrent_io
+        captured.append(harness)
+
+    report = run_bench.run_workload(args.users, args.turns, args.concurrency, configure, **run_bench.harness_options(args))
+    harness = captured[0]
+    harness.latencies.clear()
+    harness.metrics.counters.clear()
+
+    def start(index):
+        product_id = workload.PRODUCTS[index % len(workload.PRODUCTS)]["ProductId"]
+        harness.call("StartConversation", {"user_id": f"opener-{index:04d}", "product_id": product_id})
+
+    contexts = harness.dynamodb.Table('SessionContext').items
+    old_contexts = [context for context in contexts.values() if not context['user_id'].startswith('opener-')]
+    for context in old_contexts:
+        for name in STATE_ATTRIBUTES:
+            context.pop(name, None)
+
+    def first_turn(context):
+        # Every container is cold for its product, like a fresh deployment
+        Product_cache.invalidate(context['ProductId'])
+        harness.call("ContinueConversation", {"body": json.dumps({"session_id": context['session_id'], "user_input": workload.SALESPERSON_LINES[0]})})
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(start, range(args.users)))
+        # One at a time, so one trainee's cache fill does not serve another's
+        for context in old_contexts:
+            first_turn(context)
+    paths = {
+        "ContinueConversation (regular turn)": report["handlers"]["ContinueConversation"],
+        "StartConversation": harness.report()["StartConversation"],
+        "ContinueConversation (pre-state context, cold product)": harness.report()["ContinueConversation"],
+    }
+    return {path: {"p50_ms": row["p50_ms"], "p95_ms": row["p95_ms"], "ddb": row["dynamodb_calls_per_call"], "errors": row["errors"]}
+            for path, row in paths.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare handler latency with and without concurrent DynamoDB calls.")
+    run_bench.add_common_arguments(parser)
+    args = parser.parse_args()
+
+    results = {}
+    for concurrent_io in (False, True):
+        started_at = time.perf_counter()
+        results[f"concurrent_io={int(concurrent_io)}"] = rows = run_mode(concurrent_io, args)
+        print(f"== CONCURRENT_IO={int(concurrent_io)} (wall {time.perf_counter() - started_at:.2f} s) ==")
+        print(f"{'path':<56}{'p50 ms':>9}{'p95 ms':>9}{'ddb':>6}{'err':>5}")
+        for path, row in rows.items():
+            print(f"{path:<56}{row['p50_ms']:>9}{row['p95_ms']:>9}{row['ddb']:>6}{row['errors']:>5}")
+        print()
+    run_bench.write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+from Sentiment_rules import RULES_MIN_CONFIDENCE, score_by_rules
+
+# Evaluates the rule-based sentiment fast path on a labeled set: how many model calls it
+# saves (coverage), how often it agrees with the reference on the replies it answers, and
+# how long a rule evaluation takes. The reference is the hand labels by default, or the live
+# SageMaker analyzer with --reference model (requires AWS credentials and the endpoint).
+
+DEFAULT_EVAL_SET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sentiment_eval.jsonl")
+
+
+# Helper function to map a conviction score to the rubric range used in the analyzer prompt
+def score_bucket(score):
+    if score <= 30:
+        return "0-30"
+    if score <= 60:
+        return "31-60"
+    if score <= 80:
+        return "61-80"
+    return "81-100"
+
+
+def load_examples(path):
+    with open(path) as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the rule-based sentiment fast path.")
+    parser.add_argument("--eval-set", default=DEFAULT_EVAL_SET, help="JSONL file with text and labels")
+    parser.add_argument("--reference", choices=["labels", "model"], default="labels", help="What the rules are compared against")
+    parser.add_argument("--verbose", action="store_true", help="Print every disagreement")
+    args = parser.parse_args()
+
+    examples = load_examples(args.eval_set)
+    if args.reference == "model":
+        from Analyze_sentiment import analyze_with_model
+        references = [analyze_with_model(example["text"]) for example in examples]
+    else:
+        references = examples
+
+    answered = convinced_ok = mood_ok = bucket_ok = false_convinced = 0
+    elapsed_ns = 0
+    for example, reference in zip(examples, references):
+        started_at = time.perf_counter_ns()
+        result = score_by_rules(example["text"])
+        elapsed_ns += time.perf_counter_ns() - started_at
+        if result is None or result["confidence"] < RULES_MIN_CONFIDENCE:
+            continue
+        answered += 1
+        convinced_ok += result["convinced"] == reference["convinced"]
+        mood_ok += result["mood"] == reference["mood"]
+        bucket_ok += score_bucket(result["conviction_score"]) == score_bucket(reference["conviction_score"])
+        false_convinced += result["convinced"] and not reference["convinced"]
+        if args.verbose and (result["convinced"] != reference["convinced"] or result["mood"] != reference["mood"]):
+            print(f"disagree: {example['text']!r} rules={result} reference={reference}")
+
+    total = len(examples)
+    print(f"examples:                 {total}")
+    print(f"answered by rules:        {answered} ({answered / total:.0%} of model calls saved)")
+    if answered:
+        print(f"convinced agreement:      {convinced_ok / answered:.0%}")
+        print(f"mood agreement:           {mood_ok / answered:.0%}")
+        print(f"score range agreement:    {bucket_ok / answered:.0%}")
+        print(f"false 'convinced':        {false_convinced}")
+    print(f"mean rule latency:        {elapsed_ns / total / 1000:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
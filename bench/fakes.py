@@ -0,0 +1,852 @@
+import contextlib
+import io
+import json
+import math
+import re
+import threading
+import time
+from decimal import Decimal
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import Binary, TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+# In-memory stand-ins for DynamoDB, SageMaker and Lambda used by the offline benchmarks.
+# They are installed into Aws_clients so the real handlers run unchanged, and they account
+# for every call: latency per handler, DynamoDB capacity units and model invocations.
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+# Shaped like the service's errors: ClientErrors whose response carries the error code and,
+# for a cancelled transaction, one cancellation reason per item
+class ConditionalCheckFailedException(ClientError):
+    def __init__(self, message, operation_name='PutItem'):
+        super().__init__({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': message}}, operation_name)
+
+
+class TransactionCanceledException(ClientError):
+    def __init__(self, reasons):
+        message = f"Transaction cancelled, please refer cancellation reasons for specific reasons [{', '.join(reasons)}]"
+        super().__init__({'Error': {'Code': 'TransactionCanceledException', 'Message': message},
+                          'CancellationReasons': [{'Code': reason} for reason in reasons]}, 'TransactWriteItems')
+
+
+# Collects per-handler counters. The benchmark sets the current handler around each call;
+# work done in nested in-process Lambda invocations is charged to the outer handler.
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.counters = {}
+
+    def set_handler(self, handler_name):
+        self.local.handler = handler_name
+
+    def add(self, counter, amount=1):
+        handler_name = getattr(self.local, 'handler', None) or "unattributed"
+        with self.lock:
+            bucket = self.counters.setdefault(handler_name, {})
+            bucket[counter] = bucket.get(counter, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return {name: dict(values) for name, values in self.counters.items()}
+
+
+# Helper function to sleep for a simulated service latency
+def simulate_latency(milliseconds):
+    if milliseconds > 0:
+        time.sleep(milliseconds / 1000.0)
+
+
+# Helper function to store values the way DynamoDB returns them (ints become Decimal,
+# floats are rejected just like boto3 does)
+def normalize(value):
+    return _deserializer.deserialize(_serializer.serialize(value))
+
+
+# Approximate item size in bytes for capacity accounting; binary values count their length
+def item_size(item):
+    return len(json.dumps(item, default=_size_placeholder).encode('utf-8'))
+
+
+def _size_placeholder(value):
+    if isinstance(value, (bytes, Binary)):
+        return "b" * len(bytes(getattr(value, 'value', value)))
+    return str(value)
+
+
+def read_units(size_bytes, consistent=False):
+    units = max(1, math.ceil(size_bytes / 4096))
+    return units if consistent else units / 2
+
+
+def write_units(size_bytes):
+    return max(1, math.ceil(size_bytes / 1024))
+
+
+# ---------------------------------------------------------------------------------------
+# Expression evaluation (condition, key condition, filter and update expressions)
+# ---------------------------------------------------------------------------------------
+
+_TOKEN_PATTERN = re.compile(r"\s*(<>|<=|>=|=|<|>|\(|\)|,|\+|-|\[\d+\]|\.|:[A-Za-z0-9_]+|#[A-Za-z0-9_]+|[A-Za-z_][A-Za-z0-9_]*)")
+_MISSING = object()
+
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _TOKEN_PATTERN.match(expression, position)
+        if not match:
+            raise ValueError(f"Cannot parse expression near: {expression[position:]}")
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, expression, names, values):
+        self.tokens = _tokenize(expression)
+        self.index = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self, offset=0):
+        index = self.index + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if expected is not None and (token is None or token.upper() != expected):
+            raise ValueError(f"Expected {expected}, found {token}")
+        self.index += 1
+        return token
+
+    # path := name ('.' name | '[n]')*
+    def path(self):
+        parts = [self._name(self.take())]
+        while self.peek() in ('.',) or (self.peek() or '').startswith('['):
+            token = self.take()
+            if token == '.':
+                parts.append(self._name(self.take()))
+            else:
+                parts.append(int(token[1:-1]))
+        return parts
+
+    def _name(self, token):
+        return self.names[token] if token.startswith('#') else token
+
+    # operand := ':value' | path | size(path) | function(...)
+    def operand(self):
+        token = self.peek()
+        if token.startswith(':'):
+            self.take()
+            value = self.values[token]
+            return lambda item, value=value: value
+        if self.peek(1) == '(':
+            return self.function()
+        path = self.path()
+        return lambda item, path=path: _get_path(item, path)
+
+    def function(self):
+        name = self.take().lower()
+        self.take('(')
+        args = []
+        if name in ('attribute_exists', 'attribute_not_exists', 'if_not_exists', 'size'):
+            args.append(self.path())
+        else:
+            args.append(self.operand())
+        while self.peek() == ',':
+            self.take(',')
+            args.append(self.operand())
+        self.take(')')
+        if name == 'attribute_exists':
+            return lambda item: _get_path(item, args[0]) is not _MISSING
+        if name == 'attribute_not_exists':
+            return lambda item: _get_path(item, args[0]) is _MISSING
+        if name == 'begins_with':
+            return lambda item: isinstance(args[0](item), str) and args[0](item).startswith(args[1](item))
+        if name == 'contains':
+            return lambda item: _contains(args[0](item), args[1](item))
+        if name == 'size':
+            return lambda item: Decimal(len(_get_path(item, args[0])))
+        if name == 'if_not_exists':
+            return lambda item: args[1](item) if _get_path(item, args[0]) is _MISSING else _get_path(item, args[0])
+        if name == 'list_append':
+            return lambda item: list(args[0](item)) + list(args[1](item))
+        raise ValueError(f"Unsupported function {name}")
+
+    # condition grammar with the usual precedence: NOT > AND > OR
+    def condition(self):
+        left = self.conjunction()
+        while (self.peek() or '').upper() == 'OR':
+            self.take()
+            right = self.conjunction()
+            left = (lambda item, l=left, r=right: l(item) or r(item))
+        return left
+
+    def conjunction(self):
+        left = self.negation()
+        while (self.peek() or '').upper() == 'AND':
+            self.take()
+            right = self.negation()
+            left = (lambda item, l=left, r=right: l(item) and r(item))
+        return left
+
+    def negation(self):
+        if (self.peek() or '').upper() == 'NOT':
+            self.take()
+            inner = self.negation()
+            return lambda item: not inner(item)
+        return self.comparison()
+
+    def comparison(self):
+        if self.peek() == '(':
+            self.take('(')
+            inner = self.condition()
+            self.take(')')
+            return inner
+        left = self.operand()
+        token = (self.peek() or '').upper()
+        if token in ('=', '<>', '<', '<=', '>', '>='):
+            operator = self.take()
+            right = self.operand()
+            return lambda item: _compare(operator, left(item), right(item))
+        if token == 'BETWEEN':
+            self.take()
+            low = self.operand()
+            self.take('AND')
+            high = self.operand()
+            return lambda item: _compare('>=', left(item), low(item)) and _compare('<=', left(item), high(item))
+        if token == 'IN':
+            self.take()
+            self.take('(')
+            options = [self.operand()]
+            while self.peek() == ',':
+                self.take(',')
+                options.append(self.operand())
+            self.take(')')
+            return lambda item: any(_compare('=', left(item), option(item)) for option in options)
+        return lambda item: bool(left(item)) and left(item) is not _MISSING
+
+    # value := operand (('+' | '-') operand)?
+    def value(self):
+        left = self.operand()
+        if self.peek() in ('+', '-'):
+            operator = self.take()
+            right = self.operand()
+            if operator == '+':
+                return lambda item: left(item) + right(item)
+            return lambda item: left(item) - right(item)
+        return left
+
+
+def _get_path(item, path):
+    current = item
+    for part in path:
+        if isinstance(part, int):
+            if not isinstance(current, list) or part >= len(current):
+                return _MISSING
+            current = current[part]
+        else:
+            if not isinstance(current, dict) or part not in current:
+                return _MISSING
+            current = current[part]
+    return current
+
+
+def _set_path(item, path, value):
+    current = item
+    for part in path[:-1]:
+        current = current.setdefault(part, {}) if isinstance(part, str) else current[part]
+    if isinstance(path[-1], int):
+        current[path[-1]] = value
+    else:
+        current[path[-1]] = value
+
+
+def _remove_path(item, path):
+    current = _get_path(item, path[:-1]) if len(path) > 1 else item
+    if isinstance(current, dict):
+        current.pop(path[-1], None)
+    elif isinstance(current, list) and path[-1] < len(current):
+        current.pop(path[-1])
+
+
+def _contains(container, value):
+    if container is _MISSING:
+        return False
+    return value in container
+
+
+def _compare(operator, left, right):
+    if left is _MISSING or right is _MISSING:
+        return operator == '<>'
+    try:
+        if operator == '=':
+            return left == right
+        if operator == '<>':
+            return left != right
+        if operator == '<':
+            return left < right
+        if operator == '<=':
+            return left <= right
+        if operator == '>':
+            return left > right
+        if operator == '>=':
+            return left >= right
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported operator {operator}")
+
+
+# Helper function to turn a boto3 condition object or a string into a predicate
+def compile_condition(expression, names=None, values=None, is_key_condition=False):
+    if expression is None:
+        return lambda item: True
+    if isinstance(expression, ConditionBase):
+        built = ConditionExpressionBuilder().build_expression(expression, is_key_condition=is_key_condition)
+        expression = built.condition_expression
+        names = dict(names or {}, **built.attribute_name_placeholders)
+        values = dict(values or {}, **built.attribute_value_placeholders)
+    parser = _Parser(expression, names, values)
+    predicate = parser.condition()
+    if parser.peek() is not None:
+        raise ValueError(f"Unexpected token {parser.peek()} in {expression}")
+    return predicate
+
+
+# Apply SET / ADD / REMOVE clauses of an update expression to an item in place
+def apply_update(item, expression, names=None, values=None):
+    parser = _Parser(expression, names, values)
+    # Every value is computed from the item as it was before the update, like DynamoDB does
+    original = json_copy(item)
+    while parser.peek() is not None:
+        clause = parser.take().upper()
+        while True:
+            if clause == 'SET':
+                path = parser.path()
+                parser.take('=')
+                value = parser.value()
+                _set_path(item, path, normalize(value(original)))
+            elif clause == 'ADD':
+                path = parser.path()
+                value = parser.operand()(original)
+                current = _get_path(item, path)
+                if current is _MISSING:
+                    _set_path(item, path, normalize(value))
+                elif isinstance(current, set):
+                    current |= set(value)
+                else:
+                    _set_path(item, path, current + value)
+            elif clause == 'REMOVE':
+                _remove_path(item, parser.path())
+            else:
+                raise ValueError(f"Unsupported update clause {clause}")
+            if parser.peek() == ',':
+                parser.take(',')
+                continue
+            break
+    return item
+
+
+# ---------------------------------------------------------------------------------------
+# DynamoDB
+# ---------------------------------------------------------------------------------------
+
+class _Exceptions:
+    ConditionalCheckFailedException = ConditionalCheckFailedException
+    TransactionCanceledException = TransactionCanceledException
+
+
+class _Meta:
+    def __init__(self, client):
+        self.client = client
+
+
+# Table stand-in implementing the subset of the boto3 Table API the handlers use
+class FakeTable:
+    def __init__(self, name, key_schema, dynamodb):
+        self.name = name
+        self.key_schema = key_schema
+        self.dynamodb = dynamodb
+        self.items = {}
+        self.lock = threading.RLock()
+        self.meta = _Meta(dynamodb.client)
+        # List of stream records when the table's stream is enabled
+        self.stream = None
+
+    def enable_stream(self):
+        self.stream = []
+        return self.stream
+
+    # Append a stream record (NEW_AND_OLD_IMAGES) for a write; called with the lock held
+    def _record(self, old, new):
+        if self.stream is None:
+            return
+        event_name = 'REMOVE' if new is None else 'INSERT' if old is None else 'MODIFY'
+        images = {'Keys': _to_typed({attribute: (new or old)[attribute] for attribute in self.key_schema})}
+        if new is not None:
+            images['NewImage'] = _to_typed(new)
+        if old is not None:
+            images['OldImage'] = _to_typed(old)
+        self.stream.append({
+            'eventName': event_name,
+            'eventSourceARN': f"arn:aws:dynamodb:us-east-1:000000000000:table/{self.name}/stream/fake",
+            'dynamodb': dict(images, SequenceNumber=str(len(self.stream) + 1))
+        })
+
+    def _key(self, item):
+        return tuple(item[attribute] for attribute in self.key_schema)
+
+    def _sorted_items(self):
+        return [self.items[key] for key in sorted(self.items, key=lambda k: tuple(str(part) if not isinstance(part, Decimal) else part for part in k))]
+
+    def _charge(self, operation, read=0, write=0):
+        metrics = self.dynamodb.metrics
+        metrics.add("dynamodb_calls")
+        metrics.add(f"dynamodb_{operation}")
+        if read:
+            metrics.add("rcu", read)
+        if write:
+            metrics.add("wcu", write)
+        simulate_latency(self.dynamodb.latency_ms)
+
+    def get_item(self, Key, ConsistentRead=False, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        with self.lock:
+            item = self.items.get(self._key(normalize(Key)))
+            item = json_copy(item) if item is not None else None
+        self._charge("get_item", read=read_units(item_size(item) if item else 1, ConsistentRead))
+        if item is None:
+            return {}
+        return {'Item': project(item, ProjectionExpression, ExpressionAttributeNames)}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        item = normalize(Item)
+        with self.lock:
+            existing = self.items.get(self._key(item), {})
+            if not compile_condition(ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)(existing):
+                self._charge("put_item", write=write_units(item_size(item)))
+                raise ConditionalCheckFailedException(f"Condition failed on {self.name}")
+            self._record(self.items.get(self._key(item)), item)
+            self.items[self._key(item)] = item
+        self._charge("put_item", write=write_units(item_size(item)))
+        return {}
+
+    # Buffers nothing: each put is written (and charged) as a single put_item
+    @contextlib.contextmanager
+    def batch_writer(self, **kwargs):
+        yield self
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, ReturnValues=None, **kwargs):
+        key = normalize(Key)
+        with self.lock:
+            existing = self.items.get(self._key(key))
+            current = json_copy(existing) if existing is not None else dict(key)
+            if not compile_condition(ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)(existing or {}):
+                self._charge("update_item", write=write_units(item_size(current)))
+                raise ConditionalCheckFailedException(f"Condition failed on {self.name}", "UpdateItem")
+            updated = apply_update(current, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+            self._record(existing, updated)
+            self.items[self._key(key)] = updated
+        self._charge("update_item", write=write_units(max(item_size(updated), item_size(existing or {}))))
+        if ReturnValues in ('ALL_NEW', 'UPDATED_NEW'):
+            return {'Attributes': json_copy(updated)}
+        return {}
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        with self.lock:
+            existing = self.items.get(self._key(normalize(Key)))
+            if not compile_condition(ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)(existing or {}):
+                self._charge("delete_item", write=write_units(item_size(existing or {})))
+                raise ConditionalCheckFailedException(f"Condition failed on {self.name}", "DeleteItem")
+            removed = self.items.pop(self._key(normalize(Key)), None)
+            if removed is not None:
+                self._record(removed, None)
+        self._charge("delete_item", write=write_units(item_size(removed) if removed else 1))
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    # IndexName queries a secondary index on the table's partition key: only items with its sort
+    # key, in that order
+    def query(self, KeyConditionExpression, ScanIndexForward=True, Limit=None, ExclusiveStartKey=None,
+              FilterExpression=None, ProjectionExpression=None, ExpressionAttributeNames=None,
+              ExpressionAttributeValues=None, ConsistentRead=False, IndexName=None, **kwargs):
+        key_condition = compile_condition(KeyConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, is_key_condition=True)
+        filter_condition = compile_condition(FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        with self.lock:
+            matches = [json_copy(item) for item in self._sorted_items() if key_condition(item)]
+        index_key = None
+        if IndexName is not None:
+            index_key = self.dynamodb.INDEXES[self.name][IndexName]
+            matches = sorted((item for item in matches if index_key in item), key=lambda item: item[index_key])
+        if not ScanIndexForward:
+            matches.reverse()
+        return self._page("query", matches, Limit, ExclusiveStartKey, filter_condition, ProjectionExpression, ExpressionAttributeNames, ConsistentRead,
+                          index_key)
+
+    def scan(self, Limit=None, ExclusiveStartKey=None, FilterExpression=None, ProjectionExpression=None,
+             ExpressionAttributeNames=None, ExpressionAttributeValues=None, Segment=None, TotalSegments=None, **kwargs):
+        filter_condition = compile_condition(FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        with self.lock:
+            matches = [json_copy(item) for item in self._sorted_items()]
+        if TotalSegments:
+            matches = [item for item in matches if hash(str(item[self.key_schema[0]])) % TotalSegments == Segment]
+        return self._page("scan", matches, Limit, ExclusiveStartKey, filter_condition, ProjectionExpression, ExpressionAttributeNames, False)
+
+    # Pages like DynamoDB: at most Limit items or page_size_bytes of data are read per call,
+    # filters apply after the read and LastEvaluatedKey marks where to resume
+    def _page(self, operation, matches, limit, exclusive_start_key, filter_condition, projection, names, consistent, index_key=None):
+        if exclusive_start_key is not None:
+            start_key = self._key(normalize(exclusive_start_key))
+            keys = [self._key(item) for item in matches]
+            matches = matches[keys.index(start_key) + 1:] if start_key in keys else []
+        page, read_bytes = [], 0
+        for item in matches:
+            if limit is not None and len(page) >= limit:
+                break
+            if page and read_bytes + item_size(item) > self.dynamodb.page_size_bytes:
+                break
+            page.append(item)
+            read_bytes += item_size(item)
+        self._charge(operation, read=read_units(read_bytes or 1, consistent))
+        response = {
+            'Items': [project(item, projection, names) for item in page if filter_condition(item)],
+            'ScannedCount': len(page)
+        }
+        response['Count'] = len(response['Items'])
+        if len(page) < len(matches):
+            response['LastEvaluatedKey'] = {attribute: page[-1][attribute] for attribute in self.key_schema + ([index_key] if index_key else [])}
+        return response
+
+
+# Helper function to deep-copy an item so callers cannot mutate stored state
+def json_copy(item):
+    if isinstance(item, dict):
+        return {k: json_copy(v) for k, v in item.items()}
+    if isinstance(item, list):
+        return [json_copy(v) for v in item]
+    if isinstance(item, set):
+        return set(item)
+    return item
+
+
+# Helper function to apply a ProjectionExpression to an item
+def project(item, projection, names=None):
+    if not projection:
+        return item
+    projected = {}
+    for attribute in [part.strip() for part in projection.split(',')]:
+        attribute = (names or {}).get(attribute, attribute)
+        if attribute in item:
+            projected[attribute] = item[attribute]
+    return projected
+
+
+# Low-level DynamoDB client stand-in (typed attribute values) backed by the same tables
+class FakeDynamoDBClient:
+    exceptions = _Exceptions
+
+    def __init__(self, dynamodb):
+        self.dynamodb = dynamodb
+
+    def get_item(self, TableName, Key, **kwargs):
+        response = self.dynamodb.Table(TableName).get_item(Key=_from_typed(Key), **kwargs)
+        if 'Item' in response:
+            response['Item'] = _to_typed(response['Item'])
+        return response
+
+    def put_item(self, TableName, Item, ExpressionAttributeValues=None, **kwargs):
+        if ExpressionAttributeValues:
+            kwargs['ExpressionAttributeValues'] = _from_typed(ExpressionAttributeValues)
+        return self.dynamodb.Table(TableName).put_item(Item=_from_typed(Item), **kwargs)
+
+    def update_item(self, TableName, Key, ExpressionAttributeValues=None, **kwargs):
+        if ExpressionAttributeValues:
+            kwargs['ExpressionAttributeValues'] = _from_typed(ExpressionAttributeValues)
+        response = self.dynamodb.Table(TableName).update_item(Key=_from_typed(Key), **kwargs)
+        if 'Attributes' in response:
+            response['Attributes'] = _to_typed(response['Attributes'])
+        return response
+
+    def query(self, TableName, ExpressionAttributeValues=None, **kwargs):
+        if ExpressionAttributeValues:
+            kwargs['ExpressionAttributeValues'] = _from_typed(ExpressionAttributeValues)
+        if kwargs.get('ExclusiveStartKey'):
+            kwargs['ExclusiveStartKey'] = _from_typed(kwargs['ExclusiveStartKey'])
+        response = self.dynamodb.Table(TableName).query(**kwargs)
+        response['Items'] = [_to_typed(item) for item in response['Items']]
+        if 'LastEvaluatedKey' in response:
+            response['LastEvaluatedKey'] = _to_typed(response['LastEvaluatedKey'])
+        return response
+
+    # Reads up to 100 keys across tables in one call; each item is charged separately, rounded
+    # up to 4 KB like the real service, and missing keys cost nothing
+    def batch_get_item(self, RequestItems, **kwargs):
+        if sum(len(request['Keys']) for request in RequestItems.values()) > 100:
+            raise ValueError("Too many items requested for the BatchGetItem call")
+        responses = {}
+        for table_name, request in RequestItems.items():
+            table = self.dynamodb.Table(table_name)
+            consistent = request.get('ConsistentRead', False)
+            items, units = [], 0
+            with table.lock:
+                for key in request['Keys']:
+                    item = table.items.get(table._key(normalize(_from_typed(key))))
+                    if item is not None:
+                        items.append(json_copy(item))
+                        units += read_units(item_size(item), consistent)
+            table._charge("batch_get_item", read=units or read_units(1, consistent))
+            responses[table_name] = [_to_typed(project(item, request.get('ProjectionExpression'), request.get('ExpressionAttributeNames')))
+                                     for item in items]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    # All-or-nothing write across tables: every condition is checked before anything is
+    # applied, and each item costs two write units like the real service
+    def transact_write_items(self, TransactItems, **kwargs):
+        operations = []
+        for entry in TransactItems:
+            (kind, request), = entry.items()
+            values = _from_typed(request['ExpressionAttributeValues']) if request.get('ExpressionAttributeValues') else None
+            operations.append((kind, self.dynamodb.Table(request['TableName']), request, values))
+
+        tables = sorted({table.name: table for _, table, _, _ in operations}.values(), key=lambda table: table.name)
+        with contextlib.ExitStack() as stack:
+            for table in tables:
+                stack.enter_context(table.lock)
+            staged = []
+            reasons = []
+            for kind, table, request, values in operations:
+                if kind == 'Put':
+                    item = normalize(_from_typed(request['Item']))
+                    key = table._key(item)
+                else:
+                    key = table._key(normalize(_from_typed(request['Key'])))
+                existing = table.items.get(key)
+                condition = compile_condition(request.get('ConditionExpression'), request.get('ExpressionAttributeNames'), values)
+                reasons.append('None' if condition(existing or {}) else 'ConditionalCheckFailed')
+                if kind == 'Put':
+                    staged.append((table, key, item))
+                elif kind == 'Update':
+                    current = json_copy(existing) if existing is not None else dict(zip(table.key_schema, key))
+                    staged.append((table, key, apply_update(current, request['UpdateExpression'], request.get('ExpressionAttributeNames'), values)))
+                elif kind == 'Delete':
+                    staged.append((table, key, None))
+            units = sum(2 * write_units(item_size(item or {})) for _, _, item in staged) + 2 * (len(operations) - len(staged))
+            if any(reason != 'None' for reason in reasons):
+                failed = True
+            else:
+                failed = False
+                for table, key, item in staged:
+                    existing = table.items.pop(key, None) if item is None else table.items.get(key)
+                    if item is not None:
+                        table.items[key] = item
+                    if existing is not None or item is not None:
+                        table._record(existing, item)
+        tables[0]._charge("transact_write_items", write=units)
+        if failed:
+            raise TransactionCanceledException(reasons)
+        return {}
+
+
+def _from_typed(item):
+    return {k: _deserializer.deserialize(v) for k, v in item.items()}
+
+
+def _to_typed(item):
+    return {k: _serializer.serialize(v) for k, v in item.items()}
+
+
+# DynamoDB resource stand-in; tables are created on first access with known key schemas
+class FakeDynamoDB:
+    KEY_SCHEMAS = {
+        'ChatHistory': ['session_id', 'timestamp'],
+        'ChatSessions': ['session_id', 'block'],
+        'Products': ['ProductId'],
+        'PersonaProgress': ['UserId', 'ProductId'],
+        'LatestSession': ['UserId', 'ProductLevel'],
+        'SessionContext': ['session_id'],
+        'SentimentCache': ['text_hash'],
+        'Rollups': ['RollupKey', 'Member'],
+        'UserTeams': ['UserId'],
+        'TurnRequests': ['request_key'],
+    }
+    # Secondary indexes partitioned like their table: table -> {index name: sort key}
+    INDEXES = {
+        'Rollups': {'LeaderboardRank': 'leaderboard_rank'},
+    }
+
+    def __init__(self, metrics, latency_ms=0, page_size_bytes=1024 * 1024):
+        self.metrics = metrics
+        self.latency_ms = latency_ms
+        self.page_size_bytes = page_size_bytes
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.client = FakeDynamoDBClient(self)
+        self.meta = _Meta(self.client)
+
+    def Table(self, name):
+        with self.lock:
+            if name not in self.tables:
+                self.tables[name] = FakeTable(name, self.KEY_SCHEMAS.get(name, ['id']), self)
+            return self.tables[name]
+
+
+# ---------------------------------------------------------------------------------------
+# SageMaker and Lambda
+# ---------------------------------------------------------------------------------------
+
+# SageMaker runtime stand-in. responder(prompt, parameters) returns (generated_text,
+# echo_prompt); latency is base_latency_ms plus per_token_ms for every generated word of the
+# longest output, plus per_input_word_ms for every word of the longest prompt (prefill), plus
+# per_prompt_ms for every extra prompt in a batched request. With
+# max_concurrency set, only that many requests run at once (the endpoint's instance slots)
+# and the rest queue, like an endpoint saturated by a burst of trainees. With max_queue set,
+# a request arriving while that many are already queued is rejected with a
+# ThrottlingException, the way SageMaker sheds load it cannot absorb.
+class FakeSageMakerRuntime:
+    def __init__(self, metrics, responder, base_latency_ms=0, per_token_ms=0, per_prompt_ms=0, max_concurrency=None,
+                 max_queue=None, per_input_word_ms=0):
+        self.metrics = metrics
+        self.responder = responder
+        self.base_latency_ms = base_latency_ms
+        self.per_token_ms = per_token_ms
+        self.per_prompt_ms = per_prompt_ms
+        self.per_input_word_ms = per_input_word_ms
+        self.slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.max_queue = max_queue
+        self.queued = 0
+        self.lock = threading.Lock()
+
+    def _generate(self, body):
+        self._check_throttle()
+        payload = json.loads(body)
+        inputs = payload["inputs"]
+        prompts = inputs if isinstance(inputs, list) else [inputs]
+        outputs = [self.responder(prompt, payload.get("parameters", {})) for prompt in prompts]
+        self.metrics.add("model_calls")
+        self.metrics.add("model_prompts", len(prompts))
+        self.metrics.add("model_input_words", sum(len(prompt.split()) for prompt in prompts))
+        return isinstance(inputs, list), prompts, outputs
+
+    def _check_throttle(self):
+        with self.lock:
+            throttled = self.max_queue is not None and self.queued >= self.max_queue
+        if throttled:
+            self.metrics.add("model_throttles")
+            simulate_latency(5)
+            raise ClientError(
+                {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'},
+                 'ResponseMetadata': {'HTTPStatusCode': 400}},
+                'InvokeEndpoint'
+            )
+
+    @contextlib.contextmanager
+    def _slot(self):
+        if self.slots is None:
+            yield
+            return
+        with self.lock:
+            self.queued += 1
+        try:
+            self.slots.acquire()
+        finally:
+            with self.lock:
+                self.queued -= 1
+        try:
+            yield
+        finally:
+            self.slots.release()
+
+    def invoke_endpoint(self, EndpointName, ContentType, Body, **kwargs):
+        batched, prompts, outputs = self._generate(Body)
+        tokens = max(len(text.split()) for text, _ in outputs)
+        prefill_ms = self.per_input_word_ms * max(len(prompt.split()) for prompt in prompts)
+        with self._slot():
+            simulate_latency(self.base_latency_ms + prefill_ms + self.per_token_ms * tokens + self.per_prompt_ms * (len(prompts) - 1))
+        results = [{"generated_text": (prompt + text) if echo else text} for prompt, (text, echo) in zip(prompts, outputs)]
+        return {'Body': io.BytesIO(json.dumps(results).encode('utf-8'))}
+
+    def invoke_endpoint_with_response_stream(self, EndpointName, ContentType, Body, **kwargs):
+        _, prompts, outputs = self._generate(Body)
+        text = outputs[0][0]
+        return {'Body': self._stream(text, self.per_input_word_ms * len(prompts[0].split()))}
+
+    def _stream(self, text, prefill_ms=0):
+        with self._slot():
+            simulate_latency(self.base_latency_ms + prefill_ms)
+            for token in re.findall(r"\s*\S+", text):
+                simulate_latency(self.per_token_ms)
+                line = "data:" + json.dumps({"token": {"text": token, "special": False}}) + "\n\n"
+                yield {'PayloadPart': {'Bytes': line.encode('utf-8')}}
+
+
+# S3 client stand-in keeping objects in memory
+class FakeS3Client:
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.metrics.add("s3_puts")
+        self.metrics.add("s3_bytes", len(Body))
+        self.objects[(Bucket, Key)] = dict(kwargs, Body=bytes(Body))
+        return {}
+
+
+# Lambda client stand-in that runs target handlers in-process after a simulated hop
+class FakeLambdaClient:
+    def __init__(self, metrics, handlers, hop_latency_ms=0):
+        self.metrics = metrics
+        self.handlers = handlers
+        self.hop_latency_ms = hop_latency_ms
+
+    def invoke(self, FunctionName, InvocationType, Payload, **kwargs):
+        self.metrics.add("lambda_invokes")
+        simulate_latency(self.hop_latency_ms)
+        result = self.handlers[FunctionName](json.loads(Payload), None)
+        return {'Payload': io.BytesIO(json.dumps(result).encode('utf-8'))}
+
+
+# Thread pool that charges work to the handler that submitted it. Each simulated trainee
+# stands for its own Lambda container, so the pool is sized for the benchmark concurrency
+# instead of the handler's per-container default.
+class AttributingExecutor:
+    def __init__(self, metrics, max_workers):
+        from concurrent.futures import ThreadPoolExecutor
+        self.metrics = metrics
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, fn, *args, **kwargs):
+        handler_name = getattr(self.metrics.local, 'handler', None)
+
+        def run():
+            self.metrics.set_handler(handler_name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.metrics.set_handler(None)
+        return self.executor.submit(run)
+
+
+# Wire the stand-ins into Aws_clients so every handler resolves them on first use
+def install(dynamodb, sagemaker_runtime, lambda_client):
+    import Aws_clients
+    import Model_gateway
+    import Model_guard
+    import Product_cache
+    import Sentiment_cache
+    Aws_clients._clients.clear()
+    Aws_clients._tables.clear()
+    Aws_clients._resources.clear()
+    Aws_clients._new_resource = lambda service_name: dynamodb
+    Aws_clients._clients[('dynamodb', None)] = dynamodb.client
+    Aws_clients._clients[('sagemaker-runtime', None)] = sagemaker_runtime
+    Aws_clients._clients[('lambda', None)] = lambda_client
+    Model_gateway._batcher = None
+    Model_guard.reset()
+    Product_cache.invalidate()
+    Sentiment_cache._entries.clear()
+    Sentiment_cache._stats.update(memory_hits=0, dynamodb_hits=0, misses=0)
@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Cold-start guard: imports every Lambda handler in a fresh interpreter and fails when it
+# loads more modules than its budget, or any heavy dependency. Handlers must not create AWS
+# clients or import boto3 at module level; Aws_clients does that lazily on first use, and
+# Sentiment_classifier loads numpy on first scoring. Module counts do not depend on the
+# machine, so they are the budget; the import time is reported and only fails at several
+# times what any handler takes today.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules each handler may load at import, its own and the standard library's included. About
+# a third above what they load in a fresh interpreter today, so a new standard module fits but
+# a new dependency tree does not.
+MODULE_BUDGETS = {
+    "Analyze_sentiment": 30,
+    "Check_progress": 25,
+    "Check_progress_bulk": 30,
+    "ContinueConversation": 80,
+    "Reset_progess": 20,
+    "StartConversation": 72,
+    "Team_dashboard": 25,
+    "Start_or_continue_conversation": 28,
+}
+# Import time that fails any handler
+IMPORT_TIME_CEILING_MS = 250
+
+# Heavy dependencies that must be loaded lazily
+FORBIDDEN_AT_IMPORT = ("boto3", "botocore", "numpy", "urllib3")
+
+MEASURE_SNIPPET = """
+import json, sys, time
+before = set(sys.modules)
+started_at = time.perf_counter()
+__import__({module!r})
+elapsed_ms = (time.perf_counter() - started_at) * 1000
+print(json.dumps({{"elapsed_ms": elapsed_ms, "modules": len(set(sys.modules) - before),
+                  "loaded": [m for m in {forbidden!r} if m in sys.modules]}}))
+"""
+
+# Helper function to import one module in a clean interpreter and report the time it took
+# and the modules it loaded
+def measure(module, runs):
+    samples = []
+    loaded = []
+    modules = 0
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", MEASURE_SNIPPET.format(module=module, forbidden=FORBIDDEN_AT_IMPORT)],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+            env=dict(os.environ, AWS_DEFAULT_REGION=os.environ.get("AWS_DEFAULT_REGION", "us-east-1"))
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        samples.append(result["elapsed_ms"])
+        loaded = result["loaded"]
+        modules = result["modules"]
+    samples.sort()
+    return samples[len(samples) // 2], modules, loaded
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the modules each handler loads at import against its budget.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per handler; the median is reported")
+    args = parser.parse_args()
+
+    failures = 0
+    for module, budget in MODULE_BUDGETS.items():
+        median_ms, modules, loaded = measure(module, args.runs)
+        ok = modules <= budget and median_ms <= IMPORT_TIME_CEILING_MS and not loaded
+        failures += 0 if ok else 1
+        note = f" (imports {', '.join(loaded)} eagerly)" if loaded else ""
+        print(f"{'ok  ' if ok else 'FAIL'} {module:<32} {modules:4d} modules / budget {budget}  {median_ms:7.1f} ms{note}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import fakes
+import workload
+
+# Offline benchmark: drives the real lambda_handler functions against in-memory DynamoDB,
+# a fake SageMaker endpoint and an in-process Lambda client, replaying scripted
+# negotiations for many simulated trainees. Reports latency percentiles, DynamoDB capacity
+# units and model/Lambda calls per handler so changes to the conversation flow can be
+# compared on the same workload.
+
+HANDLER_MODULES = {
+    "Start_or_continue_conversation": "Start_or_continue_conversation",
+    "StartConversation": "StartConversation",
+    "ContinueConversation": "ContinueConversation",
+    "Analyze_sentiment": "Analyze_sentiment",
+    "Check_progress": "Check_progress",
+    "Check_progress_bulk": "Check_progress_bulk",
+    "Team_dashboard": "Team_dashboard",
+    "Reset_progess": "Reset_progess",
+}
+
+# Lambda function names used by lambda_client.invoke in the handlers
+LAMBDA_FUNCTIONS = {
+    "analyze_sentiment": "Analyze_sentiment",
+    "StartConversation": "StartConversation",
+    "Continueconversation": "ContinueConversation",
+}
+
+
+# Helper function to read a percentile from a sorted list of samples
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+# One simulated deployment: fakes installed into Aws_clients, products seeded, and every
+# handler call timed and attributed
+class Harness:
+    def __init__(self, ddb_latency_ms=5, model_latency_ms=120, per_token_ms=2, lambda_hop_ms=20, page_size_bytes=1024 * 1024,
+                 per_prompt_ms=0, model_slots=None, model_max_queue=None, per_input_word_ms=0):
+        import importlib
+        self.modules = {name: importlib.import_module(module) for name, module in HANDLER_MODULES.items()}
+        self.metrics = fakes.Metrics()
+        self.dynamodb = fakes.FakeDynamoDB(self.metrics, latency_ms=ddb_latency_ms, page_size_bytes=page_size_bytes)
+        self.sagemaker = fakes.FakeSageMakerRuntime(self.metrics, workload.responder, model_latency_ms, per_token_ms, per_prompt_ms, model_slots,
+                                                  model_max_queue, per_input_word_ms)
+        self.lambda_client = fakes.FakeLambdaClient(
+            self.metrics,
+            {function: self.modules[name].lambda_handler for function, name in LAMBDA_FUNCTIONS.items()},
+            lambda_hop_ms
+        )
+        fakes.install(self.dynamodb, self.sagemaker, self.lambda_client)
+        products = self.dynamodb.Table('Products')
+        for product in workload.PRODUCTS:
+            products.items[(product["ProductId"],)] = fakes.normalize(product)
+        self.latencies = {}
+
+    # Invoke a handler the way API Gateway would and record its wall-clock latency
+    def call(self, handler_name, event):
+        self.metrics.set_handler(handler_name)
+        started_at = time.perf_counter()
+        result = self.modules[handler_name].lambda_handler(event, None)
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        self.metrics.add("calls")
+        if result.get("statusCode") != 200:
+            self.metrics.add("errors")
+        self.latencies.setdefault(handler_name, []).append(elapsed_ms)
+        self.metrics.set_handler(None)
+        return result
+
+    def report(self):
+        counters = self.metrics.snapshot()
+        rows = {}
+        for handler_name, samples in sorted(self.latencies.items()):
+            values = counters.get(handler_name, {})
+            calls = values.get("calls", len(samples))
+            rows[handler_name] = {
+                "calls": calls,
+                "p50_ms": round(percentile(samples, 50), 1),
+                "p95_ms": round(percentile(samples, 95), 1),
+                "p99_ms": round(percentile(samples, 99), 1),
+                "rcu_per_call": round(values.get("rcu", 0) / calls, 2),
+                "wcu_per_call": round(values.get("wcu", 0) / calls, 2),
+                "dynamodb_calls_per_call": round(values.get("dynamodb_calls", 0) / calls, 2),
+                "model_calls_per_call": round(values.get("model_calls", 0) / calls, 2),
+                "lambda_invokes_per_call": round(values.get("lambda_invokes", 0) / calls, 2),
+                "errors": values.get("errors", 0),
+            }
+            if "resumes" in values:
+                rows[handler_name]["resumes"] = values["resumes"]
+                rows[handler_name]["resume_misses"] = values.get("resume_misses", 0)
+        return rows
+
+
+# Helper function to unwrap the double-encoded body returned by Start_or_continue_conversation
+def session_from_start(result):
+    body = json.loads(result["body"])
+    if isinstance(body, dict) and "body" in body:
+        # The orchestrator reports a failed start with an inner status code and a plain-text body
+        if body.get("statusCode") != 200:
+            return None
+        body = json.loads(body["body"])
+    return body.get("session_id") if isinstance(body, dict) else None
+
+
+# Replay one scripted negotiation: start, several turns, then the dashboard check and a resume
+# with the progress it reported, like the app. A resume with progress that starts a new session
+# instead of returning the previous one (e.g. after a level-up) is counted as a resume miss.
+def run_negotiation(harness, user_index, turns):
+    user_id = f"trainee-{user_index:04d}"
+    product_id = workload.PRODUCTS[user_index % len(workload.PRODUCTS)]["ProductId"]
+    started = harness.call("Start_or_continue_conversation", {"body": json.dumps({"user_id": user_id, "product_id": product_id})})
+    session_id = session_from_start(started)
+    if not session_id:
+        return
+    for turn in range(turns):
+        line = workload.SALESPERSON_LINES[(user_index + turn) % len(workload.SALESPERSON_LINES)]
+        harness.call("ContinueConversation", {"body": json.dumps({"session_id": session_id, "user_input": line})})
+    progress = json.loads(harness.call("Check_progress", {"body": json.dumps({"user_id": user_id, "product_id": product_id})})["body"])
+    resumed = harness.call("Start_or_continue_conversation", {"body": json.dumps({
+        "user_id": user_id, "product_id": product_id,
+        "levels_passed": len(progress["levels_passed"]), "progress_percentage": progress["progress_percentage"]})})
+    if progress["progress_percentage"] > 0:
+        harness.metrics.set_handler("Start_or_continue_conversation")
+        harness.metrics.add("resumes")
+        # A resumed session answers with its id at the top of the body, a new one inside the wrapped start response
+        if json.loads(resumed["body"]).get("session_id") != session_id:
+            harness.metrics.add("resume_misses")
+        harness.metrics.set_handler(None)
+
+
+# Run the whole workload for one configuration and return the per-handler report
+def run_workload(users, turns, concurrency, configure=None, **harness_options):
+    harness = Harness(**harness_options)
+    import Concurrent_io
+    Concurrent_io._executor = fakes.AttributingExecutor(harness.metrics, 2 * concurrency)
+    if configure is not None:
+        configure(harness)
+    started_at = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(lambda index: run_negotiation(harness, index, turns), range(users)))
+    return {"wall_seconds": round(time.perf_counter() - started_at, 2), "handlers": harness.report()}
+
+
+def print_report(title, report):
+    print(f"== {title} (wall {report['wall_seconds']} s) ==")
+    print(f"{'handler':<32}{'calls':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'RCU':>7}{'WCU':>7}{'ddb':>6}{'model':>7}{'hops':>6}{'err':>5}")
+    for handler_name, row in report["handlers"].items():
+        print(f"{handler_name:<32}{row['calls']:>6}{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}"
+              f"{row['rcu_per_call']:>7}{row['wcu_per_call']:>7}{row['dynamodb_calls_per_call']:>6}"
+              f"{row['model_calls_per_call']:>7}{row['lambda_invokes_per_call']:>6}{row['errors']:>5}")
+    for handler_name, row in report["handlers"].items():
+        if "resumes" in row:
+            print(f"{handler_name}: {row['resume_misses']} of {row['resumes']} resumes with progress lost their session")
+    print()
+
+
+# Command-line options shared with the focused benchmarks
+def add_common_arguments(parser):
+    parser.add_argument("--users", type=int, default=20, help="Simulated trainees")
+    parser.add_argument("--turns", type=int, default=6, help="Salesperson messages per negotiation")
+    parser.add_argument("--concurrency", type=int, default=10, help="Trainees negotiating at the same time")
+    parser.add_argument("--ddb-latency-ms", type=float, default=5, help="Latency of every DynamoDB call")
+    parser.add_argument("--model-latency-ms", type=float, default=120, help="Base latency of every model call")
+    parser.add_argument("--per-token-ms", type=float, default=2, help="Extra model latency per generated word")
+    parser.add_argument("--lambda-hop-ms", type=float, default=20, help="Overhead of a Lambda-to-Lambda invoke")
+    parser.add_argument("--json", help="Also write the results to this file")
+
+
+def harness_options(args):
+    return {
+        "ddb_latency_ms": args.ddb_latency_ms,
+        "model_latency_ms": args.model_latency_ms,
+        "per_token_ms": args.per_token_ms,
+        "lambda_hop_ms": args.lambda_hop_ms,
+    }
+
+
+def write_json(path, results):
+    if path:
+        with open(path, "w") as handle:
+            json.dump(results, handle, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay scripted negotiations against local stand-ins.")
+    add_common_arguments(parser)
+    parser.add_argument("--sentiment-modes", nargs="+", default=["lambda", "inprocess", "combined"],
+                        help="ContinueConversation SENTIMENT_MODE values to compare")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.sentiment_modes:
+        def configure(harness, mode=mode):
+            handler = harness.modules["ContinueConversation"]
+            handler.SENTIMENT_MODE = mode
+        results[f"sentiment_mode={mode}"] = run_workload(args.users, args.turns, args.concurrency, configure, **harness_options(args))
+        print_report(f"sentiment mode: {mode}", results[f"sentiment_mode={mode}"])
+    write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
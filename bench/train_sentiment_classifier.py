@@ -0,0 +1,172 @@
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+import zlib
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+from eval_sentiment_rules import DEFAULT_EVAL_SET, score_bucket
+from Sentiment_classifier import CLASSIFIER_MIN_CONFIDENCE, analysis_from_output, train
+
+# Trains the in-process sentiment classifier (Sentiment_classifier.py) on scored turns and
+# compares it with the model path: agreement on convinced, mood and score range, how many
+# replies it is confident enough to answer, and the latency of one reply and of a batch.
+#
+# Training data is JSONL with {text, conviction_score, mood, convinced} (like
+# sentiment_eval.jsonl) or NDJSON parts of Export_transcripts, whose scores were produced by
+# the model path. With --train the model is evaluated on a held-out share of the replies;
+# without it, by cross-validation on the labeled eval set. The reference is the labels, or the
+# live SageMaker analyzer with --reference model (requires AWS credentials and the endpoint).
+# --out saves a model trained on all the replies for SENTIMENT_MODEL_PATH.
+
+
+# Replies and analyses from labeled JSONL or transcript export parts (.ndjson or .ndjson.gz);
+# openings, deferred turns and repeated replies are skipped
+def load_turns(paths):
+    texts, analyses, seen = [], [], set()
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as handle:
+            for line in handle:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                text = row.get("text", row.get("ai_response"))
+                if not text or row.get("conviction_score") is None or row.get("sentiment_pending"):
+                    continue
+                if text in seen:
+                    continue
+                seen.add(text)
+                texts.append(text)
+                analyses.append({"conviction_score": int(row["conviction_score"]), "mood": row["mood"], "convinced": bool(row["convinced"])})
+    return texts, analyses
+
+
+# Helper function to assign a reply to one of folds groups by a hash of its text, so the split
+# is the same on every run
+def fold_of(text, folds):
+    return zlib.crc32(text.lower().encode("utf-8")) % folds
+
+
+def percentile_us(samples_ns, fraction):
+    ordered = sorted(samples_ns)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] / 1000
+
+
+# Score the evaluation replies with a trained model, one at a time and as one batch
+def predict(model, texts):
+    single_ns = []
+    predictions = []
+    # The first call pays for numpy's lazy setup, which a warm container has done already
+    model.output(texts[0])
+    for text in texts:
+        started_at = time.perf_counter_ns()
+        predictions.append(analysis_from_output(model.output(text)))
+        single_ns.append(time.perf_counter_ns() - started_at)
+    started_at = time.perf_counter_ns()
+    model.outputs(texts)
+    batch_ns = time.perf_counter_ns() - started_at
+    return predictions, single_ns, batch_ns
+
+
+def agreement(predictions, references):
+    total = len(predictions)
+    confident = [(p, r) for p, r in zip(predictions, references) if p["confidence"] >= CLASSIFIER_MIN_CONFIDENCE]
+    row = {
+        "examples": total,
+        "convinced agreement": sum(p["convinced"] == r["convinced"] for p, r in zip(predictions, references)) / total,
+        "mood agreement": sum(p["mood"] == r["mood"] for p, r in zip(predictions, references)) / total,
+        "score range agreement": sum(score_bucket(p["conviction_score"]) == score_bucket(r["conviction_score"]) for p, r in zip(predictions, references)) / total,
+        "mean score error": sum(abs(p["conviction_score"] - r["conviction_score"]) for p, r in zip(predictions, references)) / total,
+        "false 'convinced'": sum(p["convinced"] and not r["convinced"] for p, r in zip(predictions, references)),
+        "confident": len(confident) / total,
+    }
+    if confident:
+        row["confident convinced agreement"] = sum(p["convinced"] == r["convinced"] for p, r in confident) / len(confident)
+        row["confident mood agreement"] = sum(p["mood"] == r["mood"] for p, r in confident) / len(confident)
+        row["confident false 'convinced'"] = sum(p["convinced"] and not r["convinced"] for p, r in confident)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train and evaluate the in-process sentiment classifier.")
+    parser.add_argument("--train", nargs="+", help="Labeled JSONL or transcript export NDJSON files (default: cross-validate on --eval-set)")
+    parser.add_argument("--eval-set", default=DEFAULT_EVAL_SET, help="Labeled JSONL used when --train is not given")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of --train replies kept for evaluation")
+    parser.add_argument("--folds", type=int, default=5, help="Cross-validation folds without --train")
+    parser.add_argument("--bits", type=int, default=12, help="Feature hash buckets are 2**bits")
+    parser.add_argument("--alpha", type=float, default=1.0, help="Ridge regularization")
+    parser.add_argument("--reference", choices=["labels", "model"], default="labels", help="What the classifier is compared against")
+    parser.add_argument("--out", help="Save a model trained on every reply to this .npz path")
+    parser.add_argument("--min-confident", type=float, default=0.05,
+                        help="Share of held-out replies that must reach CLASSIFIER_MIN_CONFIDENCE for --out to save the model")
+    args = parser.parse_args()
+
+    texts, analyses = load_turns(args.train or [args.eval_set])
+    if args.train:
+        folds = max(2, round(1 / args.holdout))
+        splits = [[index for index, text in enumerate(texts) if fold_of(text, folds) == 0]]
+    else:
+        folds = args.folds
+        splits = [[index for index, text in enumerate(texts) if fold_of(text, folds) == fold] for fold in range(folds)]
+
+    eval_indices, predictions, single_ns, batch_ns, train_seconds = [], [], [], 0, 0.0
+    for held_out in splits:
+        held = set(held_out)
+        kept = [index for index in range(len(texts)) if index not in held]
+        started_at = time.perf_counter()
+        model = train([texts[i] for i in kept], [analyses[i] for i in kept], args.bits, args.alpha)
+        train_seconds += time.perf_counter() - started_at
+        fold_predictions, fold_single_ns, fold_batch_ns = predict(model, [texts[i] for i in held_out])
+        eval_indices.extend(held_out)
+        predictions.extend(fold_predictions)
+        single_ns.extend(fold_single_ns)
+        batch_ns += fold_batch_ns
+
+    eval_texts = [texts[i] for i in eval_indices]
+    if args.reference == "model":
+        from Analyze_sentiment import analyze_with_model
+        references, model_ns = [], []
+        for text in eval_texts:
+            started_at = time.perf_counter_ns()
+            references.append(analyze_with_model(text))
+            model_ns.append(time.perf_counter_ns() - started_at)
+    else:
+        references, model_ns = [analyses[i] for i in eval_indices], []
+
+    print(f"training replies:              {len(texts)} ({'held-out share' if args.train else f'{folds}-fold cross-validation'})")
+    row = agreement(predictions, references)
+    for name, value in row.items():
+        if name == "mean score error":
+            value = f"{value:.1f} points"
+        elif isinstance(value, float):
+            value = f"{value:.0%}"
+        print(f"{name + ':':<31}{value}")
+    print(f"single reply latency p50/p99:  {percentile_us(single_ns, 0.5):.1f} / {percentile_us(single_ns, 0.99):.1f} us")
+    print(f"batch latency per reply:       {batch_ns / len(eval_texts) / 1000:.1f} us ({len(eval_texts)} replies)")
+    if model_ns:
+        print(f"model path latency p50/p99:    {percentile_us(model_ns, 0.5) / 1000:.1f} / {percentile_us(model_ns, 0.99) / 1000:.1f} ms")
+    print(f"training time:                 {train_seconds:.2f} s ({len(splits)} fits, 2**{args.bits} buckets)")
+
+    if args.out:
+        # A model whose predictions never reach the threshold answers nothing and only costs a
+        # numpy import; one that confidently calls a hesitant reply convinced passes levels wrongly
+        if row["confident"] <= 0 or row["confident"] < args.min_confident:
+            print(f"not saving {args.out}: {row['confident']:.0%} of held-out replies were confident "
+                  f"(--min-confident {args.min_confident:.0%}); train on more exported transcripts")
+            sys.exit(1)
+        false_convinced = row.get("confident false 'convinced'", 0)
+        if false_convinced:
+            print(f"not saving {args.out}: {false_convinced} confident predictions called a reply convinced that was not")
+            sys.exit(1)
+        train(texts, analyses, args.bits, args.alpha).save(args.out)
+        print(f"saved model trained on {len(texts)} replies to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
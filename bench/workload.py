@@ -0,0 +1,115 @@
+import hashlib
+import re
+
+# Scripted negotiation workload shared by the benchmarks: the sample products from the
+# README, salesperson lines to replay, and a deterministic fake model that answers like the
+# customer persona and the sentiment analyzer would.
+
+PERSONAS = [
+    {"Name": "Neha Banerjee", "PrimaryTrait": "Socially conscious", "Description": "Neha supports brands with a positive social impact."},
+    {"Name": "Ravi Patel", "PrimaryTrait": "Price-sensitive", "Description": "Ravi seeks the best deals."},
+    {"Name": "Sara Verma", "PrimaryTrait": "Impulse buyer", "Description": "Sara loves trends and frequently makes spontaneous purchases."},
+    {"Name": "Akshay Mehta", "PrimaryTrait": "Research-driven", "Description": "Akshay thoroughly researches products before buying."},
+]
+
+
+def _product(product_id, name, description, price, rotation):
+    levels = {}
+    for level in range(1, 5):
+        persona = PERSONAS[(level - 1 + rotation) % len(PERSONAS)]
+        levels[f"Level{level}"] = {"Description": f"Level {level} package of {name}.", "Persona": dict(persona)}
+    return {
+        "ProductId": product_id,
+        "ProductName": name,
+        "ProductDescription": description,
+        "Price": price,
+        "ProductLevels": levels,
+    }
+
+
+PRODUCTS = [
+    _product("TravelAgency", "ExploreWorld Package", "An all-inclusive travel package with accommodation, meals, and guided tours to scenic destinations.", 1200, 0),
+    _product("Smartphone", "TechPlus X5", "A smartphone with a 6.1-inch display, 128GB storage, and 4000mAh battery.", 399, 2),
+    _product("Sneakers", "StrideMax", "Durable and stylish sneakers with excellent arch support for daily wear.", 90, 1),
+]
+
+SALESPERSON_LINES = [
+    "Thanks for your interest! What matters most to you in a purchase like this?",
+    "It comes with a two-year warranty and free support, so you are covered if anything goes wrong.",
+    "Many of our customers in your situation chose the mid-tier option because it balances price and features really well, and it is our best-rated package this year.",
+    "We can offer a ten percent discount if you decide this week.",
+    "Our supplier partners follow fair-trade practices and we publish an annual impact report.",
+    "Compared with the leading competitor you get more features at a lower total cost.",
+    "Would you like me to walk you through the payment options?",
+    "I can send you the contract right now so you can review the details.",
+]
+
+CUSTOMER_LINES = [
+    "Can you tell me more about pricing?",
+    "That sounds interesting, but how does it compare to other options?",
+    "I'm not sure this is worth the money.",
+    "What kind of warranty do you offer?",
+    "Hmm, I need to think about it. Do you have any reviews I can read?",
+    "I like that. Is there a discount if I buy today?",
+    "That is good to hear. How long does delivery take?",
+    "Honestly this seems a bit expensive for what it offers, and I have seen cheaper alternatives online that look very similar.",
+    "Okay, that makes sense. What are the payment options?",
+    "That sounds great, I'll take it.",
+]
+
+OPENERS = [
+    "Hi, I came across {name} and I'm curious. What makes it a good fit for someone like me?",
+    "Hello! A friend mentioned {name}. Can you tell me what sets it apart?",
+    "Hi there, I've been looking at {name}. Is it really worth the price?",
+    "Good afternoon. I'm comparing a few options and {name} is on my list. What should I know?",
+    "Hey, quick question about {name}: who is it really made for?",
+    "Hi, I saw an ad for {name}. How is it different from what I already have?",
+    "Hello, I'm considering {name}, but I have a few doubts. Can you help?",
+    "Hi! What do most of your customers like about {name}?",
+    "Hi, I'm interested in {name}, though I'd like to understand the details first.",
+    "Hello there. Before I decide on anything, what's included with {name}?",
+]
+
+MOODS = ["Positive", "Neutral", "Skeptical", "Negative"]
+
+
+# Helper function for stable pseudo-random choices derived from text
+def stable_hash(text):
+    return int(hashlib.sha256(text.encode('utf-8')).hexdigest()[:12], 16)
+
+
+# Score a customer line the way the analyzer model might
+def assessment_for(customer_text):
+    if "take it" in customer_text.lower():
+        return 92, "Positive", True
+    value = stable_hash(customer_text)
+    score = 20 + value % 55
+    return score, MOODS[value % len(MOODS)], False
+
+
+def format_assessment(score, mood, convinced):
+    return f"Conviction Score: {score}\nMood: {mood}\nConvinced: {convinced}"
+
+
+# Deterministic fake model. Returns (generated_text, echo_prompt) where echo_prompt mimics
+# endpoints that return the prompt together with the completion.
+def responder(prompt, parameters):
+    if "analyzing a customer's response" in prompt:
+        match = re.search(r'Customer Response:\n"(.*)"', prompt, re.DOTALL)
+        return " " + format_assessment(*assessment_for(match.group(1) if match else "")), False
+    if "Start the conversation" in prompt:
+        product = re.search(r"The product, (.*?), offers", prompt)
+        name = product.group(1) if product else "the product"
+        # Sampled generations (a seed is given) vary the wording like a real model would
+        opener = OPENERS[parameters.get("seed", 0) % len(OPENERS)] if "seed" in parameters else OPENERS[0]
+        return " " + opener.format(name=name), True
+    # Customer reply: later turns are more likely to close, like a real negotiation
+    turns = prompt.count("Salesperson:")
+    value = stable_hash(prompt)
+    index = value % (len(CUSTOMER_LINES) - 1)
+    if turns >= 3 and value % 4 == 0:
+        index = len(CUSTOMER_LINES) - 1
+    reply = " " + CUSTOMER_LINES[index]
+    if "assess your own interest" in prompt:
+        reply += "\n" + format_assessment(*assessment_for(reply))
+    return reply, False